@@ -0,0 +1,224 @@
+"""Throughput, latency and memory benchmarks of the acquisition engine against a mock daemon."""
+
+import argparse
+import functools
+import sys
+import threading
+import time
+import tracemalloc
+
+import numpy as np  # type: ignore
+
+import picotech_chart_mock
+from picotech_chart_engine import Engine, Gate, GateSet, RingBuffer
+from picotech_chart_mock import MockClient
+
+
+def percentiles(values):
+    if not len(values):
+        return "n/a"
+    p50, p95 = np.percentile(values, [50, 95]) * 1000
+    return f"median {p50:.1f} ms, p95 {p95:.1f} ms"
+
+
+def make_engine(port, daemon_kwargs):
+    factory = functools.partial(MockClient, **daemon_kwargs)
+    return Engine(port, client_factory=factory).connect()
+
+
+def make_gates(engine):
+    stop = min(5, engine.nsamples)
+    gates = [Gate(f"{key} signal", key, min(1, stop - 1), stop) for key in engine.channel_keys]
+    return GateSet(gates, engine.channel_keys, engine.nsamples)
+
+
+def bench_acquire(engine, nchunks, singleshot=False):
+    """
+    Average nchunks measurements, from every shot in single shot mode.
+
+    Reports chunks/sec against the daemon's own measurement rate, daemon
+    calls per chunk, measurements the engine never saw, and the delay from
+    a measurement finishing to the engine handing it to its callback.
+    """
+    daemon = engine.client.daemon
+    latencies = []
+    ids = []
+
+    def callback(traces, stats):
+        ids.append(engine.watcher.measurement_id)
+        latencies.append(time.time() - daemon.created[ids[-1]])
+
+    calls = sum(daemon.calls.values())
+    began = time.perf_counter()
+    result = engine.acquire(nchunks, singleshot, callback=callback)
+    seconds = time.perf_counter() - began
+    calls = sum(daemon.calls.values()) - calls
+    return {
+        "chunks": result["count"],
+        "chunks/sec": result["count"] / seconds,
+        "daemon measurements/sec": 1 / daemon.period,
+        "calls/chunk": calls / max(result["count"], 1),
+        "measurements skipped": (ids[-1] - ids[0] + 1 - len(ids)) if ids else 0,
+        "measurement to engine": percentiles(latencies),
+    }
+
+
+def bench_chart(engine, seconds, nchunks, retention):
+    """
+    Chart for seconds into a RingBuffer like the GUI does.
+
+    Memory is traced after the first point, so the reported growth is what
+    a long run keeps accumulating once buffers have been allocated.  The
+    mock daemon's own allocations are not counted.
+    """
+    gates = make_gates(engine)
+    history = RingBuffer(retention, shape=(len(gates),))
+    times = RingBuffer(retention)
+    points = engine.chart(nchunks, gates)
+    count = 0
+    began = time.perf_counter()
+    try:
+        for elapsed, values, stats in points:
+            times.append(elapsed)
+            history.append(values)
+            count += 1
+            if count == 1:
+                tracemalloc.start()
+                start_snapshot = tracemalloc.take_snapshot()
+            if time.perf_counter() - began >= seconds:
+                break
+    finally:
+        points.close()
+    duration = time.perf_counter() - began
+    growth = 0
+    if count > 1:
+        ignore = [
+            tracemalloc.Filter(False, picotech_chart_mock.__file__),
+            tracemalloc.Filter(False, tracemalloc.__file__),
+        ]
+        start_snapshot = start_snapshot.filter_traces(ignore)
+        end_snapshot = tracemalloc.take_snapshot().filter_traces(ignore)
+        growth = sum(stat.size_diff for stat in end_snapshot.compare_to(start_snapshot, "filename"))
+    tracemalloc.stop()
+    return {
+        "points": count,
+        "points/sec": count / duration,
+        "memory growth": f"{growth / 1024:.1f} KiB ({growth / max(count - 1, 1):.0f} B/point)",
+    }
+
+
+def bench_gui(engine, nchunks):
+    """
+    Measurement to pixel: the engine's chunks are sent through a queued Qt
+    signal to a Plot1D, drawn by a render timer as in the GUI, and timed
+    once the frame holding them has been painted.
+    """
+    from qtpy import QtCore, QtWidgets  # type: ignore
+    from picotech_chart_gui import Plot1D
+
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    daemon = engine.client.daemon
+
+    class Relay(QtCore.QObject):
+        chunk = QtCore.Signal(object, int)
+
+    relay = Relay()
+    plot = Plot1D(yAutoRange=False)
+    curves = [plot.add_curve() for key in engine.channel_keys]
+    plot.resize(800, 600)
+    plot.show()
+    waiting = []  # measurement ids queued but not yet painted
+    latencies = []
+    frames = []
+
+    def on_chunk(traces, measurement_id):
+        for curve, trace in zip(curves, traces):
+            plot.set_data(curve, engine.sample_time, trace)
+        waiting.append(measurement_id)
+
+    def render():
+        drawn = plot.last_render
+        plot.render()
+        if plot.last_render != drawn:
+            plot.viewport().repaint()
+            now = time.time()
+            frames.append(now)
+            latencies.extend(now - daemon.created[i] for i in waiting if i in daemon.created)
+            waiting.clear()
+
+    relay.chunk.connect(on_chunk)
+    timer = QtCore.QTimer()
+    timer.timeout.connect(render)
+    timer.start(20)
+    callback = lambda traces, stats: relay.chunk.emit(traces, engine.watcher.measurement_id)
+    thread = threading.Thread(target=engine.acquire, args=(nchunks,), kwargs={"callback": callback})
+    began = time.perf_counter()
+    thread.start()
+    while thread.is_alive():
+        app.processEvents()
+        time.sleep(0.001)
+    for _ in range(10):  # let the last frame be drawn
+        app.processEvents()
+        time.sleep(0.02)
+    timer.stop()
+    plot.close()
+    seconds = time.perf_counter() - began
+    return {
+        "chunks/sec": nchunks / seconds,
+        "frames/sec": len(frames) / seconds,
+        "measurement to pixel": percentiles(latencies),
+    }
+
+
+def report(name, results):
+    print(name)
+    for key, value in results.items():
+        if isinstance(value, float):
+            value = f"{value:.1f}"
+        print(f"  {key}: {value}")
+
+
+def main(argv=None):
+    """Benchmark acquisition against a mock picotech daemon: ``python -m picotech_chart_benchmark``."""
+    parser = argparse.ArgumentParser(prog="picotech_chart_benchmark", description=main.__doc__)
+    parser.add_argument("--shot-rate", type=float, default=10000.0, help="simulated shots per second")
+    parser.add_argument("--nshots", type=int, default=100)
+    parser.add_argument("--nsamples", type=int, default=200)
+    parser.add_argument("--channels", default="AB")
+    parser.add_argument("--noise", type=float, default=0.05, help="volts rms per shot")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per daemon call")
+    parser.add_argument("--dead-time", type=float, default=0.0, help="seconds per measurement besides its shots")
+    parser.add_argument("--chunks", type=int, default=200, help="chunks for the acquire and gui benchmarks")
+    parser.add_argument("--chart-seconds", type=float, default=10.0, help="length of the chart run")
+    parser.add_argument("--chart-chunks", type=int, default=1, help="chunks per chart point")
+    parser.add_argument("--retention", type=int, default=100000, help="chart history, as in the GUI")
+    parser.add_argument("--singleshot", action="store_true", help="acquire from every shot instead of the mean")
+    parser.add_argument("--gui", action="store_true", help="also time measurement to pixel (needs Qt)")
+    parser.add_argument("--timers", action="store_true", help="print the engine's per-step timers after each run")
+    args = parser.parse_args(argv)
+
+    daemon_kwargs = {
+        "shot_rate": args.shot_rate,
+        "nshots": args.nshots,
+        "nsamples": args.nsamples,
+        "channels": args.channels,
+        "noise": args.noise,
+        "latency": args.latency,
+        "dead_time": args.dead_time,
+    }
+    print(f"mock daemon: {daemon_kwargs}")
+    runs = [
+        ("acquire", lambda engine: bench_acquire(engine, args.chunks, args.singleshot)),
+        ("chart", lambda engine: bench_chart(engine, args.chart_seconds, args.chart_chunks, args.retention)),
+    ]
+    if args.gui:
+        runs.append(("gui", lambda engine: bench_gui(engine, args.chunks)))
+    for port, (name, run) in enumerate(runs):
+        engine = make_engine(port, daemon_kwargs)
+        report(name, run(engine))
+        if args.timers:
+            print(engine.instrumentation.format())
+
+
+if __name__ == "__main__":
+    sys.exit(main())
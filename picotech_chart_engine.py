@@ -0,0 +1,2303 @@
+"""GUI-free acquisition engine for yaqd-picotech: averaging, gating, charting and recording."""
+
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import contextlib
+import copy
+import functools
+import json
+import os
+import pathlib
+import sys
+import threading
+import time
+
+import numpy as np  # type: ignore
+import toml
+import yaqc  # type: ignore
+
+from picotech_processing import Gate, GateSet, reject_outliers
+
+
+class Instrumentation:
+    """
+    Timers and counters for the acquisition hot path.
+
+    Timers keep their total count and the most recent ``window`` durations,
+    from which summary() reports mean, median, 95th percentile and max.
+    Counters only count.  Both are safe to update from any thread, so the
+    engine thread and the GUI thread can share one Instrumentation.
+    """
+
+    def __init__(self, window=1000):
+        self.window = window
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.timers = {}  # name -> [total count, RingBuffer of recent seconds]
+            self.counters = collections.Counter()
+            self.since = time.time()
+
+    @contextlib.contextmanager
+    def time(self, name):
+        began = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - began)
+
+    def record(self, name, seconds):
+        with self.lock:
+            if name not in self.timers:
+                self.timers[name] = [0, RingBuffer(self.window)]
+            timer = self.timers[name]
+            timer[0] += 1
+            timer[1].append(seconds)
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] += n
+
+    def summary(self):
+        """
+        Returns
+        -------
+        dict
+            "seconds" since reset, "timers" (name -> count and mean, p50,
+            p95, max in ms over the recent window) and "counters".
+        """
+        with self.lock:
+            timers = {name: (count, recent.view().copy()) for name, (count, recent) in self.timers.items()}
+            counters = dict(self.counters)
+            since = self.since
+        out = {}
+        for name, (count, recent) in sorted(timers.items()):
+            p50, p95 = np.percentile(recent, [50, 95]) * 1000
+            out[name] = {
+                "count": count,
+                "mean": float(recent.mean() * 1000),
+                "p50": float(p50),
+                "p95": float(p95),
+                "max": float(recent.max() * 1000),
+            }
+        return {"seconds": time.time() - since, "timers": out, "counters": counters}
+
+    def format(self):
+        summary = self.summary()
+        lines = [f"{'timer':<28}{'count':>8}{'mean':>9}{'p50':>9}{'p95':>9}{'max':>9}  (ms)"]
+        for name, timer in summary["timers"].items():
+            lines.append(
+                f"{name:<28}{timer['count']:>8}"
+                + "".join(f"{timer[key]:>9.2f}" for key in ("mean", "p50", "p95", "max"))
+            )
+        lines.append("")
+        for name, value in sorted(summary["counters"].items()):
+            lines.append(f"{name:<28}{value:>8}")
+        return "\n".join(lines)
+
+
+class InstrumentedClient:
+    """Wrap a yaqc.Client so every daemon call is timed as ``rpc <message>``."""
+
+    def __init__(self, client, instrumentation):
+        self._client = client
+        self._instrumentation = instrumentation
+        self._protocol = client._protocol
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        if name.startswith("_") or not callable(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            with self._instrumentation.time(f"rpc {name}"):
+                return attribute(*args, **kwargs)
+
+        return call
+
+
+class MetricsLog:
+    """Append Instrumentation summaries to a JSON lines file at most every interval seconds."""
+
+    def __init__(self, path, instrumentation, interval=1.0):
+        self.path = pathlib.Path(path)
+        self.instrumentation = instrumentation
+        self.interval = interval  # sec
+        self.last = 0.0
+        self.file = open(self.path, "a")
+
+    def write(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.last < self.interval:
+            return
+        self.last = now
+        record = {"time": time.time(), **self.instrumentation.summary()}
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.write(force=True)
+        self.file.close()
+
+
+class MeasurementWatcher:
+    """
+    Wait for new daemon measurements with one get_measured call per poll.
+
+    The full reply (measurement_id and every channel array) is handed back,
+    so callers never need a second round-trip.  The watcher keeps a running
+    estimate of the measurement period and sleeps until shortly before the
+    next measurement is due, then polls with a geometrically growing interval.
+    Gaps in measurement_id between arrivals are counted as skipped.
+    """
+
+    def __init__(
+        self,
+        client,
+        min_interval=0.002,
+        max_interval=0.5,
+        lead=0.8,
+        backoff=1.5,
+        smoothing=0.2,
+        instrumentation=None,
+    ):
+        self.client = client
+        self.instrumentation = instrumentation
+        self.min_interval = min_interval  # sec
+        self.max_interval = max_interval  # sec
+        self.lead = lead  # fraction of the period to sleep before polling
+        self.backoff = backoff
+        self.smoothing = smoothing
+        self.period = None  # sec per measurement
+        self.polls = 0
+        self.skipped = 0  # measurements that arrived and were replaced between two polls
+        self.arrival_time = None
+        self.reset()
+
+    def reset(self):
+        """Forget the last seen measurement. The next wait returns the first new one."""
+        self.measurement_id = None
+        self.last_arrival = None
+
+    def wait(self, stop_event=None, min_id=None, count_gap=True, ids_only=False):
+        """
+        Block until a measurement newer than the last seen one arrives.
+
+        With min_id, keep waiting until a measurement with at least that id
+        arrives; the measurements before it are passed over on purpose and
+        not counted as skipped.  count_gap=False likewise ignores any gap
+        since the last seen measurement, for callers that paused on purpose.
+        ids_only polls get_measurement_id instead of get_measured, for
+        callers that fetch the measurement some other way.
+
+        Returns
+        -------
+        dict or None
+            The get_measured reply (only "measurement_id" with ids_only), or
+            None if stop_event was set.
+        """
+        if self.measurement_id is None:
+            self.measurement_id = self.poll(ids_only)["measurement_id"]
+        while True:
+            ahead = 1 if min_id is None else max(min_id - self.measurement_id, 1)
+            measured = self._wait_next(stop_event, ahead, min_id, count_gap, ids_only)
+            if measured is None or min_id is None or measured["measurement_id"] >= min_id:
+                return measured
+
+    def _wait_next(self, stop_event, ahead, min_id, count_gap, ids_only):
+        # sleep until shortly before the measurement ahead of the last one is due, then poll
+        if self.period is not None and self.last_arrival is not None:
+            remaining = self.last_arrival + (ahead - 1 + self.lead) * self.period - time.monotonic()
+            if remaining > 0 and self._sleep(remaining, stop_event):
+                return None
+        interval = self.min_interval
+        while True:
+            measured = self.poll(ids_only)
+            if measured["measurement_id"] != self.measurement_id:
+                self._arrived(measured["measurement_id"], min_id, count_gap)
+                return measured
+            if self._sleep(interval, stop_event):
+                return None
+            ceiling = self.max_interval
+            if self.period is not None:
+                ceiling = min(ceiling, self.period / 4)
+            interval = max(min(interval * self.backoff, ceiling), self.min_interval)
+
+    def poll(self, ids_only=False):
+        self.polls += 1
+        if ids_only:
+            return {"measurement_id": self.client.get_measurement_id()}
+        return self.client.get_measured()
+
+    def _arrived(self, measurement_id, min_id=None, count_gap=True):
+        now = time.monotonic()
+        self.arrival_time = time.time()  # wall clock, for measurements without a daemon timestamp
+        wanted = self.measurement_id if min_id is None else max(self.measurement_id, min_id - 1)
+        skipped = max(measurement_id - wanted - 1, 0) if count_gap else 0
+        self.skipped += skipped
+        if self.instrumentation is not None:
+            self.instrumentation.count("measurements")
+            if skipped:
+                self.instrumentation.count("measurements skipped", skipped)
+        if self.last_arrival is not None:
+            steps = max(measurement_id - self.measurement_id, 1)
+            period = (now - self.last_arrival) / steps
+            if self.period is None:
+                self.period = period
+            else:
+                self.period += self.smoothing * (period - self.period)
+        self.last_arrival = now
+        self.measurement_id = measurement_id
+
+    def _sleep(self, seconds, stop_event):
+        # returns True if stopped
+        if stop_event is None:
+            time.sleep(seconds)
+            return False
+        return stop_event.wait(seconds)
+
+
+class RingBuffer:
+    """
+    Preallocated NumPy ring buffer with O(1) append and a zero-copy view.
+
+    Every item is written twice, at i and i + capacity, so the newest
+    ``len(self)`` items are always one contiguous slice of the storage.
+    Storage starts small and doubles until it reaches maxlen; after that
+    the oldest items are overwritten.  With a path the storage is a
+    np.memmap of the full maxlen, so long histories live on disk.
+    """
+
+    def __init__(self, maxlen, shape=(), dtype=float, initial=1024, path=None):
+        self.maxlen = int(maxlen)
+        self.shape = tuple(shape)
+        self.dtype = dtype
+        self.path = path
+        self.capacity = max(1, min(int(initial), self.maxlen))
+        if path is not None:
+            self.capacity = max(1, self.maxlen)
+        self.data = self._allocate(self.capacity)
+        self.start = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, item):
+        if self.size == self.capacity and self.capacity < self.maxlen:
+            self._reallocate(min(2 * self.capacity, self.maxlen))
+        if self.size < self.capacity:
+            index = self.start + self.size
+            self.size += 1
+        else:
+            index = self.start
+            self.start = (self.start + 1) % self.capacity
+        index %= self.capacity
+        self.data[index] = item
+        self.data[index + self.capacity] = item
+
+    def extend(self, items):
+        """Append a batch of items along the first axis, with at most two slice writes per half."""
+        items = items[len(items) - self.maxlen :] if len(items) > self.maxlen else items
+        count = len(items)
+        while self.size + count > self.capacity and self.capacity < self.maxlen:
+            self._reallocate(min(2 * self.capacity, self.maxlen))
+        index = (self.start + self.size) % self.capacity
+        first = min(count, self.capacity - index)
+        for index, chunk in ((index, items[:first]), (0, items[first:])):
+            stop = index + len(chunk)
+            self.data[index:stop] = chunk
+            self.data[index + self.capacity : stop + self.capacity] = chunk
+        overflow = max(self.size + count - self.capacity, 0)
+        self.start = (self.start + overflow) % self.capacity
+        self.size = min(self.size + count, self.capacity)
+
+    def clear(self):
+        self.start = 0
+        self.size = 0
+
+    def resize(self, maxlen):
+        """Change the retention window, keeping the newest items."""
+        self.maxlen = int(maxlen)
+        if self.capacity > self.maxlen or self.size > self.maxlen:
+            self._reallocate(self.maxlen)
+
+    def view(self):
+        """
+        Oldest-to-newest items without copying.
+
+        The returned array shares memory with the buffer, so it is only
+        guaranteed to be consistent until the next append.
+        """
+        return self.data[self.start : self.start + self.size]
+
+    def _reallocate(self, capacity):
+        capacity = max(1, capacity)
+        kept = np.array(self.view()[-capacity:])
+        self.capacity = capacity
+        data = self._allocate(capacity)
+        data[: len(kept)] = kept
+        data[self.capacity : self.capacity + len(kept)] = kept
+        self.data = data
+        self.start = 0
+        self.size = len(kept)
+
+    def _allocate(self, capacity):
+        shape = (2 * capacity,) + self.shape
+        if self.path is None:
+            return np.empty(shape, dtype=self.dtype)
+        return np.lib.format.open_memmap(self.path, mode="w+", dtype=self.dtype, shape=shape)
+
+
+class NpyAppender:
+    """
+    Append records to a .npy file as they arrive.
+
+    The header is padded to a fixed size and rewritten after every append,
+    so the file on disk is always a valid array that np.load can open
+    (use mmap_mode="r" for long runs).  A crash loses at most the record
+    being written.
+    """
+
+    def __init__(self, path, dtype):
+        self.path = pathlib.Path(path)
+        self.dtype = np.dtype(dtype)
+        self.length = 0
+        self.descr = np.lib.format.dtype_to_descr(self.dtype)
+        # leave room for a 20 digit record count, round up to numpy's 64 byte alignment
+        widest = self._header_dict(10**20)
+        self.header_size = -(-(len(widest) + 12) // 64) * 64
+        self.file = open(self.path, "wb")
+        self._write_header()
+
+    def _header_dict(self, length):
+        return repr({"descr": self.descr, "fortran_order": False, "shape": (length,)})
+
+    def _write_header(self):
+        header = self._header_dict(self.length).encode("latin1")
+        header = header.ljust(self.header_size - 11) + b"\n"
+        self.file.seek(0)
+        self.file.write(b"\x93NUMPY\x01\x00")
+        self.file.write(np.uint16(len(header)).tobytes())
+        self.file.write(header)
+
+    def append(self, record):
+        """Write one record (a tuple matching dtype) and update the header."""
+        self.file.seek(0, 2)
+        self.file.write(np.array(record, dtype=self.dtype).tobytes())
+        self.length += 1
+        self._write_header()
+        self.file.flush()
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+
+class Recorder:
+    """
+    Stream shots and chart data to timestamped binary files.
+
+    Each recording writes ``<stem>_shots.npy`` (one record per chunk),
+    ``<stem>_chart.npy`` (one record per chart point) and ``<stem>.toml``
+    holding the scope settings needed to interpret them.  Times are
+    wall-clock; a chart's ``origin`` is the time its chart times count from.
+    nshots and range changes made while recording are listed under
+    ``changes`` in the .toml, each with the index of the first chunk
+    recorded after it.
+    """
+
+    def __init__(
+        self, directory, port, config, nshots, sample_time, channel_keys, gates=None, t0=None, origin=None
+    ):
+        self.directory = pathlib.Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.stem = f"picotech_{port}_{time.strftime('%Y%m%d_%H%M%S')}"
+        self.nsamples = len(sample_time)
+        self.nchannels = len(channel_keys)
+        self.shots = None
+        self.chart = None
+        self.metadata = {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "port": port,
+            "nshots": nshots,
+            "recorded_channels": list(channel_keys),
+            "timebase": config.get("timebase"),
+            "max_samples": config.get("max_samples"),
+            "oversample": config.get("oversample"),
+            "channels": copy.deepcopy(config.get("channels", {})),  # as at the start; later changes are logged
+            "sample_time": [float(t) for t in sample_time],
+        }
+        if gates is not None:
+            self.metadata["gates"] = [gate.to_dict() for gate in gates.gates]
+        if t0 is not None:
+            # wall-clock origin of the chart time axis, shared by every scope in one session
+            self.metadata["t0"] = t0
+        if origin is not None:
+            self.metadata["origin"] = origin
+        self.write_metadata()
+
+    def write_metadata(self):
+        path = self.directory / f"{self.stem}.toml"
+        temporary = path.with_name(path.name + ".tmp")
+        with open(temporary, "w") as f:
+            toml.dump(self.metadata, f)
+        os.replace(temporary, path)
+
+    def record_change(self, nshots=None, ranges=None):
+        """Note a new nshots, or new ranges (channel key -> range name), for the chunks recorded from now on."""
+        change = {"chunk": 0 if self.shots is None else self.shots.length}
+        if nshots is not None:
+            change["nshots"] = int(nshots)
+        if ranges:
+            change["ranges"] = dict(ranges)
+        self.metadata.setdefault("changes", []).append(change)
+        self.write_metadata()
+
+    def record_shots(self, timestamp, measurement_id, traces):
+        if self.shots is None:
+            shape = (self.nchannels, self.nsamples)
+            dtype = [("time", "f8"), ("measurement_id", "i8"), ("traces", "f8", shape)]
+            self.shots = NpyAppender(self.directory / f"{self.stem}_shots.npy", dtype)
+        self.shots.append((timestamp, measurement_id, traces))
+
+    def record_chart(self, timestamp, values):
+        if self.chart is None:
+            dtype = [("time", "f8"), ("values", "f8", (len(values),))]
+            self.chart = NpyAppender(self.directory / f"{self.stem}_chart.npy", dtype)
+        self.chart.append((timestamp, values))
+
+    def close(self):
+        for appender in (self.shots, self.chart):
+            if appender is not None:
+                appender.close()
+
+
+class Checkpoint:
+    """
+    Periodic on-disk snapshot of a chart session, to resume it after a crash.
+
+    The chart history (times and gate values) is kept here as the chart
+    runs; every interval seconds it is written to one .npz file together
+    with the gates, the chart settings and origin, and the latest averaging
+    state.  Writes go to a temporary file that then replaces the previous
+    checkpoint, so a crash mid-write never leaves a torn file.
+    """
+
+    def __init__(self, path, interval=10.0, retention=100000):
+        self.path = pathlib.Path(path)
+        self.interval = interval  # sec
+        self.retention = retention  # points
+        self.times = RingBuffer(retention)
+        self.values = RingBuffer(retention, shape=(0,))
+        self.settings = {}
+        self.stats = None
+        self.last_write = None
+
+    def begin(self, gates, origin, settings, resume=False):
+        """
+        Start recording a chart, returning its time origin.
+
+        With resume, a checkpoint on disk with the same gate names and
+        lock-in settings (settings["demodulator"]) is continued: its
+        history is kept and its origin returned, so the time axis carries
+        on where it stopped.  A lock-in chart is never continued as a
+        plain one or the other way round.
+        """
+        state = self.load(self.path) if resume and self.path.exists() else None
+        names = [gate.name for gate in gates.gates]
+        if state is not None and not self.matches(state, names, settings.get("demodulator")):
+            print(f"checkpoint {self.path} is of another chart (gates or lock-in), starting anew", file=sys.stderr)
+            state = None
+        if state is not None:
+            origin = state["origin"]
+            self.times = RingBuffer(self.retention)
+            self.times.extend(state["times"])
+            self.values = RingBuffer(self.retention, shape=(len(names),))
+            self.values.extend(state["values"])
+        else:
+            self.times.clear()
+            self.values = RingBuffer(self.retention, shape=(len(names),))
+        self.settings = dict(settings, origin=origin, gates=[gate.to_dict() for gate in gates.gates])
+        self.last_write = time.monotonic()
+        return origin
+
+    @staticmethod
+    def matches(state, names, demodulator=None):
+        """Whether a loaded checkpoint is of a chart of these gate names and Demodulator.to_dict settings."""
+        return [gate["name"] for gate in state.get("gates", [])] == names and state.get("demodulator") == demodulator
+
+    def add(self, elapsed, values, stats):
+        """Add a chart point and write the checkpoint if one is due."""
+        self.times.append(elapsed)
+        self.values.append(values)
+        self.update(stats)
+
+    def update(self, stats):
+        """Note the latest averaging state and write the checkpoint if one is due."""
+        self.stats = stats
+        if self.last_write is None or time.monotonic() - self.last_write >= self.interval:
+            self.write()
+
+    def write(self):
+        arrays = {"times": self.times.view(), "values": self.values.view()}
+        if self.stats is not None:
+            arrays.update({f"stats_{key}": value for key, value in self.stats.snapshot().items() if key != "rejected"})
+        settings = dict(self.settings, saved=time.time())
+        temporary = self.path.with_name(self.path.name + ".tmp")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(temporary, "wb") as f:
+            np.savez(f, settings=json.dumps(settings), **arrays)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.path)
+        self.last_write = time.monotonic()
+
+    @staticmethod
+    def load(path):
+        """
+        Read a checkpoint.
+
+        Returns
+        -------
+        dict
+            The chart settings ("origin", "gates" as dicts, "nchunks",
+            "singleshot", "schedule", "demodulator" as a dict or None,
+            ...), "times" and "values" of the history, and "stats", the
+            last averaging snapshot or None.
+        """
+        with np.load(path) as data:
+            state = json.loads(str(data["settings"]))
+            state["times"] = data["times"]
+            state["values"] = data["values"]
+            stats = {key[len("stats_") :]: data[key] for key in data.files if key.startswith("stats_")}
+        if stats:
+            stats["count"] = int(stats["count"])
+        state["stats"] = stats or None
+        return state
+
+
+class Waterfall:
+    """
+    Averaged traces of every chart point, for trace-vs-time views.
+
+    Traces are kept in a RingBuffer shaped (point, channel, sample), as
+    float32 and memory-mapped to path when one is given, next to the chart
+    times of the points.  ``appended`` counts every trace ever added, so a
+    viewer can tell how many rows are new since it last looked.  recompute
+    gates the whole history after the fact, e.g. after moving a gate, and
+    save and load keep it as one .npz file.
+    """
+
+    def __init__(self, maxlen, channel_keys, sample_time, path=None):
+        self.channel_keys = list(channel_keys)
+        self.sample_time = np.asarray(sample_time, dtype=float)
+        self.path = path
+        shape = (len(self.channel_keys), len(self.sample_time))
+        self.times = RingBuffer(maxlen)
+        self.traces = RingBuffer(maxlen, shape=shape, dtype=np.float32, path=path)
+        self.appended = 0
+
+    def __len__(self):
+        return len(self.times)
+
+    def append(self, elapsed, traces):
+        self.times.append(elapsed)
+        self.traces.append(traces)
+        self.appended += 1
+
+    def extend(self, times, traces):
+        self.times.extend(times)
+        self.traces.extend(traces)
+        self.appended += len(times)
+
+    def clear(self):
+        self.times.clear()
+        self.traces.clear()
+
+    def recompute(self, gates, block=1024):
+        """
+        Gate values of every stored trace, shape (point, gate).
+
+        The history is gated block points at a time, so a memory-mapped
+        one is read from disk in pieces rather than all at once.
+        """
+        traces = self.traces.view()
+        values = np.empty((len(traces), len(gates)))
+        for start in range(0, len(traces), block):
+            values[start : start + block] = gates.compute(traces[start : start + block])
+        return values
+
+    def save(self, path):
+        np.savez(
+            path,
+            times=self.times.view(),
+            traces=self.traces.view(),
+            channel_keys=np.array(self.channel_keys),
+            sample_time=self.sample_time,
+        )
+
+    @classmethod
+    def load(cls, path):
+        """Read a saved waterfall, holding exactly the points saved."""
+        with np.load(path) as data:
+            waterfall = cls(max(len(data["times"]), 1), data["channel_keys"].tolist(), data["sample_time"])
+            waterfall.extend(data["times"], data["traces"])
+        return waterfall
+
+
+class RunningStats:
+    """
+    Per-sample mean, spread and extrema over chunks (Welford's algorithm).
+
+    Updates are made in place on preallocated arrays, so adding a chunk
+    does not allocate and no chunk is kept after it is added, unless keep
+    asks for the last chunks to be kept for a median.  Chunks turned away
+    by a Rejector are counted per reason in ``rejected``.
+    """
+
+    def __init__(self, shape, keep=0):
+        self.shape = tuple(shape)
+        self.kept = RingBuffer(keep, shape=self.shape) if keep else None
+        self.rejected = collections.Counter()
+        self.mean = np.zeros(self.shape)
+        self.m2 = np.zeros(self.shape)
+        self.min = np.empty(self.shape)
+        self.max = np.empty(self.shape)
+        self._delta = np.empty(self.shape)
+        self._scratch = np.empty(self.shape)
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.mean.fill(0)
+        self.m2.fill(0)
+        self.min.fill(np.inf)
+        self.max.fill(-np.inf)
+        self.rejected.clear()
+        if self.kept is not None:
+            self.kept.clear()
+
+    def add(self, x):
+        self.count += 1
+        np.subtract(x, self.mean, out=self._delta)
+        np.multiply(self._delta, 1 / self.count, out=self._scratch)
+        self.mean += self._scratch
+        # m2 += (x - old_mean) * (x - new_mean)
+        np.subtract(x, self.mean, out=self._scratch)
+        self._scratch *= self._delta
+        self.m2 += self._scratch
+        np.minimum(self.min, x, out=self.min)
+        np.maximum(self.max, x, out=self.max)
+        if self.kept is not None:
+            self.kept.append(x)
+
+    def reject(self, reason):
+        self.rejected[reason] += 1
+
+    def average(self):
+        """The median of the kept chunks when keeping them, otherwise the mean."""
+        if self.kept is None or not len(self.kept):
+            return self.mean
+        return np.median(self.kept.view(), axis=0)
+
+    def variance(self):
+        if self.count < 2:
+            return np.zeros(self.shape)
+        return self.m2 / (self.count - 1)
+
+    def std(self):
+        return np.sqrt(self.variance())
+
+    def sem(self):
+        """Standard error of the mean."""
+        return self.std() / np.sqrt(max(self.count, 1))
+
+    def snapshot(self):
+        """Copies of the current statistics, safe to hand to another thread."""
+        snapshot = {
+            "count": self.count,
+            "mean": self.mean.copy(),
+            "std": self.std(),
+            "sem": self.sem(),
+            "min": self.min.copy(),
+            "max": self.max.copy(),
+            "rejected": dict(self.rejected),
+        }
+        if self.kept is not None:
+            snapshot["median"] = self.average()
+        return snapshot
+
+
+def range_volts(text):
+    """Full scale of an adc_range symbol such as "5 V", "20 mV" or "_5_V", in volts."""
+    value, unit = text.strip("_").replace("_", " ").split()
+    return float(value) * {"mV": 1e-3, "V": 1.0}[unit]
+
+
+class Rejector:
+    """
+    Decide per chunk whether it goes into the average.
+
+    Two checks, each optional:
+
+    clip
+        Any sample at or beyond clip_fraction of its channel's ADC range,
+        i.e. a saturated or misfired measurement.
+    zscore
+        Each channel's RMS distance from the running mean of accepted
+        chunks, as a robust z-score against the distances of the last
+        window accepted chunks.  Catches dropouts and trigger glitches.
+        After patience rejections in a row the level is taken as a real
+        change: the chunk is accepted and the running mean starts over.
+
+    check costs a few vectorized passes over one (channel, sample) chunk.
+    """
+
+    reasons = ["clipped", "outlier"]
+
+    def __init__(self, zscore=None, clip=True, clip_fraction=0.99, window=50, warmup=5, patience=10):
+        self.zscore = zscore
+        self.clip = clip
+        self.clip_fraction = clip_fraction
+        self.window = window  # chunks
+        self.warmup = warmup  # accepted chunks before anything is rejected as an outlier
+        self.patience = patience
+        self.rebaselined = 0
+        self.reset()
+
+    def reset(self):
+        self.reference = None
+        self.distances = None
+        self.streak = 0
+
+    def clipped(self, traces, limits):
+        """
+        Boolean (..., channel) mask of traces reaching their channel's limit.
+
+        traces is (..., channel, sample) and limits (channel,) in volts,
+        or (..., channel) for limits that differ from trace to trace.
+        """
+        return np.abs(traces).max(axis=-1) >= self.clip_fraction * limits
+
+    def check(self, traces, limits=None):
+        """
+        Parameters
+        ----------
+        traces : array
+            One chunk, (channel, sample).
+        limits : array (optional)
+            Full scale of each channel in volts, needed for clip.
+
+        Returns
+        -------
+        str or None
+            The reason the chunk is rejected (one of ``reasons``), or None to accept it.
+        """
+        if self.clip and limits is not None and self.clipped(traces, limits).any():
+            return "clipped"
+        if self.zscore is None:
+            return None
+        if self.reference is None:
+            self.reference = np.array(traces, dtype=float)
+            self.distances = RingBuffer(self.window, shape=traces.shape[:-1])
+            return None
+        distance = np.sqrt(np.mean((traces - self.reference) ** 2, axis=-1))
+        if len(self.distances) >= self.warmup:
+            recent = self.distances.view()
+            median = np.median(recent, axis=0)
+            mad = np.median(np.abs(recent - median), axis=0)
+            z = 0.6745 * (distance - median) / np.where(mad > 0, mad, np.inf)
+            if np.any(z > self.zscore):
+                self.streak += 1
+                if self.streak <= self.patience:
+                    return "outlier"
+                self.rebaselined += 1
+                self.reset()
+                return self.check(traces, limits)
+        self.streak = 0
+        self.distances.append(distance)
+        self.reference += (traces - self.reference) / min(len(self.distances) + 1, self.window)
+        return None
+
+
+class Demodulator:
+    """
+    Software boxcar / lock-in: sort each measurement's shots by a reference level and difference them.
+
+    With a chopper or shutter in one beam, a reference channel (A, the
+    trigger, in the default wiring) is high on one part of the shots and
+    low on the other.  Every shot's reference level is the value of the
+    reference Gate.  With two bins the shots are split at threshold volts,
+    or at the midpoint of the measurement's lowest and highest levels when
+    threshold is None, into "on" (above) and "off"; with more, into nbins
+    equal-width phase bins between those levels, "on" being the top and
+    "off" the bottom one.  invert swaps them.  The output is on - off, or
+    (on - off) / off with ratio (dT/T), computed for all shots at once.
+
+    A measurement counts as modulated only when its levels fall into two
+    groups: split at the threshold (or midpoint), the means of the upper
+    and lower shots must be at least separation times their pooled
+    within-group standard deviation apart, and at least min_contrast
+    volts.  Noise split in two comes out at most about 3.5 apart, a
+    chopped reference its step over its noise, so a stopped chopper is
+    noticed instead of splitting noise.
+    """
+
+    outputs = ["difference", "ratio"]
+
+    def __init__(
+        self, reference, threshold=None, nbins=2, invert=False, ratio=False, min_contrast=0.0, separation=5.0
+    ):
+        self.reference = reference  # Gate on the reference channel
+        self.threshold = threshold  # volts, None for the midpoint
+        self.nbins = max(int(nbins), 2)
+        self.invert = invert
+        self.ratio = ratio
+        self.min_contrast = min_contrast  # volts
+        self.separation = separation  # within-group standard deviations
+        self.gates = None
+        self.layout = None
+
+    def levels(self, shots, channel_keys):
+        """Reference level of every shot, (shot,)."""
+        if self.gates is None or self.layout != (tuple(channel_keys), shots.shape[-1]):
+            # the raw reference window; its own baseline or reference gates are not charted here
+            r = self.reference
+            window = Gate(r.name, r.channel, r.start, r.stop, method=r.method)
+            self.gates = GateSet([window], channel_keys, shots.shape[-1])
+            self.layout = (tuple(channel_keys), shots.shape[-1])
+        return self.gates.compute(shots)[:, 0]
+
+    def to_dict(self):
+        return {
+            "reference": self.reference.to_dict(),
+            "threshold": self.threshold,
+            "nbins": self.nbins,
+            "invert": self.invert,
+            "ratio": self.ratio,
+            "min_contrast": self.min_contrast,
+            "separation": self.separation,
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        """A Demodulator from a to_dict dict."""
+        return cls(Gate(**d["reference"]), **{key: value for key, value in d.items() if key != "reference"})
+
+    def modulated(self, levels):
+        """Whether the levels fall into an upper and a lower group, see the class docstring."""
+        if len(levels) < 4:
+            return False  # too few for two groups of two
+        split = (np.min(levels) + np.max(levels)) / 2 if self.threshold is None else self.threshold
+        upper, lower = levels[levels > split], levels[levels <= split]
+        if len(upper) < 2 or len(lower) < 2:
+            return False
+        distance = upper.mean() - lower.mean()
+        spread = np.sqrt((upper.var(ddof=1) + lower.var(ddof=1)) / 2)
+        return bool(distance >= self.min_contrast and distance >= self.separation * spread)
+
+    def bins(self, levels):
+        """Phase bin of every shot, 0 (off) to nbins - 1 (on), or None if the levels are not modulated."""
+        if not self.modulated(levels):
+            return None
+        low, high = np.min(levels), np.max(levels)
+        if self.nbins == 2 and self.threshold is not None:
+            index = (levels > self.threshold).astype(int)
+        else:
+            edges = np.linspace(low, high, self.nbins + 1)[1:-1]
+            index = np.searchsorted(edges, levels, side="right")
+        return self.nbins - 1 - index if self.invert else index
+
+    def demodulate(self, shots, keep, channel_keys, values=None):
+        """
+        Parameters
+        ----------
+        shots : array
+            (shot, channel, sample)
+        keep : array
+            (shot,) bool, shots to use
+        channel_keys : list of str
+            Channel of each row of shots.
+        values : array (optional)
+            (shot, gate) gate values, to demodulate per gate too.
+
+        Returns
+        -------
+        dict or None
+            "traces" (channel, sample) on - off; "values" and "errors"
+            (gate,), the demodulated gate values and their standard errors
+            from the shot-to-shot spread (None without values); and "on"
+            and "off", the shots in each.  None if the shots could not be
+            split.
+        """
+        index = self.bins(self.levels(shots, channel_keys)[keep])
+        if index is None:
+            return None
+        on = np.zeros(len(shots), dtype=bool)
+        off = np.zeros(len(shots), dtype=bool)
+        on[keep] = index == self.nbins - 1
+        off[keep] = index == 0
+        count_on, count_off = int(on.sum()), int(off.sum())
+        if not count_on or not count_off:
+            return None
+        off_traces = np.mean(shots, axis=0, where=off[:, None, None])
+        traces = np.mean(shots, axis=0, where=on[:, None, None]) - off_traces
+        result = {"traces": traces, "values": None, "errors": None, "on": count_on, "off": count_off}
+        if values is not None:
+            values_on, values_off = values[on], values[off]
+            mean_off = values_off.mean(axis=0)
+            delta = values_on.mean(axis=0) - mean_off
+            variance = 0.0
+            if count_on > 1 and count_off > 1:
+                variance = values_on.var(axis=0, ddof=1) / count_on + values_off.var(axis=0, ddof=1) / count_off
+            errors = np.sqrt(variance) * np.ones_like(delta)
+            if self.ratio:
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    delta, errors = delta / mean_off, errors / np.abs(mean_off)
+            result["values"], result["errors"] = delta, errors
+        if self.ratio:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                result["traces"] = traces / off_traces
+        return result
+
+
+class ChartScheduler:
+    """
+    Decide when each chart point starts.
+
+    mode is one of
+
+    - "fast": start the next point as soon as the previous one is done.
+    - "fixed": start points every interval seconds, on a grid anchored to
+      the monotonic clock when charting starts, so lateness never
+      accumulates.  Slots that pass while a point is still averaging are
+      dropped and counted in ``missed``.
+    - "every": start a point on every Nth measurement_id, whatever the
+      averaging takes, measurements in between are passed over.
+    """
+
+    modes = ["fast", "fixed", "every"]
+
+    def __init__(self, mode="fast", interval=1.0, every=1):
+        if mode not in self.modes:
+            raise ValueError(f"mode must be one of {self.modes}, not {mode!r}")
+        self.mode = mode
+        self.interval = float(interval)  # sec, fixed mode
+        self.every = max(int(every), 1)  # measurements, every mode
+        self.start()
+
+    def start(self):
+        self.origin = time.monotonic()
+        self.slot = 0
+        self.missed = 0
+        self.last_id = None
+
+    def wait(self, stop_event):
+        """Sleep until the next fixed-rate slot. Returns True if stopped."""
+        if self.mode != "fixed" or self.interval <= 0:
+            return stop_event.is_set()
+        now = time.monotonic()
+        due = self.origin + self.slot * self.interval
+        if now > due + self.interval:
+            # a slow point overran whole slots: drop them rather than catching up in a burst
+            late = int((now - self.origin) / self.interval)
+            self.missed += late - self.slot
+            self.slot = late
+            due = self.origin + self.slot * self.interval
+        self.slot += 1
+        return stop_event.wait(max(due - now, 0))
+
+    def min_id(self):
+        """Smallest measurement_id the next point may start with, or None for any new one."""
+        if self.mode != "every" or self.last_id is None:
+            return None
+        return self.last_id + self.every
+
+    def started(self, measurement_id):
+        """Note the measurement_id a point started with."""
+        if self.mode == "every" and self.last_id is not None:
+            # stay on the grid of every Nth id even if a point ran late
+            measurement_id -= (measurement_id - self.last_id) % self.every
+        self.last_id = measurement_id
+
+
+class DaemonCache:
+    """
+    Client-side cache of a daemon's metadata, so each item costs one round trip.
+
+    Items are fetched through whichever client asks first and kept until
+    invalidated: after the config file is written, nshots is set, or the
+    daemon restarts.  One cache can be shared by every client of the same
+    daemon, in any thread; fetches are serialized by a lock.  prefetch
+    fills it ahead of time, e.g. from a background thread while a window
+    is being drawn.
+    """
+
+    # item name -> how it is read from a client
+    fetchers = {
+        "id": lambda client: client.id(),
+        "config": lambda client: toml.loads(client.get_config()),
+        "config_filepath": lambda client: client.get_config_filepath(),
+        "types": lambda client: {t["name"]: t for t in client._protocol.get("types", [])},
+        "mappings": lambda client: client.get_mappings(),
+        "nshots": lambda client: client.get_nshots(),
+        "channel_names": lambda client: client.get_channel_names(),
+    }
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def get(self, name, client):
+        with self.lock:
+            if name not in self.values:
+                self.values[name] = self.fetchers[name](client)
+            return self.values[name]
+
+    def prefetch(self, client, names=None):
+        """Fetch every item (or the given ones) that is not cached yet."""
+        for name in self.fetchers if names is None else names:
+            self.get(name, client)
+        return self
+
+    def set_nshots(self, client, nshots):
+        """Set nshots on the daemon unless it is known to be set already."""
+        with self.lock:
+            if self.values.get("nshots") == nshots:
+                return
+            client.set_nshots(nshots)
+            self.values["nshots"] = nshots
+
+    def invalidate(self, *names):
+        """Forget the given items, or everything."""
+        with self.lock:
+            for name in names or list(self.values):
+                self.values.pop(name, None)
+
+
+def fit_nshots(probes):
+    """
+    Fit a linear timing model to probe_nshots results at two or more nshots.
+
+    A measurement takes ``overhead + nshots / shot_rate`` seconds (trigger
+    rate plus the daemon's fixed cost per measurement), and reading one
+    takes ``fetch + nshots * fetch_per_shot`` (RPC round trip plus transfer,
+    which only grows with nshots in single shot mode).
+
+    Returns
+    -------
+    dict
+        "shot_rate" (shots per second), "overhead", "fetch" and
+        "fetch_per_shot" (seconds).
+    """
+    nshots = np.array([probe["nshots"] for probe in probes], dtype=float)
+    period = np.array([probe["period"] for probe in probes])
+    fetch = np.array([probe["fetch"] for probe in probes])
+    if np.ptp(nshots) > 0:
+        slope, overhead = np.polyfit(nshots, period, 1)
+        fetch_per_shot, fetch_fixed = np.polyfit(nshots, fetch, 1)
+    else:
+        slope, overhead, fetch_per_shot, fetch_fixed = 0.0, 0.0, 0.0, float(np.mean(fetch))
+    if slope <= 0 or overhead < 0:
+        # too noisy to separate the overhead, put it all on the shots
+        slope, overhead = float(np.max(period / nshots)), 0.0
+    return {
+        "shot_rate": float(1 / slope),
+        "overhead": float(overhead),
+        "fetch": max(float(fetch_fixed), 0.0),
+        "fetch_per_shot": max(float(fetch_per_shot), 0.0),
+    }
+
+
+def choose_nshots(model, target_latency, nchunks=1, minimum=1, maximum=100000):
+    """
+    Pick nshots for a fit_nshots model.
+
+    A chunk takes as long as the slower of measuring and reading a
+    measurement, and a chart point nchunks chunks.  Shots averaged per
+    second only grow with nshots (the fixed costs are shared by more
+    shots), so the answer is the largest nshots whose chart point still
+    fits in target_latency seconds.  If none does, it is the largest
+    nshots that is no slower than the smallest one.
+
+    Returns
+    -------
+    dict
+        "nshots", and the predicted "chunk" seconds, "latency" seconds per
+        chart point and "shots/sec" averaged.
+    """
+    def chunk(nshots):
+        return max(
+            model["overhead"] + nshots / model["shot_rate"],
+            model["fetch"] + nshots * model["fetch_per_shot"],
+        )
+
+    allowed = max(target_latency / max(nchunks, 1), chunk(minimum))
+    limits = [(allowed - model["overhead"]) * model["shot_rate"]]
+    if model["fetch_per_shot"] > 0:
+        limits.append((allowed - model["fetch"]) / model["fetch_per_shot"])
+    nshots = int(np.clip(np.floor(min(limits) + 1e-9), minimum, maximum))
+    seconds = chunk(nshots)
+    return {"nshots": nshots, "chunk": seconds, "latency": seconds * max(nchunks, 1), "shots/sec": nshots / seconds}
+
+
+class Engine:
+    """
+    Headless acquisition engine owning the yaqc.Client.
+
+    Everything that talks to the daemon lives here: waiting for new
+    measurements, averaging chunks, auto-stop targets, charting gate values,
+    range changes, single shot analysis and recording.  The Qt GUI drives an Engine from its worker
+    thread; scripts and the command line can use one directly::
+
+        engine = Engine(port)
+        engine.connect()
+        stats = engine.acquire(10)
+        for elapsed, values, stats in engine.chart(5, gates):
+            ...
+
+    Every chunk passes the ``rejector`` (a Rejector) before it is averaged;
+    rejected chunks are replaced by later ones and counted in the stats.
+    With ``median`` set, acquisitions and chart points report the median of
+    their chunks instead of the mean.
+
+    In single shot mode each measurement is fetched once as its full shot
+    cube; the shots are kept in ``shot_history``, optionally screened for
+    outliers, averaged, and handed to ``shot_listeners``.
+
+    Daemon metadata (config, mappings, nshots, ...) comes from ``cache``, a
+    DaemonCache that can be shared with other clients of the same daemon.
+
+    The loops reconnect on their own when the daemon drops out (for up to
+    ``reconnect_timeout`` seconds) and, given a checkpoint_path, keep a
+    Checkpoint of the chart on disk that chart(resume=True) continues from.
+
+    nshots can be changed between chunks with request_nshots, or tuned
+    against the daemon with tune_nshots.
+
+    stop, request_range, request_nshots, set_gates, set_reject, set_rejector and set_daemon_gates are safe
+    to call from any thread.
+    Daemon calls and each step of the loops are timed in ``instrumentation``.
+    """
+
+    # daemon message for changing a channel range at runtime, used when the protocol has it
+    range_setter = "set_channel_range"
+
+    def __init__(
+        self,
+        port,
+        channel_keys=None,
+        record_directory=".",
+        t0=None,
+        client_factory=None,
+        instrumentation=None,
+        shot_history=10000,
+        shot_history_path=None,
+        cache=None,
+        checkpoint_path=None,
+        checkpoint_interval=10.0,
+    ):
+        self.port = port
+        self.cache = DaemonCache() if cache is None else cache
+        self.instrumentation = Instrumentation() if instrumentation is None else instrumentation
+        # called as client_factory(port) to connect, yaqc.Client unless given (e.g. a MockClient)
+        self.client_factory = client_factory
+        self.channel_keys = None if channel_keys is None else list(channel_keys)
+        self.record_directory = record_directory
+        self.t0 = t0  # wall-clock chart origin (time.time()), None for the start of each chart
+        self.client = None
+        self.watcher = None
+        self.recorder = None
+        self.gates = None
+        self.measure_id = None
+        self.stop_event = threading.Event()
+        self.min_target_chunks = 3  # chunks needed before the auto-stop estimate is trusted
+        # range changes requested by the caller, applied between chunks
+        self.range_lock = threading.Lock()
+        self.pending_ranges = {}
+        self.pending_since = 0.0
+        self.range_debounce = 0.2  # sec, lets several channel changes share one apply
+        self.range_listeners = []  # called as listener(key, value) once a range is applied
+        self.pending_nshots = None  # requested by the caller, applied between chunks like ranges
+        self.nshots_listeners = []  # called as listener(nshots) once nshots is applied
+        # single shot mode
+        self.shot_history_length = shot_history  # shots kept, newest last
+        self.shot_history_path = shot_history_path  # .npy file to memory-map the history to, for long runs
+        self.shot_history = None
+        self.reject_threshold = None  # robust z-score above which a shot is left out of the average
+        self.shot_listeners = []  # called as listener(batch) with every measurement's shots, see read_shots
+        # chunk rejection, checked before averaging; by default only an explicit Rejector rejects anything
+        self.rejector = Rejector(clip=False)
+        self.median = False
+        self.limits = None  # full scale of each channel in volts, for clipping
+        # unattended runs
+        self.reconnect_timeout = 300.0  # sec a loop waits for a lost daemon before giving up
+        self.checkpoint = None if checkpoint_path is None else Checkpoint(checkpoint_path, checkpoint_interval)
+        # gates computed by the daemon's picotech_processing module instead of from fetched traces
+        self.daemon_gates = False
+        self.processing_version = 0
+        # lock-in: shots split by a reference level and differenced, see Demodulator
+        self.demodulator = None
+        self.demodulated = None  # result for the last measurement
+        self.shot_rejection = None  # why read_shots had no traces for the last measurement
+        self.point_errors = None  # standard errors of the last chart point's values, when known
+        self.waterfall = None  # a Waterfall that chart adds every point's averaged traces to
+
+    def connect(self):
+        """Connect to the daemon and read the scope layout."""
+        self.client = self.connect_client()
+        self.config = self.cache.get("config", self.client)
+        if self.channel_keys is None:
+            # every enabled channel is acquired, in daemon order
+            self.channel_keys = [
+                key for key, channel in self.config["channels"].items() if channel.get("enabled", True)
+            ]
+        self.sample_time = self.cache.get("mappings", self.client)["time"]
+        self.nsamples = len(self.sample_time)
+        self.watcher = MeasurementWatcher(self.client, instrumentation=self.instrumentation)
+        self.update_layout()
+        self.shot_history = RingBuffer(
+            self.shot_history_length,
+            shape=(len(self.channel_keys), self.nsamples),
+            dtype=np.float32,
+            path=self.shot_history_path,
+        )
+        return self
+
+    def update_layout(self):
+        """Find the acquired channels among the config's enabled ones and take their limits."""
+        # get_measured_samples returns every enabled channel, in daemon order
+        enabled = [key for key, channel in self.config["channels"].items() if channel.get("enabled", True)]
+        missing = [key for key in self.channel_keys if key not in enabled]
+        if missing:
+            raise RuntimeError(f"daemon on port {self.port} no longer acquires channels {missing}")
+        self.shot_channels = [enabled.index(key) for key in self.channel_keys]
+        if self.shot_channels == list(range(len(enabled))):
+            self.shot_channels = None  # all of them, no need to index (and copy)
+        self.update_limits()
+
+    def update_limits(self):
+        try:
+            self.limits = np.array([range_volts(self.config["channels"][key]["range"]) for key in self.channel_keys])
+        except (KeyError, ValueError):
+            self.limits = None  # unknown range names, clipping cannot be checked
+
+    def connect_client(self):
+        if self.client_factory is None:
+            client = yaqc.Client(self.port)
+        else:
+            client = self.client_factory(self.port)
+        return InstrumentedClient(client, self.instrumentation)
+
+    def stop(self):
+        """Request that a running acquisition or chart return. Safe from any thread."""
+        self.stop_event.set()
+
+    def get_traces(self, measured):
+        """Stack every recorded channel's mean trace from one get_measured reply."""
+        return np.stack([measured[f"{key}_mean"] for key in self.channel_keys])
+
+    def read_shots(self, measurement_id):
+        """
+        Fetch one measurement's shots and run them through the single shot stages.
+
+        The shot cube is transferred once and only viewed, never copied,
+        except into ``shot_history``.  With gates set, every shot's gate
+        values are computed.  Shots that clip are left out of the average
+        when the rejector checks clipping.  With a reject threshold, shots
+        that reject_outliers flags are left out as well; it looks at their
+        gate values, or without gates at each shot's distance from the
+        median trace.  If no shot is left, there are no traces to average
+        and ``shot_rejection`` says why, as it does for shots the
+        demodulator cannot split.  Every shot_listener is then called with
+        a batch dict holding "measurement_id", "shots" (shot, channel,
+        sample), "keep" (shot,), "values" (shot, gate) or None, and
+        "gate_names".
+
+        With a demodulator, the kept shots are demodulated instead of
+        averaged; the result (see Demodulator.demodulate) is kept in
+        ``demodulated`` and the batch's "demodulated".
+
+        Returns
+        -------
+        tuple
+            (mean traces over the kept shots, or the demodulated traces,
+            (channel, sample), None if no shots were kept or they were not
+            modulated; shots)
+        """
+        cube = self.client.get_measured_samples()  # (channel, shot, sample)
+        if self.shot_channels is not None:
+            cube = cube[self.shot_channels]
+        shots = cube.transpose(1, 0, 2)  # (shot, channel, sample), a view
+        gates = self.gates
+        values = gates.compute(shots) if gates is not None and len(gates) else None
+        keep = np.ones(len(shots), dtype=bool)
+        rejector = self.rejector
+        if rejector.clip and self.limits is not None:
+            clipped = rejector.clipped(shots, self.limits).any(axis=-1)
+            keep &= ~clipped
+            self.instrumentation.count("shots clipped", int(clipped.sum()))
+        threshold = self.reject_threshold
+        if threshold is not None and len(shots) > 2:
+            if values is not None:
+                scores = values
+            else:
+                scores = np.sqrt(np.mean((shots - np.median(shots, axis=0)) ** 2, axis=(1, 2)))[:, None]
+            outliers = ~reject_outliers(scores, threshold)
+            keep &= ~outliers
+            self.instrumentation.count("shots rejected", int(outliers.sum()))
+        demodulator = self.demodulator
+        self.shot_rejection = None
+        if not keep.any():
+            self.shot_rejection = "no shots kept"
+            self.demodulated = None
+            traces = None
+        elif demodulator is None:
+            traces = np.mean(shots, axis=0, where=keep[:, None, None])
+        else:
+            with self.instrumentation.time("demodulate"):
+                self.demodulated = demodulator.demodulate(shots, keep, self.channel_keys, values)
+            traces = None if self.demodulated is None else self.demodulated["traces"]
+            if traces is None:
+                self.shot_rejection = "unmodulated"
+        self.shot_history.extend(shots)
+        batch = {
+            "measurement_id": measurement_id,
+            "shots": shots,
+            "keep": keep,
+            "values": values,
+            "gate_names": [] if values is None else gates.names,
+            "demodulated": None if demodulator is None else self.demodulated,
+        }
+        for listener in self.shot_listeners:
+            listener(batch)
+        return traces, shots
+
+    def read_measurement(self, measured, singleshot=False):
+        """
+        Traces of a measurement the watcher reported.
+
+        Returns
+        -------
+        tuple
+            (traces to average, traces to display), both (channel, sample).
+            In single shot mode the displayed traces are the first shot.
+        """
+        if not singleshot:
+            traces = self.get_traces(measured)
+            return traces, traces
+        with self.instrumentation.time("shots"):
+            traces, shots = self.read_shots(measured["measurement_id"])
+        return traces, shots[0]
+
+    def latest(self, singleshot=False):
+        """
+        Return the newest traces, (channel, sample), if they changed since the last call.
+
+        In single shot mode this is the first shot of the newest measurement,
+        which is read (and passed to shot_listeners) only once.
+        """
+        self.apply_pending()
+        if singleshot:
+            measurement_id = self.client.get_measurement_id()
+            if measurement_id == self.measure_id:
+                return None
+            self.measure_id = measurement_id
+            return self.read_measurement({"measurement_id": measurement_id}, singleshot)[1]
+        measured = self.client.get_measured()
+        if measured["measurement_id"] == self.measure_id:
+            return None
+        self.measure_id = measured["measurement_id"]
+        return self.get_traces(measured)
+
+    def request_range(self, key, value):
+        """Queue a channel range change, applied between chunks. Safe from any thread."""
+        with self.range_lock:
+            if not self.pending_ranges:
+                self.pending_since = time.monotonic()
+            self.pending_ranges[key] = value
+
+    def apply_pending_ranges(self):
+        """Apply queued range changes in one batch, keeping all averaging state."""
+        with self.range_lock:
+            if not self.pending_ranges:
+                return
+            if time.monotonic() - self.pending_since < self.range_debounce:
+                return
+            pending, self.pending_ranges = self.pending_ranges, {}
+        if self.range_setter in self.client._protocol.get("messages", {}):
+            # runtime path: no restart needed
+            for key, value in pending.items():
+                getattr(self.client, self.range_setter)(key, value)
+        else:
+            self.write_config_ranges(pending)  # the restart is noticed by reconnect, which reports the new ranges
+        self.watcher.reset()
+        changed = {key: value for key, value in pending.items() if self.config["channels"][key].get("range") != value}
+        for key, value in pending.items():
+            self.config["channels"][key]["range"] = value
+        self.update_limits()
+        self.report_ranges(changed)
+
+    def report_ranges(self, ranges):
+        # ranges (channel key -> range name) now in effect: log them and tell the listeners
+        if not ranges:
+            return
+        if self.recorder is not None:
+            self.recorder.record_change(ranges=ranges)
+        for key, value in ranges.items():
+            for listener in self.range_listeners:
+                listener(key, value)
+
+    def request_nshots(self, nshots):
+        """Queue an nshots change, applied between chunks. Safe from any thread."""
+        with self.range_lock:
+            self.pending_nshots = int(nshots)
+
+    def apply_pending(self):
+        """Apply queued range and nshots changes."""
+        self.apply_pending_ranges()
+        with self.range_lock:
+            nshots, self.pending_nshots = self.pending_nshots, None
+        if nshots is not None:
+            self.apply_nshots(nshots)
+
+    def apply_nshots(self, nshots):
+        """Set nshots on the daemon now, from the thread running the engine (see request_nshots)."""
+        if nshots == self.cache.get("nshots", self.client):
+            return
+        self.cache.set_nshots(self.client, nshots)
+        if self.recorder is not None:
+            self.recorder.record_change(nshots=nshots)
+        # measurements now take a different time and have a different noise level
+        self.watcher.reset()
+        self.watcher.period = None
+        self.rejector.reset()
+        for listener in self.nshots_listeners:
+            listener(nshots)
+
+    def probe_nshots(self, nshots, measurements=5, singleshot=False):
+        """
+        Time the daemon at nshots shots per measurement.
+
+        The measurement in progress when nshots is set is passed over, then
+        measurements more are timed: their period, from measurement_id and
+        arrival time, and how long reading one takes (get_measured, or
+        get_measured_samples in single shot mode).
+
+        Returns
+        -------
+        dict or None
+            "nshots", "period" and "fetch" (median) in seconds, or None if stopped.
+        """
+        self.apply_nshots(nshots)
+        read = self.client.get_measured_samples if singleshot else self.client.get_measured
+        fetches = []
+        for i in range(measurements + 2):
+            measured = self.watcher.wait(self.stop_event, count_gap=False, ids_only=True)
+            if measured is None:
+                return None
+            if i == 1:
+                first = (measured["measurement_id"], self.watcher.last_arrival)
+            if i >= 1:
+                began = time.perf_counter()
+                read()
+                fetches.append(time.perf_counter() - began)
+        steps = max(measured["measurement_id"] - first[0], 1)
+        return {
+            "nshots": nshots,
+            "period": (self.watcher.last_arrival - first[1]) / steps,
+            "fetch": float(np.median(fetches)),
+        }
+
+    def tune_nshots(
+        self, target_latency, nchunks=1, singleshot=False, measurements=5, probe_period=0.5, minimum=1, maximum=100000
+    ):
+        """
+        Set the nshots that averages the most shots per second while a chart
+        point of nchunks chunks takes at most target_latency seconds.
+
+        The daemon is probed at the current nshots and at a second one,
+        picked towards the target but with measurements no longer than
+        probe_period seconds so tuning stays quick, and the fit_nshots model
+        of both is handed to choose_nshots.  If stopped, the original nshots
+        is restored.
+
+        Returns
+        -------
+        dict or None
+            The choose_nshots result and the fit_nshots model, plus the
+            "probes" made; None if stopped.
+        """
+        self.stop_event.clear()
+        start = self.cache.get("nshots", self.client)
+        try:
+            probes = [self.probe_nshots(start, measurements, singleshot)]
+            if probes[0] is None:
+                return None
+            guess = choose_nshots(fit_nshots(probes), target_latency, nchunks, minimum, maximum)["nshots"]
+            ceiling = min(max(int(start * probe_period / probes[0]["period"]), 1), maximum)
+            guess = min(guess, ceiling)
+            if abs(guess - start) < start / 2:
+                # too close to separate the fixed cost from the shots
+                guess = start * 2 if start * 2 <= ceiling else max(start // 2, minimum)
+            if guess != start:
+                probes.append(self.probe_nshots(guess, measurements, singleshot))
+                if probes[-1] is None:
+                    self.apply_nshots(start)
+                    return None
+            model = fit_nshots(probes)
+            result = choose_nshots(model, target_latency, nchunks, minimum, maximum)
+            self.apply_nshots(result["nshots"])
+        finally:
+            self.stop_event.clear()
+        result.update(model)
+        result["probes"] = probes
+        return result
+
+    def write_config_ranges(self, ranges):
+        # create dictionary, starting from existing
+        config = copy.deepcopy(self.cache.get("config", self.client))
+        for key, value in ranges.items():
+            config["channels"][key]["range"] = value
+        with open(self.cache.get("config_filepath", self.client), "w") as f:
+            toml.dump({self.cache.get("id", self.client)["name"]: config}, f)
+        self.client.shutdown(restart=True)
+        self.reconnect()
+
+    def reconnect(self, timeout=30.0, delay=0.05, max_delay=1.0):
+        """
+        Reconnect to the daemon, backing off exponentially up to timeout seconds.
+
+        The daemon may have restarted meanwhile, perhaps with another
+        config, so everything cached is read anew: limits follow the new
+        ranges, which are reported as range changes, and a config that no
+        longer has the acquired channels or samples raises RuntimeError.
+        Gives up at once when the engine is stopped, leaving the client
+        disconnected.
+
+        Returns
+        -------
+        bool
+            True once reconnected, False if stopped first.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            if self.stop_event.wait(delay):
+                return False
+            try:
+                self.client = self.connect_client()
+                self.cache.invalidate()
+                config = self.cache.get("config", self.client)
+                nsamples = len(self.cache.get("mappings", self.client)["time"])
+            except OSError:
+                if time.monotonic() + delay > deadline:
+                    raise TimeoutError(f"daemon on port {self.port} did not return within {timeout} s")
+                print("tried to connect")
+                delay = min(2 * delay, max_delay)
+            else:
+                break
+        if nsamples != self.nsamples:
+            raise RuntimeError(f"daemon on port {self.port} now takes {nsamples} samples, not {self.nsamples}")
+        old, new = self.config["channels"], config["channels"]
+        changed = {
+            key: new[key].get("range")
+            for key in self.channel_keys
+            if key in new and new[key].get("range") != old[key].get("range")
+        }
+        self.config = config
+        self.update_layout()
+        self.report_ranges(changed)
+        self.watcher.client = self.client
+        self.watcher.reset()
+        return True
+
+    def recover(self, error):
+        """
+        Reconnect after the daemon dropped out. Raises TimeoutError if it does not return.
+
+        Returns False, as reconnect does, if the engine was stopped meanwhile.
+        """
+        self.instrumentation.count("reconnects")
+        print(f"lost daemon on port {self.port} ({error!r}), reconnecting", file=sys.stderr)
+        return self.reconnect(timeout=self.reconnect_timeout)
+
+    def next_chunk(self, singleshot=False, min_id=None, count_gap=True):
+        """
+        Wait for the next measurement and read it, riding out daemon dropouts.
+
+        Arguments are passed on to the watcher.  A measurement lost to a
+        dropout is not retried; after reconnecting the next one is awaited.
+
+        Returns
+        -------
+        tuple or None
+            (get_measured reply, traces, displayed traces) as in
+            read_measurement, or None if stopped.
+        """
+        while not self.stop_event.is_set():
+            try:
+                with self.instrumentation.time("wait for measurement"):
+                    measured = self.watcher.wait(
+                        self.stop_event, min_id=min_id, count_gap=count_gap, ids_only=singleshot
+                    )
+                if measured is None:
+                    return None
+                return (measured,) + self.read_measurement(measured, singleshot)
+            except OSError as error:  # includes ConnectionError and socket timeouts
+                self.recover(error)
+        return None
+
+    def set_gates(self, gates):
+        """Swap in a new GateSet for a running chart and for single shot values. Safe from any thread."""
+        self.gates = gates
+
+    def set_reject(self, threshold):
+        """Set the single shot outlier threshold in robust z-scores, None to keep every shot. Safe from any thread."""
+        self.reject_threshold = threshold
+
+    def set_rejector(self, rejector, median=False):
+        """Swap in a new chunk Rejector and choose median or mean, from the next chunk on. Safe from any thread."""
+        self.rejector = rejector
+        self.median = median
+
+    def set_demodulator(self, demodulator):
+        """Demodulate shots with a Demodulator (None to average them), from the next run on. Safe from any thread."""
+        self.demodulator = demodulator
+
+    def set_daemon_gates(self, enabled):
+        """Chart gate values computed in the daemon, from the next chart on. Safe from any thread."""
+        self.daemon_gates = enabled
+
+    def processing_control_path(self):
+        """Control file of the daemon's shots processing module (see picotech_processing), or None."""
+        path = self.config.get("shots_processing_path")
+        if not path:
+            return None
+        path = pathlib.Path(path)
+        if not path.is_absolute():
+            path = pathlib.Path(self.cache.get("config_filepath", self.client)).parent / path
+        return path.with_suffix(".json")
+
+    def daemon_processing(self):
+        """Whether the daemon runs picotech_processing, publishing gate values with every measurement."""
+        channel_names = self.cache.get("channel_names", self.client)
+        return "gate_values" in channel_names and self.processing_control_path() is not None
+
+    def write_processing_gates(self, gates):
+        """
+        Hand gates, and the single shot reject threshold, to the daemon's picotech_processing module.
+
+        Returns
+        -------
+        int
+            The "gates_version" of measurements processed with them.
+        """
+        self.processing_version = max(int(time.time() * 1000), self.processing_version + 1)
+        control = {
+            "version": self.processing_version,
+            "gates": [gate.to_dict() for gate in gates.gates],
+            "dt": float(gates.dt),
+            "invert": {key: bool(channel.get("invert", False)) for key, channel in self.config["channels"].items()},
+            "reject": self.reject_threshold,
+        }
+        path = self.processing_control_path()
+        temporary = path.with_name(path.name + ".tmp")
+        temporary.write_text(json.dumps(control))
+        os.replace(temporary, path)
+        return self.processing_version
+
+    def reject_shots(self, stats):
+        # read_shots kept no shots, or the demodulator could not split them: reject the chunk
+        reason = self.shot_rejection
+        stats.reject(reason)
+        self.instrumentation.count(f"chunks {reason}")
+
+    def accept(self, stats, traces):
+        """Add a chunk to stats if the rejector passes it. Returns False (and counts why) if it does not."""
+        with self.instrumentation.time("reject"):
+            reason = self.rejector.check(traces, self.limits)
+        if reason is not None:
+            stats.reject(reason)
+            self.instrumentation.count(f"chunks {reason}")
+            return False
+        with self.instrumentation.time("average"):
+            stats.add(traces)
+        return True
+
+    def open_recorder(self, gates=None, origin=None):
+        self.recorder = Recorder(
+            self.record_directory,
+            self.port,
+            self.config,
+            self.cache.get("nshots", self.client),
+            self.sample_time,
+            self.channel_keys,
+            gates=gates,
+            t0=self.t0,
+            origin=origin,
+        )
+        return self.recorder
+
+    def close_recorder(self):
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+
+    def target_reached(self, gate_stats, target):
+        """
+        Check the auto-stop target against the spread of per-chunk gate values.
+
+        target is a dict with "kind" ("snr" or "sem"), "value" and "gates"
+        (a GateSet).  Every gate has to reach it.
+        """
+        if gate_stats.count < self.min_target_chunks:
+            return False
+        sem = gate_stats.sem()
+        if target["kind"] == "sem":
+            return bool(np.all(sem <= target["value"]))
+        snr = np.abs(gate_stats.mean) / np.where(sem > 0, sem, np.nan)
+        return bool(np.all(np.nan_to_num(snr, nan=np.inf) >= target["value"]))
+
+    def acquire(self, nchunks, singleshot=False, record=False, target=None, callback=None):
+        """
+        Average up to nchunks measurements.
+
+        Rejected chunks are replaced, up to nchunks of them.  With a
+        demodulator, every shot is read and the demodulated traces are
+        averaged; unmodulated chunks are rejected, as are chunks whose
+        shots were all clipped or outliers.  If target is
+        given (see target_reached) acquisition stops as soon as the gate
+        values of accepted chunks reach it; nchunks is then only a safety cap.
+        callback(traces, stats) is called after every chunk, with traces the
+        displayed (channel, sample) array and stats the RunningStats so far.
+        The checkpoint is left alone; it belongs to the chart.
+
+        Returns
+        -------
+        dict
+            RunningStats snapshot, plus "seconds" spent and per-gate "snr".
+        """
+        self.stop_event.clear()
+        singleshot = singleshot or self.demodulator is not None
+        stats = RunningStats((len(self.channel_keys), self.nsamples), keep=nchunks if self.median else 0)
+        gate_stats = RunningStats((len(target["gates"]) if target else 0,))
+        timer = self.instrumentation.time
+        starttime = time.monotonic()
+        try:
+            if record:
+                self.open_recorder()
+            self.watcher.reset()
+            self.rejector.reset()
+            for i in range(2 * nchunks):
+                if stats.count >= nchunks:
+                    break
+                self.apply_pending()
+                chunk = self.next_chunk(singleshot)
+                if chunk is None:
+                    break
+                measured, yi2, yitemp = chunk
+                if yi2 is None:
+                    self.reject_shots(stats)
+                    continue
+                if self.recorder is not None:
+                    with timer("record"):
+                        self.recorder.record_shots(
+                            self.measurement_time(measured), measured["measurement_id"], yi2
+                        )
+                accepted = self.accept(stats, yi2)
+                if callback is not None:
+                    with timer("callback"):
+                        callback(yitemp, stats)
+                if target is not None and accepted:
+                    with timer("gates"):
+                        gate_stats.add(target["gates"].compute(yi2))
+                    if self.target_reached(gate_stats, target):
+                        break
+        finally:
+            self.close_recorder()
+            self.stop_event.clear()
+        result = stats.snapshot()
+        sem = gate_stats.sem()
+        result["seconds"] = time.monotonic() - starttime
+        result["snr"] = np.abs(gate_stats.mean) / np.where(sem > 0, sem, np.nan)
+        return result
+
+    def chart(self, nchunks, gates, singleshot=False, scheduler=None, record=False, callback=None, resume=False):
+        """
+        Chart one value per gate until stopped.
+
+        Each point averages nchunks accepted measurements (replacing up to
+        nchunks rejected ones, and skipped if all are rejected) and starts when scheduler
+        (a ChartScheduler, as fast as possible by default) says so.  gates is
+        a GateSet; it can be replaced while running with set_gates.  A point's
+        time is the mean timestamp of its measurements, counted from t0 when
+        the engine has one, otherwise from the start of the chart.
+        callback(traces, stats) is called after every chunk, as in acquire.
+        With resume, a checkpoint with the same gates and demodulator is
+        continued, origin and history included.
+
+        With daemon_gates set and the daemon running picotech_processing,
+        the gates are handed to the daemon and each point averages the gate
+        values it publishes: per-shot values, so ratios are taken shot by
+        shot, and in single shot mode no shots are transferred at all.
+        Measurements still carrying older gates are passed over.
+
+        With a demodulator (see set_demodulator) every shot is read and
+        each point averages the demodulated gate values of its chunks;
+        ``point_errors`` then holds their standard errors, from the
+        shot-to-shot spread, when the point is yielded.
+
+        With a ``waterfall`` (a Waterfall) every point's averaged traces
+        are added to it, so the gates can be recomputed later.
+
+        Yields
+        ------
+        tuple
+            (elapsed seconds, gate values, RunningStats of the point)
+        """
+        self.stop_event.clear()
+        self.gates = gates
+        scheduler = ChartScheduler() if scheduler is None else scheduler
+        timer = self.instrumentation.time
+        try:
+            # chart time is wall-clock time since t0, so engines sharing t0 share one time axis
+            starttime = time.time() if self.t0 is None else self.t0
+            demodulator = self.demodulator
+            singleshot = singleshot or demodulator is not None
+            if self.checkpoint is not None:
+                settings = {
+                    "port": self.port,
+                    "channel_keys": self.channel_keys,
+                    "nchunks": nchunks,
+                    "singleshot": singleshot,
+                    "schedule": {"mode": scheduler.mode, "interval": scheduler.interval, "every": scheduler.every},
+                    "demodulator": None if demodulator is None else demodulator.to_dict(),
+                }
+                starttime = self.checkpoint.begin(gates, starttime, settings, resume)
+            if record:
+                self.open_recorder(gates, origin=starttime)
+            stats = RunningStats((len(self.channel_keys), self.nsamples), keep=nchunks if self.median else 0)
+            daemon = self.daemon_gates and demodulator is None and self.daemon_processing()
+            if self.daemon_gates and demodulator is None and not daemon:
+                print(f"daemon on port {self.port} does not run picotech_processing, gating here", file=sys.stderr)
+            written = None  # gates and reject threshold last handed to the daemon
+            self.point_errors = None
+            self.watcher.reset()
+            self.rejector.reset()
+            scheduler.start()
+            while not self.stop_event.is_set():
+                stats.reset()
+                if daemon and written != (self.gates, self.reject_threshold):
+                    written = (self.gates, self.reject_threshold)
+                    version = self.write_processing_gates(self.gates)
+                if daemon or demodulator is not None:
+                    # per-chunk gate values, averaged here rather than gated from the averaged traces
+                    gate_stats = RunningStats((len(self.gates),), keep=nchunks if self.median else 0)
+                    variances = np.zeros(len(self.gates))
+                missed = scheduler.missed
+                if scheduler.wait(self.stop_event):
+                    break
+                if scheduler.missed > missed:
+                    self.instrumentation.count("chart slots missed", scheduler.missed - missed)
+                timestamps = []
+                for i in range(2 * nchunks):
+                    if stats.count >= nchunks:
+                        break
+                    self.apply_pending()
+                    chunk = self.next_chunk(
+                        singleshot and not daemon,
+                        min_id=scheduler.min_id() if i == 0 else None,
+                        count_gap=i > 0 or scheduler.mode == "fast",
+                    )
+                    if chunk is None:
+                        break
+                    measured, yi2, yitemp = chunk
+                    if i == 0:
+                        scheduler.started(measured["measurement_id"])
+                    if daemon and measured["gates_version"] != version:
+                        self.instrumentation.count("chunks stale gates")
+                        continue
+                    if yi2 is None:
+                        self.reject_shots(stats)
+                        continue
+                    values = None if demodulator is None else self.demodulated["values"]
+                    if demodulator is not None and (values is None or len(values) != len(gate_stats.mean)):
+                        self.instrumentation.count("chunks stale gates")
+                        continue
+                    timestamp = self.measurement_time(measured)
+                    if self.recorder is not None:
+                        with timer("record"):
+                            self.recorder.record_shots(timestamp, measured["measurement_id"], yi2)
+                    if self.accept(stats, yi2):
+                        timestamps.append(timestamp)
+                        if daemon:
+                            gate_stats.add(np.asarray(measured["gate_values"], dtype=float))
+                        elif demodulator is not None:
+                            gate_stats.add(self.demodulated["values"])
+                            variances += self.demodulated["errors"] ** 2
+                    if callback is not None:
+                        with timer("callback"):
+                            callback(yitemp, stats)
+                if self.stop_event.is_set():
+                    break
+                if not timestamps:
+                    continue  # every chunk rejected
+                timestamp = float(np.mean(timestamps))
+                currenttime = timestamp - starttime
+                with timer("gates"):
+                    if daemon or demodulator is not None:
+                        datum = gate_stats.average().copy()
+                    else:
+                        datum = self.gates.compute(stats.average())
+                if demodulator is not None:
+                    self.point_errors = np.sqrt(variances) / gate_stats.count
+                if self.recorder is not None:
+                    with timer("record"):
+                        self.recorder.record_chart(timestamp, datum)
+                if self.checkpoint is not None:
+                    self.checkpoint.add(currenttime, datum, stats)
+                if self.waterfall is not None:
+                    with timer("waterfall"):
+                        self.waterfall.append(currenttime, stats.average())
+                yield currenttime, datum, stats
+        finally:
+            self.close_recorder()
+            self.stop_event.clear()
+            if self.checkpoint is not None:
+                self.checkpoint.write()
+
+    def measurement_time(self, measured):
+        """
+        Wall-clock time of a measurement: the daemon's own "timestamp" when
+        it publishes one, otherwise when the watcher saw it arrive.
+        """
+        return measured.get("timestamp", self.watcher.arrival_time)
+
+
+class AsyncClient:
+    """
+    asyncio front end for one daemon's yaqc.Client.
+
+    yaqc clients are blocking and not thread-safe, so every call for a daemon
+    runs on that daemon's own single worker thread.  Awaiting calls to
+    different daemons therefore keeps them all in flight at once, while calls
+    to the same daemon stay in order.  Any daemon message can be awaited::
+
+        client = await AsyncClient(port).connect()
+        measured = await client.get_measured()
+    """
+
+    def __init__(self, port, host="127.0.0.1", client_factory=None, instrumentation=None):
+        self.port = port
+        self.host = host
+        self.client_factory = client_factory
+        self.instrumentation = instrumentation  # times calls as "monitor rpc <message>" when given
+        self.client = None
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix=f"yaqc-{port}"
+        )
+
+    async def connect(self):
+        factory = yaqc.Client if self.client_factory is None else self.client_factory
+        self.client = await self.run(factory, self.port, self.host)
+        return self
+
+    async def run(self, function, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(function, *args))
+
+    def __getattr__(self, name):
+        if name.startswith("_") or self.client is None:
+            raise AttributeError(name)
+        method = getattr(self.client, name)
+
+        async def call(*args):
+            if self.instrumentation is None:
+                return await self.run(method, *args)
+            with self.instrumentation.time(f"monitor rpc {name}"):
+                return await self.run(method, *args)
+
+        return call
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+class MonitoredScope:
+    """Live-view state of one daemon watched by an AsyncMonitor."""
+
+    def __init__(self, port, channel_keys, callback, host="127.0.0.1", client_factory=None, instrumentation=None):
+        self.client = AsyncClient(port, host, client_factory, instrumentation)
+        self.channel_keys = list(channel_keys)
+        self.callback = callback  # called as callback(traces) with (channel, sample) traces
+        self.singleshot = False
+        self.paused = False
+        self.measurement_id = None
+
+    async def latest(self):
+        if self.client.client is None:
+            await self.client.connect()
+        if self.singleshot:
+            yi = await self.client.get_measured_samples()  # samples:  (channel, shot, sample)
+            return yi[:, 0]
+        measured = await self.client.get_measured()
+        if measured["measurement_id"] == self.measurement_id:
+            return None
+        self.measurement_id = measured["measurement_id"]
+        return np.stack([measured[f"{key}_mean"] for key in self.channel_keys])
+
+
+class AsyncMonitor:
+    """
+    Poll the latest traces of several daemons concurrently.
+
+    Each round awaits every scope's request together, so monitoring N scopes
+    costs about one round-trip rather than N.  Scopes that are paused (for
+    example while their Engine is averaging) are skipped.
+    """
+
+    def __init__(self, interval=0.05):
+        self.interval = interval  # sec between rounds
+        self.scopes = []
+
+    def add(self, port, channel_keys, callback, host="127.0.0.1", client_factory=None, instrumentation=None):
+        scope = MonitoredScope(port, channel_keys, callback, host, client_factory, instrumentation)
+        self.scopes.append(scope)
+        return scope
+
+    async def poll(self):
+        scopes = [scope for scope in self.scopes if not scope.paused]
+        results = await asyncio.gather(*(scope.latest() for scope in scopes), return_exceptions=True)
+        for scope, traces in zip(scopes, results):
+            if isinstance(traces, Exception):
+                print(f"monitor of port {scope.client.port} failed: {traces!r}")
+                if isinstance(traces, OSError):
+                    scope.client.client = None  # reconnect next round, e.g. after a daemon restart
+            elif traces is not None and not scope.paused:
+                scope.callback(traces)
+
+    async def run(self):
+        """Poll until cancelled."""
+        try:
+            while True:
+                began = time.monotonic()
+                await self.poll()
+                await asyncio.sleep(max(self.interval - (time.monotonic() - began), 0))
+        finally:
+            self.close()
+
+    def close(self):
+        for scope in self.scopes:
+            scope.client.close()
+
+
+def parse_gate(text, channel_keys):
+    # NAME:CHANNEL:START:STOP[:METHOD]
+    parts = text.split(":")
+    if len(parts) not in (4, 5) or parts[1] not in channel_keys:
+        raise argparse.ArgumentTypeError(f"bad gate '{text}', expected NAME:CHANNEL:START:STOP[:METHOD]")
+    method = parts[4] if len(parts) == 5 else "mean"
+    return Gate(parts[0], parts[1], int(parts[2]), int(parts[3]), method=method)
+
+
+def main(argv=None):
+    """Record a chart without a display: ``python -m picotech_chart_engine PORT``."""
+    parser = argparse.ArgumentParser(prog="picotech_chart_engine", description=main.__doc__)
+    parser.add_argument("port", type=int)
+    parser.add_argument("--chunks", type=int, default=None, help="measurements averaged per chart point (default 1)")
+    parser.add_argument("--interval", type=float, default=None, help="start a chart point every this many seconds")
+    parser.add_argument("--every", type=int, default=None, help="start a chart point every this many measurements")
+    parser.add_argument(
+        "--gate",
+        action="append",
+        default=[],
+        metavar="NAME:CHANNEL:START:STOP[:METHOD]",
+        help="gate in samples, repeatable; default is samples 1-5 of every channel",
+    )
+    parser.add_argument("--nshots", type=int, default=None, help="shots per measurement, set on the daemon")
+    parser.add_argument(
+        "--tune",
+        type=float,
+        default=None,
+        metavar="SEC",
+        help="first tune nshots for the most shots per second with chart points at most SEC apart",
+    )
+    parser.add_argument("--points", type=int, default=None, help="stop after this many points")
+    parser.add_argument("--duration", type=float, default=None, help="stop after this many seconds")
+    parser.add_argument("--directory", default=".", help="where recordings are written")
+    parser.add_argument("--mock", action="store_true", help="use a simulated daemon instead of hardware")
+    parser.add_argument("--metrics", default=None, help="append timing and skip counts to this JSON lines file")
+    parser.add_argument(
+        "--checkpoint",
+        default=None,
+        help="chart checkpoint file (default picotech_PORT_checkpoint.npz in --directory)",
+    )
+    parser.add_argument("--checkpoint-interval", type=float, default=10.0, help="seconds between checkpoint writes")
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="continue the checkpointed chart: its gates, chunks, schedule and lock-in unless given, and its time axis",
+    )
+    parser.add_argument(
+        "--singleshot", action="store_true", help="read every shot of each measurement instead of the daemon's mean"
+    )
+    parser.add_argument(
+        "--reject", type=float, default=None, metavar="Z", help="with --singleshot, leave out shots above this robust z"
+    )
+    parser.add_argument(
+        "--chunk-reject",
+        type=float,
+        default=None,
+        metavar="Z",
+        help="leave out chunks above this robust z from the running mean",
+    )
+    parser.add_argument("--keep-clipped", action="store_true", help="average chunks that reach the ADC range too")
+    parser.add_argument(
+        "--lockin",
+        type=str,
+        default=None,
+        metavar="NAME:CHANNEL:START:STOP",
+        help="demodulate every measurement's shots against this reference gate (a chopper on channel A, say)",
+    )
+    parser.add_argument("--lockin-threshold", type=float, default=None, help="volts; default the midpoint")
+    parser.add_argument("--lockin-bins", type=int, default=2, help="phase bins, on being the top and off the bottom")
+    parser.add_argument("--lockin-invert", action="store_true", help="shots below the threshold are on")
+    parser.add_argument("--lockin-ratio", action="store_true", help="chart (on - off) / off instead of on - off")
+    parser.add_argument(
+        "--lockin-separation",
+        type=float,
+        default=5.0,
+        help="on and off reference levels must be this many of their standard deviations apart, else not modulated",
+    )
+    parser.add_argument(
+        "--lockin-min-contrast", type=float, default=0.0, help="volts on and off reference levels must differ by"
+    )
+    parser.add_argument(
+        "--daemon-gates",
+        action="store_true",
+        help="have the daemon's picotech_processing module compute the gates, fetching only their values",
+    )
+    parser.add_argument("--median", action="store_true", help="chart the median of each point's chunks, not the mean")
+    parser.add_argument("--shot-history", type=int, default=10000, help="with --singleshot, shots kept in memory")
+    parser.add_argument(
+        "--shot-history-file", default=None, help="with --singleshot, memory-map the shot history to this .npy file"
+    )
+    parser.add_argument(
+        "--waterfall",
+        default=None,
+        metavar="FILE.npz",
+        help="keep every point's averaged traces and save them to this file at the end, see Waterfall.load",
+    )
+    parser.add_argument("--waterfall-length", type=int, default=10000, help="with --waterfall, points kept")
+    parser.add_argument(
+        "--waterfall-file", default=None, help="with --waterfall, memory-map the traces to this .npy file"
+    )
+    args = parser.parse_args(argv)
+
+    client_factory = None
+    if args.mock:
+        from picotech_chart_mock import MockClient
+
+        client_factory = MockClient
+    checkpoint = args.checkpoint
+    if checkpoint is None:
+        checkpoint = pathlib.Path(args.directory) / f"picotech_{args.port}_checkpoint.npz"
+    state = {}
+    if args.resume and pathlib.Path(checkpoint).exists():
+        state = Checkpoint.load(checkpoint)
+        print(f"resuming {len(state['times'])} points from {checkpoint}", file=sys.stderr)
+    engine = Engine(
+        args.port,
+        record_directory=args.directory,
+        client_factory=client_factory,
+        shot_history=args.shot_history,
+        shot_history_path=args.shot_history_file,
+        checkpoint_path=checkpoint,
+        checkpoint_interval=args.checkpoint_interval,
+    ).connect()
+    engine.set_reject(args.reject)
+    engine.set_rejector(Rejector(zscore=args.chunk_reject, clip=not args.keep_clipped), median=args.median)
+    engine.set_daemon_gates(args.daemon_gates)
+    if args.lockin is not None:
+        demodulator = Demodulator(
+            parse_gate(args.lockin, engine.channel_keys),
+            threshold=args.lockin_threshold,
+            nbins=args.lockin_bins,
+            invert=args.lockin_invert,
+            ratio=args.lockin_ratio,
+            min_contrast=args.lockin_min_contrast,
+            separation=args.lockin_separation,
+        )
+        engine.set_demodulator(demodulator)
+    elif state.get("demodulator"):
+        engine.set_demodulator(Demodulator.from_dict(state["demodulator"]))
+    if args.waterfall is not None:
+        engine.waterfall = Waterfall(
+            args.waterfall_length, engine.channel_keys, engine.sample_time, path=args.waterfall_file
+        )
+    if args.gate:
+        gates = [parse_gate(text, engine.channel_keys) for text in args.gate]
+    elif state.get("gates"):
+        gates = [Gate(**gate) for gate in state["gates"]]
+    else:
+        stop = min(5, engine.nsamples)
+        gates = [Gate(f"{key} signal", key, min(1, stop - 1), stop) for key in engine.channel_keys]
+    dt = engine.sample_time[1] - engine.sample_time[0] if engine.nsamples > 1 else 1.0
+    gates = GateSet(gates, engine.channel_keys, engine.nsamples, dt=dt)
+    columns = [gate.name for gate in gates.gates]
+    if engine.demodulator is not None:
+        columns += [f"{name} error" for name in columns]
+    print("time (s)\t" + "\t".join(columns))
+    if args.interval is not None:
+        scheduler = ChartScheduler("fixed", interval=args.interval)
+    elif args.every is not None:
+        scheduler = ChartScheduler("every", every=args.every)
+    elif "schedule" in state:
+        scheduler = ChartScheduler(**state["schedule"])
+    else:
+        scheduler = ChartScheduler("fast")
+    nchunks = args.chunks if args.chunks is not None else state.get("nchunks", 1)
+    singleshot = args.singleshot or state.get("singleshot", False)
+    if args.nshots is not None:
+        engine.apply_nshots(args.nshots)
+    if args.tune is not None:
+        tuned = engine.tune_nshots(args.tune, nchunks, singleshot)
+        print(
+            f"nshots {tuned['nshots']}: {tuned['shots/sec']:.0f} shots/s, {tuned['latency']:.3f} s per point "
+            f"(trigger {tuned['shot_rate']:.0f} shots/s, overhead {tuned['overhead'] * 1000:.1f} ms, "
+            f"read {tuned['fetch'] * 1000:.1f} ms)",
+            file=sys.stderr,
+        )
+    points = engine.chart(nchunks, gates, singleshot, scheduler=scheduler, record=True, resume=args.resume)
+    metrics = None if args.metrics is None else MetricsLog(args.metrics, engine.instrumentation)
+    try:
+        for count, (elapsed, values, stats) in enumerate(points, start=1):
+            if count == 1:
+                print(f"recording to {engine.recorder.directory / engine.recorder.stem}*", file=sys.stderr)
+            if engine.point_errors is not None:
+                values = np.concatenate([values, engine.point_errors])
+            print(f"{elapsed:.3f}\t" + "\t".join(f"{value:.6g}" for value in values), flush=True)
+            if metrics is not None:
+                metrics.write()
+            if args.points is not None and count >= args.points:
+                break
+            if args.duration is not None and elapsed >= args.duration:
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        points.close()
+        if metrics is not None:
+            metrics.close()
+        if engine.waterfall is not None:
+            engine.waterfall.save(args.waterfall)
+            print(f"{len(engine.waterfall)} averaged traces saved to {args.waterfall}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
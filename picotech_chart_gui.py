@@ -2,18 +2,42 @@
 
 import sys
 import pathlib
+import concurrent.futures
+import functools
 
 from qtpy import QtCore, QtGui, QtWidgets  # type: ignore
 import pyqtgraph as pg  # type: ignore
 import qtypes  # type: ignore
 import yaqc  # type: ignore
-import toml
 import numpy as np  # type: ignore
 import time
+import asyncio
+
+try:
+    import qasync  # type: ignore
+except ImportError:
+    qasync = None
+
+from picotech_chart_engine import (
+    AsyncMonitor,
+    ChartScheduler,
+    Checkpoint,
+    DaemonCache,
+    Demodulator,
+    Engine,
+    Gate,
+    GateSet,
+    Instrumentation,
+    MetricsLog,
+    Rejector,
+    RingBuffer,
+    Waterfall,
+    range_volts,
+)
+from picotech_chart_replay import Replay
 # from io import StringIO
 
-ranges = [0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 20]
-allowed_ranges = ["{0:0.2f}".format(r) for r in ranges]
+channel_colors = {"A": "#4f8ff7", "B": "#f75f5f", "C": "#5fd75f", "D": "#f7e75f"}
 
 class Channel:
 
@@ -27,9 +51,12 @@ class Channel:
         enabled,
         coupling,
         invert,
+        name="",
     ):
         range_ = range
 
+        self.name = name
+        self.color = channel_colors.get(name, "c")
         self.enabled = qtypes.Bool(value=enabled)
         self.range = qtypes.Enum(allowed_values=Channel.ranges, initial_value=range_)
         self.invert = qtypes.Bool(value=invert)
@@ -43,7 +70,7 @@ class Channel:
         tuple
             (minimum_voltage, maximum_voltage)
         """
-        r = float(Channel.ranges[self.range.get_index()].split(" ")[0])
+        r = range_volts(Channel.ranges[self.range.get_index()])
         return -r, r
 
     def get_widget(self):
@@ -54,47 +81,350 @@ class Channel:
         return self.input_table
 
 
+class GateControls:
+    """
+    GUI state for one Gate: an enable toggle, method, baseline and
+    reference choices, and a draggable region on the samples plot.
+    """
+
+    styles = {"signal": "solid", "background": "dashed", "reference": "dotted"}
+
+    def __init__(self, channel, role, start, stop, enabled, gate_names):
+        self.name = f"{channel} {role}"
+        self.channel = channel
+        self.role = role
+        self.start = start
+        self.stop = stop
+        others = ["none"] + [name for name in gate_names if name != self.name]
+        self.enabled = qtypes.Bool(name=self.name, value=enabled)
+        self.method = qtypes.Enum(allowed_values=Gate.methods, initial_value="mean", name="  method")
+        self.baseline = qtypes.Enum(allowed_values=others, initial_value="none", name="  subtract")
+        self.reference = qtypes.Enum(allowed_values=others, initial_value="none", name="  divide by")
+        self.region = None
+
+    def get_gate(self):
+        baseline = self.baseline.get()
+        reference = self.reference.get()
+        return Gate(
+            self.name,
+            self.channel,
+            self.start,
+            self.stop,
+            method=self.method.get(),
+            baseline=None if baseline == "none" else baseline,
+            reference=None if reference == "none" else reference,
+        )
+
+    def set_choices(self, names):
+        """Offer these gate names, other than this gate's own, as baseline and reference."""
+        others = ["none"] + [name for name in names if name != self.name]
+        for control in (self.baseline, self.reference):
+            if control.get() not in others:
+                control.set("none")
+            control.set_allowed_values(others)
+
+    def set_gate(self, gate):
+        """Take method, baseline, reference and window from a Gate.to_dict dict."""
+        self.method.set(gate.get("method", "mean"))
+        self.baseline.set(gate.get("baseline") or "none")
+        self.reference.set(gate.get("reference") or "none")
+        self.start = gate["start"]
+        self.stop = gate["stop"]
+
+
+class AcquisitionWorker(QtCore.QObject):
+    """
+    Runs an Engine in its own QThread.
+
+    Requests arrive as queued signals from ConfigWidget and results are sent
+    back the same way, so the GUI thread never waits on the daemon.  All
+    acquisition logic lives in the Engine; the worker only turns its
+    callbacks and chart points into signals.
+    """
+
+    samples_ready = QtCore.Signal(object)
+    shots_ready = QtCore.Signal(object)
+    shots_finished = QtCore.Signal(object)
+    acquire_report = QtCore.Signal(int, float, object)
+    chart_ready = QtCore.Signal(float, object, object)
+    chart_finished = QtCore.Signal()
+    range_changed = QtCore.Signal(str, str)
+    shots_read = QtCore.Signal(object)
+    nshots_changed = QtCore.Signal(int)
+    nshots_tuned = QtCore.Signal(object)
+
+    def __init__(
+        self,
+        port,
+        channel_keys,
+        norm_interval=50,
+        record_directory=".",
+        live_view=True,
+        t0=None,
+        client_factory=None,
+        instrumentation=None,
+        cache=None,
+        checkpoint_path=None,
+    ):
+        super().__init__()
+        self.live_view = live_view  # False when an AsyncMonitor polls the samples view instead
+        self.engine = Engine(
+            port,
+            channel_keys,
+            record_directory=record_directory,
+            t0=t0,
+            client_factory=client_factory,
+            instrumentation=instrumentation,
+            cache=cache,
+            checkpoint_path=checkpoint_path,
+        )
+        self.engine.range_listeners.append(self.range_changed.emit)
+        self.engine.nshots_listeners.append(self.nshots_changed.emit)
+        self.engine.shot_listeners.append(self.shots_read.emit)  # single shot batches, once per measurement
+        self.norm_interval = norm_interval  # msec
+        self.busy = False
+        self.singleshot = False
+
+    @QtCore.Slot()
+    def start(self):
+        # client and timer must be created inside the worker thread
+        self.engine.connect()
+        self.poll_timer = QtCore.QTimer()
+        self.poll_timer.timeout.connect(self.poll)
+        self.poll_timer.start(self.norm_interval)
+
+    @QtCore.Slot()
+    def close(self):
+        self.poll_timer.stop()
+
+    def stop(self):
+        """Request that a running acquisition or chart return. Safe from any thread."""
+        if self.busy:  # a stop requested while idle would cut short the next reconnect
+            self.engine.stop()
+
+    def request_range(self, key, value):
+        """Queue a channel range change, applied between chunks. Safe from any thread."""
+        self.engine.request_range(key, value)
+
+    def request_nshots(self, nshots):
+        """Queue an nshots change, applied between chunks. Safe from any thread."""
+        self.engine.request_nshots(nshots)
+
+    def set_gates(self, gates):
+        """Swap in a new GateSet for a running chart and for single shot values. Safe from any thread."""
+        self.engine.set_gates(gates)
+
+    def set_reject(self, threshold):
+        """Set the single shot outlier threshold, None for off. Safe from any thread."""
+        self.engine.set_reject(threshold)
+
+    def set_rejector(self, rejector, median=False):
+        """Swap in a new chunk Rejector and choose median or mean. Safe from any thread."""
+        self.engine.set_rejector(rejector, median)
+
+    def set_daemon_gates(self, enabled):
+        """Chart gate values computed in the daemon, from the next chart on. Safe from any thread."""
+        self.engine.set_daemon_gates(enabled)
+
+    @QtCore.Slot()
+    def poll(self):
+        if self.busy:
+            return
+        try:
+            if not self.live_view:
+                self.engine.apply_pending()
+                return
+            traces = self.engine.latest(self.singleshot)
+        except OSError as error:  # the daemon dropped out between runs: reconnect as the loops do
+            try:
+                self.engine.recover(error)
+            except (TimeoutError, RuntimeError) as failure:  # no daemon yet, or one with another layout
+                print(f"{failure}, trying again")
+            return
+        if traces is not None:
+            self.samples_ready.emit(traces)
+
+    @QtCore.Slot(bool)
+    def set_singleshot(self, singleshot):
+        self.singleshot = singleshot
+
+    def on_chunk(self, traces, stats):
+        self.samples_ready.emit(traces)
+        self.shots_ready.emit(stats.snapshot())
+
+    @QtCore.Slot(int, bool, bool, object)
+    def acquire_nchunks(self, chunks, singleshot, record, target=None):
+        self.busy = True
+        try:
+            result = self.engine.acquire(chunks, singleshot, record, target, callback=self.on_chunk)
+        finally:
+            self.busy = False
+        self.shots_finished.emit(result)
+        self.acquire_report.emit(result["count"], result["seconds"], result["snr"])
+
+    @QtCore.Slot(float, int, bool)
+    def tune_nshots(self, target_latency, chunks, singleshot):
+        self.busy = True
+        try:
+            result = self.engine.tune_nshots(target_latency, chunks, singleshot)
+        finally:
+            self.busy = False
+        self.nshots_tuned.emit(result)
+
+    @QtCore.Slot(int, bool, object, object, bool, bool, object)
+    def run_chart(self, chunks, singleshot, scheduler, gates, record, resume=False, demodulator=None):
+        self.busy = True
+        self.engine.set_demodulator(demodulator)
+        try:
+            points = self.engine.chart(
+                chunks, gates, singleshot, scheduler, record, callback=self.on_chunk, resume=resume
+            )
+            for elapsed, values, stats in points:
+                self.shots_finished.emit(stats.snapshot())
+                self.chart_ready.emit(elapsed, values, self.engine.point_errors)
+        finally:
+            self.engine.set_demodulator(None)
+            self.busy = False
+            self.chart_finished.emit()
+
+
 class ConfigWidget(QtWidgets.QWidget):
-    def __init__(self, port):
+    acquire_requested = QtCore.Signal(int, bool, bool, object)
+    chart_requested = QtCore.Signal(int, bool, object, object, bool, bool, object)
+    singleshot_requested = QtCore.Signal(bool)
+    tune_requested = QtCore.Signal(float, int, bool)
+
+    def __init__(
+        self,
+        port,
+        monitor=None,
+        render_timer=None,
+        t0=None,
+        client_factory=None,
+        client=None,
+        cache=None,
+        resume=False,
+    ):
         super().__init__()
         self.port = port
+        self.monitor = monitor
+        self.t0 = t0  # shared chart origin when several scopes run side by side
+        self.client_factory = client_factory  # yaqc.Client unless given, e.g. a MockClient
+        # daemon metadata, read once and shared with the worker's engine
+        self.cache = DaemonCache() if cache is None else cache
         
-        self.client = yaqc.Client(self.port)
-        config = toml.loads(self.client.get_config())
-        self.time = self.client.get_mappings()['time']
+        if client is None:
+            client = yaqc.Client(self.port) if client_factory is None else client_factory(self.port)
+        self.client = client
+        config = self.cache.get("config", self.client)
+        self.time = self.cache.get("mappings", self.client)['time']
         self.nsamples = config["max_samples"]
         self.channels = {}
-        self.types = {v["name"]: v for v in self.client._protocol["types"]}
+        self.types = self.cache.get("types", self.client)
         Channel.ranges = self.types["adc_range"]["symbols"]
         Channel.couplings = self.types["adc_coupling"]["symbols"]
         for name, d in config["channels"].items():
-            self.channels[name] = Channel(**d, nsamples=self.nsamples)
-        
-        
-        self.signal_channel_key="B"
-        self.signal_channel_index=int(1)
+            self.channels[name] = Channel(**d, nsamples=self.nsamples, name=name)
+        # every enabled channel is acquired, in daemon order
+        self.channel_keys = [name for name, channel in self.channels.items() if channel.enabled.get()]
+
         self.norm_interval=50 #msec
+        self.render_interval=20 #msec
         self.nchunks=int(1)
-        self.beginning_sample=int(0)
-        self.ending_sample=int(5)
         self.shotsdata=[]
-        self.chartdata=[]
-        self.charttimedata=[]
-        self.wait_time=0.05
+        self.shotsstats={}
+        self.chart_retention=int(100000)
+        self.chartdata=RingBuffer(self.chart_retention, shape=(0,))
+        self.charttimedata=RingBuffer(self.chart_retention)
+        self.charterrors=RingBuffer(self.chart_retention, shape=(0,))  # lock-in standard errors
+        # averaged traces of every chart point, drawn as a trace-vs-time image on the waterfall tab
+        self.waterfall_length=int(10000)
+        self.waterfall=Waterfall(self.waterfall_length, self.channel_keys, self.time)
         self.busy=False
         self.stopchart=False
         self.chartstopped=True
-        self.stopchartboolean=False
         self.singleshot=False
-        self.client.set_nshots(100)
-        self.measure_id=0.00
+        self.chart_gate_names=[]
+        self.target_names=[]
+        # single shot gate values of the histogram gate, newest last
+        self.histogram_length=int(10000)
+        self.histogram_values=RingBuffer(self.histogram_length)
+        self.histogram_keep=RingBuffer(self.histogram_length, dtype=bool)
+        self.histogram_dirty=False
+        # timers and counters shared with the worker, shown in the diagnostics tab
+        self.instrumentation=Instrumentation()
+        self.metrics_log=None
+        # charts are checkpointed here by the worker; with resume the last one is continued
+        self.checkpoint_path=pathlib.Path(f"picotech_{self.port}_checkpoint.npz")
+        self.resume_state=None
 
-        self.config = toml.loads(self.client.get_config())
+        self.config = config
 
         self.create_frame()
-        self.poll_timer = QtCore.QTimer()
-        self.poll_timer.start(self.norm_interval)  # milliseconds
-        self.poll_timer.timeout.connect(self.update)
+        self.create_worker()
+        # with an AsyncMonitor the live samples view is polled together with other daemons
+        self.monitor_scope = None
+        if self.monitor is not None:
+            self.monitor_scope = self.monitor.add(
+                self.port,
+                self.channel_keys,
+                self.on_monitor_samples,
+                client_factory=client_factory,
+                instrumentation=self.instrumentation,
+            )
+        # plots redraw at their own rate, independent of the daemon; scopes in one window share a timer
+        if render_timer is None:
+            render_timer = QtCore.QTimer()
+            render_timer.start(self.render_interval)  # milliseconds
+        self.render_timer = render_timer
+        self.render_timer.timeout.connect(self.render)
+        if resume:
+            self.resume_chart()
+
+    def create_worker(self):
+        self.worker = AcquisitionWorker(
+            self.port,
+            self.channel_keys,
+            norm_interval=self.norm_interval,
+            live_view=self.monitor is None,
+            t0=self.t0,
+            client_factory=self.client_factory,
+            instrumentation=self.instrumentation,
+            cache=self.cache,
+            checkpoint_path=self.checkpoint_path,
+        )
+        self.worker_thread = QtCore.QThread()
+        self.worker.moveToThread(self.worker_thread)
+        self.worker_thread.started.connect(self.worker.start)
+        # requests (queued into the worker thread)
+        self.acquire_requested.connect(self.worker.acquire_nchunks)
+        self.chart_requested.connect(self.worker.run_chart)
+        self.singleshot_requested.connect(self.worker.set_singleshot)
+        self.tune_requested.connect(self.worker.tune_nshots)
+        # results (queued back into the GUI thread)
+        self.worker.samples_ready.connect(self.on_samples_ready)
+        self.worker.shots_ready.connect(self.on_shots_ready)
+        self.worker.shots_finished.connect(self.on_shots_finished)
+        self.worker.acquire_report.connect(self.on_acquire_report)
+        self.worker.chart_ready.connect(self.on_chart_ready)
+        self.worker.chart_finished.connect(self.on_chart_finished)
+        self.worker.range_changed.connect(self.on_range_changed)
+        self.worker.nshots_changed.connect(self.on_nshots_changed)
+        self.worker.nshots_tuned.connect(self.on_nshots_tuned)
+        self.worker.shots_read.connect(self.on_shots_read)
+        self.worker.set_gates(self.build_gates())
+        self.on_rejection_updated()
+        self.worker_thread.start()
+
+    def close_worker(self):
+        self.diagnostics_timer.stop()
+        if self.metrics_log is not None:
+            self.metrics_log.close()
+            self.metrics_log = None
+        self.worker.engine.stop()  # also cuts short a reconnect of the idle poll
+        QtCore.QMetaObject.invokeMethod(self.worker, "close", QtCore.Qt.BlockingQueuedConnection)
+        self.worker_thread.quit()
+        self.worker_thread.wait()
 
 
     def create_frame(self):
@@ -122,6 +452,20 @@ class ConfigWidget(QtWidgets.QWidget):
         chart_widget.setLayout(chart_box)
         self.tabs.addTab(chart_widget, "Chart")
         self.create_chart_tab(chart_box)
+        # waterfall tab
+        waterfall_widget = QtWidgets.QWidget()
+        waterfall_box = QtWidgets.QHBoxLayout()
+        waterfall_box.setContentsMargins(0, 10, 0, 0)
+        waterfall_widget.setLayout(waterfall_box)
+        self.tabs.addTab(waterfall_widget, "Waterfall")
+        self.create_waterfall_tab(waterfall_box)
+        # diagnostics tab
+        diagnostics_widget = QtWidgets.QWidget()
+        diagnostics_box = QtWidgets.QHBoxLayout()
+        diagnostics_box.setContentsMargins(0, 10, 0, 0)
+        diagnostics_widget.setLayout(diagnostics_box)
+        self.tabs.addTab(diagnostics_widget, "Diagnostics")
+        self.create_diagnostics_tab(diagnostics_box)
         # finish
         self.layout().addWidget(self.tabs)
         self.update_samples_tab()
@@ -133,11 +477,15 @@ class ConfigWidget(QtWidgets.QWidget):
         layout.addWidget(display_container_widget)
 
         textbox=QtWidgets.QLabel()
-        textbox.setText(f"Channel {self.signal_channel_key} trace and current voltage range")
+        textbox.setText(f"Channel {', '.join(self.channel_keys)} traces and current voltage range")
         textbox.show()
 
-        self.samples_plot_widget = Plot1D(yAutoRange=False)    
-        self.samples_plot_scatter = self.samples_plot_widget.add_scatter()
+        self.samples_plot_widget = Plot1D(yAutoRange=False, name="samples", instrumentation=self.instrumentation)    
+        self.samples_plot_curves = self.add_channel_curves(self.samples_plot_widget)
+        # single shot persistence: the measurement's other shots drawn faintly behind the first
+        self.samples_plot_overlays = [
+            self.samples_plot_widget.add_overlay(color=self.channels[key].color) for key in self.channel_keys
+        ]
         self.samples_plot_widget.set_labels(xlabel="sample time(ns)", ylabel="volts")
         self.samples_plot_max_voltage_line = self.samples_plot_widget.add_infinite_line(
             color="y", angle=0
@@ -160,15 +508,23 @@ class ConfigWidget(QtWidgets.QWidget):
         
         input_table = qtypes.widgets.InputTable()
         settings_layout.addWidget(input_table)
-        self.voltage_range = qtypes.Enum(allowed_values=Channel.ranges, initial_value=self.config["channels"][self.signal_channel_key]["range"],  name="voltage_range")
-        self.voltage_range.updated.connect(self.on_voltage_range_updated)
-        input_table.append(self.voltage_range)
+        for key in self.channel_keys:
+            channel = self.channels[key]
+            channel.range.updated.connect(lambda key=key: self.on_voltage_range_updated(key))
+            input_table.append(channel.range, f"Channel {key} Range")
         
         self.single_shot_button = QtWidgets.QCheckBox("SINGLE SHOT")
+        self.single_shot_button.toggled.connect(self.on_single_shot_toggled)
         settings_layout.addWidget(self.single_shot_button)
+        input_table2 = qtypes.widgets.InputTable()
+        self.persistence = qtypes.Number(name="Persistence (shots)", value=20, decimals=0)
+        input_table2.append(self.persistence)
+        settings_layout.addWidget(input_table2)
 
         settings_layout.addStretch(1)
-        self.sample_xi = self.client.get_mappings()['time']
+        self.sample_xi = self.time
+        # gates, each drawn as a draggable region on the samples plot
+        self.create_gates()
 
     def create_shots_tab(self, layout):
         display_container_widget = QtWidgets.QWidget()
@@ -177,10 +533,19 @@ class ConfigWidget(QtWidgets.QWidget):
         display_layout.setContentsMargins(0, 0, 0, 0)
         layout.addWidget(display_container_widget)
         
-        self.shots_plot_widget = Plot1D()
-        self.shots_plot_scatter = self.shots_plot_widget.add_scatter()
+        self.shots_plot_widget = Plot1D(name="shots", instrumentation=self.instrumentation)
+        self.shots_plot_bands = [
+            self.shots_plot_widget.add_band(color=self.channels[key].color) for key in self.channel_keys
+        ]
+        self.shots_plot_curves = self.add_channel_curves(self.shots_plot_widget)
         self.shots_plot_widget.set_labels(xlabel="time (nsec)", ylabel="volts")
-        display_layout.addWidget(self.shots_plot_widget)
+        display_layout.addWidget(self.shots_plot_widget, 2)
+        # single shot: shot-to-shot distribution of one gate, kept and rejected shots
+        self.histogram_plot_widget = Plot1D(name="histogram", instrumentation=self.instrumentation)
+        self.histogram_plot_kept = self.histogram_plot_widget.add_histogram(color="c")
+        self.histogram_plot_rejected = self.histogram_plot_widget.add_histogram(color="r")
+        self.histogram_plot_widget.set_labels(xlabel="gate value", ylabel="shots")
+        display_layout.addWidget(self.histogram_plot_widget, 1)
         line = qtypes.widgets.Line("V")
         layout.addWidget(line)
         
@@ -193,21 +558,95 @@ class ConfigWidget(QtWidgets.QWidget):
         layout.addWidget(settings_scroll_area)
 
         input_table = qtypes.widgets.InputTable()
-        self.nchunks_temp = qtypes.Number(name=f"Num of chunks of {self.client.get_nshots()} Shots", value=1, decimals=0)
+        self.nchunks_temp = qtypes.Number(name="Num of chunks", value=1, decimals=0)
         self.nchunks_temp.updated.connect(self.on_nchunks_updated)
         input_table.append(self.nchunks_temp)
+        # applied between chunks, so acquisition keeps running
+        self.nshots_control = qtypes.Number(
+            name="Shots per Chunk (nshots)", value=self.cache.get("nshots", self.client), decimals=0
+        )
+        self.nshots_control.updated.connect(self.on_nshots_updated)
+        input_table.append(self.nshots_control)
+        # auto tune: the most shots per second with chart points at most this far apart
+        self.tune_latency = qtypes.Number(name="Target Point Latency (sec)", value=1.0, decimals=3)
+        input_table.append(self.tune_latency)
         settings_layout.addWidget(input_table)
+        self.tune_button = qtypes.widgets.PushButton("AUTO TUNE NSHOTS", background="orange")
+        self.tune_button.clicked.connect(self.tune_nshots)
+        settings_layout.addWidget(self.tune_button)
+        self.tune_label = QtWidgets.QLabel()
+        settings_layout.addWidget(self.tune_label)
                
         self.run_shots_button = qtypes.widgets.PushButton("ACQUIRE", background="green")
         self.run_shots_button.clicked.connect(self.acquire_nchunks)
         settings_layout.addWidget(self.run_shots_button)
+
+        # stream each chunk to disk while acquiring
+        self.record_shots_button = QtWidgets.QCheckBox("RECORD")
+        settings_layout.addWidget(self.record_shots_button)
+
+        # stop early once every channel's integration window reaches the target;
+        # "Num of chunks" is then the maximum
+        self.auto_stop_button = QtWidgets.QCheckBox("AUTO STOP")
+        settings_layout.addWidget(self.auto_stop_button)
+        input_table3 = qtypes.widgets.InputTable()
+        self.target_kind = qtypes.Enum(allowed_values=["snr", "sem"], initial_value="snr", name="Target")
+        input_table3.append(self.target_kind)
+        self.target_value = qtypes.Number(name="Target Value (SNR or V)", value=100, decimals=4)
+        input_table3.append(self.target_value)
+        settings_layout.addWidget(input_table3)
+        self.report_label = QtWidgets.QLabel()
+        settings_layout.addWidget(self.report_label)
         line = qtypes.widgets.Line("H")
         settings_layout.addWidget(line)
 
         input_table2= qtypes.widgets.InputTable()
         self.chunk_temp = qtypes.Number(name="Current chunk:", value=1, decimals=0)
         input_table2.append(self.chunk_temp)
+        self.error_band = qtypes.Enum(allowed_values=["none", "sem", "std"], initial_value="sem", name="Error Band")
+        input_table2.append(self.error_band)
         settings_layout.addWidget(input_table2)
+
+        # median standard error per channel, to judge when averaging is enough
+        self.stats_label = QtWidgets.QLabel()
+        settings_layout.addWidget(self.stats_label)
+        line = qtypes.widgets.Line("H")
+        settings_layout.addWidget(line)
+
+        # chunks are checked before they are averaged, in the chart tab too
+        self.reject_clipped_button = QtWidgets.QCheckBox("REJECT CLIPPED CHUNKS")
+        self.reject_clipped_button.setChecked(True)
+        self.reject_clipped_button.toggled.connect(self.on_rejection_updated)
+        settings_layout.addWidget(self.reject_clipped_button)
+        self.reject_glitches_button = QtWidgets.QCheckBox("REJECT GLITCHED CHUNKS")
+        self.reject_glitches_button.toggled.connect(self.on_rejection_updated)
+        settings_layout.addWidget(self.reject_glitches_button)
+        input_table5 = qtypes.widgets.InputTable()
+        self.glitch_threshold = qtypes.Number(name="Glitch Above (robust z)", value=6, decimals=2)
+        self.glitch_threshold.updated.connect(self.on_rejection_updated)
+        input_table5.append(self.glitch_threshold)
+        self.combine = qtypes.Enum(allowed_values=["mean", "median"], initial_value="mean", name="Combine Chunks")
+        self.combine.updated.connect(self.on_rejection_updated)
+        input_table5.append(self.combine)
+        settings_layout.addWidget(input_table5)
+        line = qtypes.widgets.Line("H")
+        settings_layout.addWidget(line)
+
+        # single shot: leave outlying shots out of the average, judged on the enabled gates
+        self.reject_button = QtWidgets.QCheckBox("REJECT OUTLIER SHOTS")
+        self.reject_button.toggled.connect(self.on_reject_updated)
+        settings_layout.addWidget(self.reject_button)
+        input_table4 = qtypes.widgets.InputTable()
+        self.reject_threshold = qtypes.Number(name="Shot Outlier Above (robust z)", value=5, decimals=2)
+        self.reject_threshold.updated.connect(self.on_reject_updated)
+        input_table4.append(self.reject_threshold)
+        names = [controls.name for controls in self.gate_controls]
+        self.histogram_gate = qtypes.Enum(allowed_values=names, initial_value=names[0], name="Histogram Gate")
+        self.histogram_gate.updated.connect(self.clear_histogram)
+        input_table4.append(self.histogram_gate)
+        settings_layout.addWidget(input_table4)
+        self.histogram_label = QtWidgets.QLabel()
+        settings_layout.addWidget(self.histogram_label)
         line = qtypes.widgets.Line("H")
         settings_layout.addWidget(line)
         
@@ -227,8 +666,10 @@ class ConfigWidget(QtWidgets.QWidget):
         display_layout.setContentsMargins(0, 0, 0, 0)
         layout.addWidget(display_container_widget)
         
-        self.chart_plot_widget = Plot1D()
-        self.chart_plot_scatter = self.chart_plot_widget.add_scatter()
+        self.chart_plot_widget = Plot1D(max_fps=10, name="chart", instrumentation=self.instrumentation)
+        self.chart_plot_curves = []
+        self.chart_plot_bands = []
+        self.chart_plot_widget.add_legend()
         self.chart_plot_widget.set_labels(xlabel="chart time (sec)", ylabel="volts")
         display_layout.addWidget(self.chart_plot_widget)
         line1 = qtypes.widgets.Line("V")
@@ -243,22 +684,62 @@ class ConfigWidget(QtWidgets.QWidget):
         layout.addWidget(settings_scroll_area)
         
         input_table1 = qtypes.widgets.InputTable()
-        self.wait_time_temp = qtypes.Number(name="Wait Time (sec)", value=0.00, decimals=3)
-        self.wait_time_temp.updated.connect(self.on_wait_time_updated)
-        input_table1.append(self.wait_time_temp)
+        # when chart points start: as fast as possible, every interval, or every N measurements
+        self.chart_schedule = qtypes.Enum(
+            allowed_values=ChartScheduler.modes, initial_value="fast", name="Schedule"
+        )
+        input_table1.append(self.chart_schedule)
+        self.chart_interval = qtypes.Number(name="Interval (sec)", value=1.0, decimals=3)
+        input_table1.append(self.chart_interval)
+        self.chart_every = qtypes.Number(name="Every N Measurements", value=10, decimals=0)
+        input_table1.append(self.chart_every)
         self.settings_layout.addWidget(input_table1)
                 
-        input_table2 = qtypes.widgets.InputTable()
-        self.beginning_sample_temp = qtypes.Number(name="Beginning Sample", value=1, decimals=0)
-        self.beginning_sample_temp.updated.connect(self.on_beginning_sample_updated)
-        input_table2.append(self.beginning_sample_temp)
-        self.settings_layout.addWidget(input_table2)
-                    
-        input_table3 = qtypes.widgets.InputTable()
-        self.ending_sample_temp = qtypes.Number(name="Ending Sample", value=5, decimals=0)
-        self.ending_sample_temp.updated.connect(self.on_ending_sample_updated)
-        input_table3.append(self.ending_sample_temp)
-        self.settings_layout.addWidget(input_table3)
+        # gates (created with the samples tab, where their regions are drawn)
+        gate_table = qtypes.widgets.InputTable()
+        for controls in self.gate_controls:
+            gate_table.append(controls.enabled)
+            gate_table.append(controls.method)
+            gate_table.append(controls.baseline)
+            gate_table.append(controls.reference)
+        self.settings_layout.addWidget(gate_table)
+
+        # lock-in: each measurement's shots split into on and off (or phase bins) by a reference gate,
+        # e.g. a chopper on channel A, and the difference charted with its standard error
+        self.lockin_button = QtWidgets.QCheckBox("LOCK-IN")
+        self.settings_layout.addWidget(self.lockin_button)
+        lockin_table = qtypes.widgets.InputTable()
+        names = [controls.name for controls in self.gate_controls]
+        self.lockin_reference = qtypes.Enum(allowed_values=names, initial_value=names[0], name="Reference Gate")
+        lockin_table.append(self.lockin_reference)
+        self.lockin_split = qtypes.Enum(
+            allowed_values=["midpoint", "threshold"], initial_value="midpoint", name="Split At"
+        )
+        lockin_table.append(self.lockin_split)
+        self.lockin_threshold = qtypes.Number(name="Threshold (V)", value=0.5, decimals=3)
+        lockin_table.append(self.lockin_threshold)
+        self.lockin_bins = qtypes.Number(name="Phase Bins", value=2, decimals=0)
+        lockin_table.append(self.lockin_bins)
+        self.lockin_output = qtypes.Enum(
+            allowed_values=Demodulator.outputs, initial_value="difference", name="Output"
+        )
+        lockin_table.append(self.lockin_output)
+        # below these the reference is taken as unmodulated and the chunk rejected
+        self.lockin_separation = qtypes.Number(name="Min Separation (std)", value=5.0, decimals=1)
+        lockin_table.append(self.lockin_separation)
+        self.lockin_min_contrast = qtypes.Number(name="Min Contrast (V)", value=0.0, decimals=3)
+        lockin_table.append(self.lockin_min_contrast)
+        self.settings_layout.addWidget(lockin_table)
+        self.lockin_invert_button = QtWidgets.QCheckBox("INVERT REFERENCE")
+        self.settings_layout.addWidget(self.lockin_invert_button)
+        self.lockin_label = QtWidgets.QLabel()
+        self.settings_layout.addWidget(self.lockin_label)
+
+        input_table4 = qtypes.widgets.InputTable()
+        self.chart_retention_temp = qtypes.Number(name="Chart History (points)", value=self.chart_retention, decimals=0)
+        self.chart_retention_temp.updated.connect(self.on_chart_retention_updated)
+        input_table4.append(self.chart_retention_temp)
+        self.settings_layout.addWidget(input_table4)
 
         line2 = qtypes.widgets.Line("H")
         self.settings_layout.addWidget(line2)
@@ -270,8 +751,21 @@ class ConfigWidget(QtWidgets.QWidget):
         
         # stop button
         self.stop_chart_button = QtWidgets.QCheckBox("STOP")
+        self.stop_chart_button.toggled.connect(self.on_stop_chart_toggled)
         self.settings_layout.addWidget(self.stop_chart_button)
 
+        # stream each chunk and chart point to disk while running
+        self.record_chart_button = QtWidgets.QCheckBox("RECORD")
+        self.settings_layout.addWidget(self.record_chart_button)
+        # with picotech_processing as the daemon's shots_processing_path only gate values need fetching
+        self.daemon_gates_button = QtWidgets.QCheckBox("GATES IN DAEMON")
+        if "gate_values" in self.cache.get("channel_names", self.client):
+            self.daemon_gates_button.toggled.connect(self.on_daemon_gates_toggled)
+        else:
+            self.daemon_gates_button.setEnabled(False)
+            self.daemon_gates_button.setToolTip("set the daemon's shots_processing_path to picotech_processing.py")
+        self.settings_layout.addWidget(self.daemon_gates_button)
+
         # save button
         self.save_chart_button = qtypes.widgets.PushButton("SAVE", background="orange")
         self.save_chart_button.clicked.connect(self.on_save_chart_updated)
@@ -281,43 +775,289 @@ class ConfigWidget(QtWidgets.QWidget):
         self.settings_layout.addStretch(1)
         #self.shot_channel_combo.updated.emit()
 
-    def write_config_single_key_range(self,key,value):
-        # create dictionary, starting from existing
-        config = toml.loads(self.client.get_config())
-        # search channel fo key equal to channel letter
-        for k in config["channels"].keys():
-            #channel = self.channels[k]
-            if k==key:
-                
-                config["channels"][k]["range"] = value
+    def create_waterfall_tab(self, layout):
+        display_container_widget = QtWidgets.QWidget()
+        display_container_widget.setLayout(QtWidgets.QVBoxLayout())
+        display_layout = display_container_widget.layout()
+        display_layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(display_container_widget)
 
-        """
-        print(toml.dumps({
-            self.client.id()["name"]: {"channels": config["channels"]}
-        }))
-        """
-        with open(self.client.get_config_filepath(), "w") as f:
-            toml.dump({self.client.id()["name"]: config}, f)
-        self.client.shutdown(restart=True)
-        while True:
-            try:
-                self.client = yaqc.Client(self.port)
-            except:
-                print("tried to connect")
-                time.sleep(0.1)
-            else:
-                break
+        # one image row per chart point, drawn in tiles so a new point redraws only the newest one
+        self.waterfall_plot_widget = Plot1D(max_fps=5, name="waterfall", instrumentation=self.instrumentation)
+        self.waterfall_view = WaterfallView(self.waterfall_plot_widget)
+        self.waterfall_plot_widget.set_labels(xlabel="sample time (ns)", ylabel="chart time (sec)")
+        display_layout.addWidget(self.waterfall_plot_widget, stretch=2)
+        # gates recomputed over the stored traces
+        self.recompute_plot_widget = Plot1D(max_fps=5, name="recomputed", instrumentation=self.instrumentation)
+        self.recompute_plot_curves = []
+        self.recompute_plot_widget.add_legend()
+        self.recompute_plot_widget.set_labels(xlabel="chart time (sec)", ylabel="volts")
+        display_layout.addWidget(self.recompute_plot_widget, stretch=1)
+        line = qtypes.widgets.Line("V")
+        layout.addWidget(line)
+
+        settings_container_widget = QtWidgets.QWidget()
+        settings_scroll_area = qtypes.widgets.ScrollArea()
+        settings_scroll_area.setWidget(settings_container_widget)
+        settings_container_widget.setLayout(QtWidgets.QVBoxLayout())
+        settings_layout = settings_container_widget.layout()
+        settings_layout.setContentsMargins(5, 5, 5, 5)
+        layout.addWidget(settings_scroll_area)
 
-    def on_beginning_sample_updated(self):
-        new = int(self.beginning_sample_temp.get())
+        input_table = qtypes.widgets.InputTable()
+        self.waterfall_channel = qtypes.Enum(
+            allowed_values=self.channel_keys, initial_value=self.channel_keys[0], name="Channel"
+        )
+        self.waterfall_channel.updated.connect(self.on_waterfall_channel_updated)
+        input_table.append(self.waterfall_channel)
+        # history length and storage take effect from the next chart run
+        self.waterfall_length_temp = qtypes.Number(
+            name="Waterfall History (points)", value=self.waterfall_length, decimals=0
+        )
+        self.waterfall_length_temp.updated.connect(self.on_waterfall_length_updated)
+        input_table.append(self.waterfall_length_temp)
+        settings_layout.addWidget(input_table)
+        self.waterfall_memmap_button = QtWidgets.QCheckBox("KEEP ON DISK")
+        self.waterfall_memmap_button.setToolTip(f"memory-map the traces to picotech_{self.port}_waterfall.npy")
+        settings_layout.addWidget(self.waterfall_memmap_button)
+        self.waterfall_label = QtWidgets.QLabel()
+        settings_layout.addWidget(self.waterfall_label)
+
+        line2 = qtypes.widgets.Line("H")
+        settings_layout.addWidget(line2)
+
+        # recompute button
+        self.recompute_button = qtypes.widgets.PushButton("RECOMPUTE GATES", background="orange")
+        self.recompute_button.clicked.connect(self.recompute_gates)
+        settings_layout.addWidget(self.recompute_button)
+
+        # replay a recording into the waterfall, to try other gates on it
+        self.open_recording_button = qtypes.widgets.PushButton("OPEN RECORDING", background="orange")
+        self.open_recording_button.clicked.connect(self.open_recording)
+        settings_layout.addWidget(self.open_recording_button)
+
+        # save button
+        self.save_waterfall_button = qtypes.widgets.PushButton("SAVE", background="orange")
+        self.save_waterfall_button.clicked.connect(self.on_save_waterfall_updated)
+        settings_layout.addWidget(self.save_waterfall_button)
+
+        settings_layout.addStretch(1)
+
+    def create_diagnostics_tab(self, layout):
+        self.diagnostics_text = QtWidgets.QPlainTextEdit()
+        self.diagnostics_text.setReadOnly(True)
+        self.diagnostics_text.setFont(QtGui.QFontDatabase.systemFont(QtGui.QFontDatabase.FixedFont))
+        layout.addWidget(self.diagnostics_text)
+        line = qtypes.widgets.Line("V")
+        layout.addWidget(line)
+
+        settings_container_widget = QtWidgets.QWidget()
+        settings_scroll_area = qtypes.widgets.ScrollArea()
+        settings_scroll_area.setWidget(settings_container_widget)
+        settings_container_widget.setLayout(QtWidgets.QVBoxLayout())
+        settings_layout = settings_container_widget.layout()
+        settings_layout.setContentsMargins(5, 5, 5, 5)
+        layout.addWidget(settings_scroll_area)
+
+        # reset button
+        self.reset_diagnostics_button = qtypes.widgets.PushButton("RESET", background="orange")
+        self.reset_diagnostics_button.clicked.connect(self.instrumentation.reset)
+        settings_layout.addWidget(self.reset_diagnostics_button)
+
+        # append a summary every second to a JSON lines file
+        self.metrics_log_button = QtWidgets.QCheckBox("METRICS LOG")
+        self.metrics_log_button.toggled.connect(self.on_metrics_log_toggled)
+        settings_layout.addWidget(self.metrics_log_button)
+
+        settings_layout.addStretch(1)
+        self.diagnostics_timer = QtCore.QTimer()
+        self.diagnostics_timer.timeout.connect(self.update_diagnostics)
+        self.diagnostics_timer.start(1000)  # milliseconds
+
+    def on_metrics_log_toggled(self, checked):
+        if checked:
+            path = f"picotech_{self.port}_metrics_{time.strftime('%Y%m%d_%H%M%S')}.jsonl"
+            self.metrics_log = MetricsLog(path, self.instrumentation)
+            print(f"metrics logged to {path}")
+        elif self.metrics_log is not None:
+            self.metrics_log.close()
+            self.metrics_log = None
+
+    def update_diagnostics(self):
+        if self.metrics_log is not None:
+            self.metrics_log.write()
+        if self.diagnostics_text.isVisible():
+            self.diagnostics_text.setPlainText(self.instrumentation.format())
+
+    def create_gates(self):
+        # signal gate on by default, background and reference gates ready to enable
+        nsamples = len(self.sample_xi)
+        defaults = {
+            "signal": (min(1, nsamples - 1), min(5, nsamples), True),
+            "background": (max(nsamples - 10, 0), nsamples, False),
+            "reference": (min(5, nsamples - 1), min(10, nsamples), False),
+        }
+        names = [f"{key} {role}" for key in self.channel_keys for role in defaults]
+        self.gate_controls = []
+        self.updating_gate_choices = False
+        for key in self.channel_keys:
+            for role, (start, stop, enabled) in defaults.items():
+                controls = GateControls(key, role, start, stop, enabled, names)
+                controls.region = self.samples_plot_widget.add_region(
+                    (self.sample_xi[start], self.sample_xi[stop - 1]),
+                    color=self.channels[key].color,
+                )
+                controls.region.sigRegionChangeFinished.connect(
+                    lambda region, controls=controls: self.on_gate_region_updated(controls)
+                )
+                controls.region.setVisible(enabled)
+                for control in (controls.method, controls.baseline, controls.reference):
+                    control.updated.connect(self.on_gates_updated)
+                controls.enabled.updated.connect(
+                    lambda controls=controls: self.on_gate_enabled_updated(controls)
+                )
+                self.gate_controls.append(controls)
+        self.update_gate_choices()
+
+    def build_gates(self):
+        gates = [controls.get_gate() for controls in self.gate_controls if controls.enabled.get()]
+        dt = self.sample_xi[1] - self.sample_xi[0] if len(self.sample_xi) > 1 else 1.0
+        return GateSet(gates, self.channel_keys, len(self.sample_xi), dt=dt)
+
+    def on_gate_region_updated(self, controls):
+        # region edges are in sample time; gates are in sample indices
+        lo, hi = controls.region.getRegion()
+        controls.start = int(np.searchsorted(self.sample_xi, lo, side="left"))
+        controls.stop = max(int(np.searchsorted(self.sample_xi, hi, side="right")), controls.start + 1)
+        self.on_gates_updated()
+
+    def on_gate_enabled_updated(self, controls):
+        controls.region.setVisible(controls.enabled.get())
+        self.update_gate_choices()
+        self.on_gates_updated()
+
+    def update_gate_choices(self):
+        # only enabled gates can be subtracted or divided by; a disabled one is unset where it was chosen
+        names = [controls.name for controls in self.gate_controls if controls.enabled.get()]
+        self.updating_gate_choices = True
+        try:
+            for controls in self.gate_controls:
+                controls.set_choices(names)
+        finally:
+            self.updating_gate_choices = False
+
+    def on_gates_updated(self):
+        if self.updating_gate_choices:
+            return  # called once the choices are all updated
+        # a running chart picks up moved or re-weighted gates on its next point,
+        # single shot gate values on the next measurement
+        gates = self.build_gates()
+        if self.chartstopped or gates.names == self.chart_gate_names:
+            self.worker.set_gates(gates)
+            self.clear_histogram()
+        else:
+            print("adding or removing gates takes effect on the next chart run")
+
+    def create_chart_curves(self, gates, bands=False):
+        for curve in self.chart_plot_curves:
+            self.chart_plot_widget.remove_item(curve)
+        for band in self.chart_plot_bands:
+            for item in band:
+                self.chart_plot_widget.remove_item(item)
+        # lock-in charts show each value's standard error as a band; resumed points have none (NaN)
+        self.chart_plot_bands = [
+            self.chart_plot_widget.add_band(color=self.channels[gate.channel].color, finite=False)
+            for gate in gates.gates
+        ] if bands else []
+        self.chart_plot_curves = self.add_gate_curves(self.chart_plot_widget, gates)
+
+    def add_gate_curves(self, plot_widget, gates):
+        # gate values can be NaN or inf, e.g. a ratio over a zero reference
+        return [
+            plot_widget.add_curve(
+                color=self.channels[gate.channel].color,
+                style=GateControls.styles.get(gate.name.split(" ")[-1], "solid"),
+                name=gate.name,
+                finite=False,
+            )
+            for gate in gates.gates
+        ]
+
+    def add_channel_curves(self, plot_widget):
+        return [plot_widget.add_curve(color=self.channels[key].color) for key in self.channel_keys]
+
+    def on_chart_retention_updated(self):
+        new = int(self.chart_retention_temp.get())
         assert new > 0
-        self.beginning_sample=new
-    
-    def on_ending_sample_updated(self):
-        new = int(self.ending_sample_temp.get())
+        self.chart_retention=new
+        self.charttimedata.resize(new)
+        self.chartdata.resize(new)
+        self.charterrors.resize(new)
+        self.update_chart_graph(self.charttimedata.view(), self.chartdata.view())
+
+    def on_waterfall_length_updated(self):
+        new = int(self.waterfall_length_temp.get())
         assert new > 0
-        self.ending_sample=new
- 
+        self.waterfall_length=new
+
+    def on_waterfall_channel_updated(self):
+        self.waterfall_view.clear()  # redrawn from the stored traces
+
+    def reset_waterfall(self):
+        # each chart run starts a new waterfall, with the history length and storage chosen on its tab
+        path = None
+        if self.waterfall_memmap_button.isChecked():
+            path = pathlib.Path(f"picotech_{self.port}_waterfall.npy")
+        # let go of the old traces first, so a memory-mapped file can be replaced
+        self.waterfall_view.clear()
+        self.waterfall = None
+        self.waterfall = Waterfall(self.waterfall_length, self.channel_keys, self.sample_xi, path=path)
+        self.waterfall_label.setText("")
+
+    def recompute_gates(self):
+        """Gate the waterfall's stored traces with the current gates and plot them."""
+        gates = self.build_gates()
+        with self.instrumentation.time("recompute gates"):
+            values = self.waterfall.recompute(gates)
+        for curve in self.recompute_plot_curves:
+            self.recompute_plot_widget.remove_item(curve)
+        self.recompute_plot_curves = self.add_gate_curves(self.recompute_plot_widget, gates)
+        times = np.array(self.waterfall.times.view())
+        for curve, series in zip(self.recompute_plot_curves, values.T):
+            self.recompute_plot_widget.set_data(curve, times, series)
+        print(f"gates recomputed over {len(times)} averaged traces")
+
+    def open_recording(self):
+        path, _ = QtWidgets.QFileDialog.getOpenFileName(
+            self, "Open recording", ".", "Recordings (*_shots.npy *.npz);;NumPy arrays (*.npy)"
+        )
+        if path:
+            self.load_recording(path)
+
+    def load_recording(self, path):
+        """
+        Replay a recording into the waterfall, averaged as set on the shots
+        tab, and recompute the gates over it.
+        """
+        if self.busy:
+            print("stop the running chart before opening a recording")
+            return
+        replay = Replay(path)
+        if replay.channel_keys != self.channel_keys or replay.nsamples != len(self.sample_xi):
+            print(f"{path} holds channels {replay.channel_keys} of {replay.nsamples} samples, not this scope's")
+            return
+        with self.instrumentation.time("replay"):
+            waterfall = replay.waterfall(self.nchunks, self.build_rejector(), self.combine.get() == "median")
+        self.waterfall_view.clear()
+        self.waterfall = waterfall
+        print(f"{len(replay)} chunks of {path} replayed into {len(self.waterfall)} points")
+        self.recompute_gates()
+
+    def on_save_waterfall_updated(self):
+        path = f"picotech_{self.port}_waterfall_{time.strftime('%Y%m%d_%H%M%S')}.npz"
+        self.waterfall.save(path)
+        print(f"Waterfall saved to {path}")
+
     def on_nchunks_updated(self):
         new = int(self.nchunks_temp.get())
         assert new > 0
@@ -327,7 +1067,7 @@ class ConfigWidget(QtWidgets.QWidget):
         if self.busy != True:
             xdata = self.sample_xi
             ydata = self.shotsdata
-            data=np.asarray([xdata,ydata], dtype=float).T
+            data=np.column_stack([xdata, np.asarray(ydata, dtype=float).T])
             f=open('shotsdata.dat','w')
             np.savetxt(f,data,fmt='%.5f')
             f.close()
@@ -337,9 +1077,9 @@ class ConfigWidget(QtWidgets.QWidget):
 
     def on_save_chart_updated(self):
         if self.chartstopped:
-            xdata = self.charttimedata
-            ydata = self.chartdata
-            data=np.asarray([xdata,ydata], dtype=float).T
+            xdata = self.charttimedata.view()
+            ydata = self.chartdata.view()
+            data=np.column_stack([xdata, ydata])
             f=open('chartdata.dat','w')
             np.savetxt(f,data,fmt='%.5f')
             f.close()
@@ -347,203 +1087,419 @@ class ConfigWidget(QtWidgets.QWidget):
         else:
             print('Chart not stopped.')
 
-    def on_voltage_range_updated(self):
-        if self.busy != True:
-            self.busy=True
-            newrange = self.voltage_range.get()
-            time.sleep(2*self.norm_interval/1000)
-            self.on_shot_channel_updated(newrange)
-            self.busy=False
-        else:
-            print('System busy...range not updated.')
+    def on_voltage_range_updated(self, key):
+        # applied by the worker between chunks, so acquisition keeps running
+        newrange = self.channels[key].range.get()
+        self.worker.request_range(key, newrange)
 
-    def on_wait_time_updated(self):
-        new = float(self.wait_time_temp.get())
-        assert new >= 0
-        self.wait_time=new
-        
-    def on_shot_channel_updated(self,rangevalue):
-        channel_index=self.signal_channel_index
-        channel_key=self.signal_channel_key
-        self.write_config_single_key_range(channel_key,rangevalue)
-        active_channels = [channel for channel in self.channels.values() if channel.enabled.get()]
-        channel = active_channels[channel_index]
-        ymin, ymax = channel.get_range()
+    def on_range_changed(self, key, rangevalue):
+        self.config["channels"][key]["range"] = rangevalue
+        self.update_samples_tab()
+        self.on_shot_channel_updated()
+
+    def on_daemon_gates_toggled(self, checked):
+        self.worker.set_daemon_gates(checked)
+
+    def on_stop_chart_toggled(self, checked):
+        if checked:
+            self.worker.stop()
+
+    def get_ylim(self):
+        # widest range over the displayed channels
+        ymax = max(self.channels[key].get_range()[1] for key in self.channel_keys)
+        return -ymax, ymax
+
+    def on_shot_channel_updated(self):
+        ymin, ymax = self.get_ylim()
         self.shots_plot_widget.set_ylim(ymin * 1.05, ymax * 1.05)
         self.samples_plot_widget.set_ylim(ymin * 1.05, ymax * 1.05)
         self.chart_plot_widget.set_ylim(ymin * 1.05, ymax * 1.05)
 
     def acquire_nchunks(self):
         if self.busy==False:
-            self.busy=True
-            chunks=self.nchunks
-            time.sleep(self.norm_interval/1000)
+            self.set_busy(True)
             self.singleshot=bool(self.single_shot_button.isChecked())
-            shotsdata=np.zeros(len(self.sample_xi))
-            index=0
-            begtime=0
-            midtime=0
-            tempid = self.client.get_measured()['measurement_id']
-            for i in range(chunks):
-                if index != 0:
-                    begtime=time.perf_counter()
-                self.chunk_temp.set(i+1)
-                while self.client.get_measured()['measurement_id'] == tempid:
-                    time.sleep(self.norm_interval/1000)
-                yi2 = self.client.get_measured()['B_mean']  # samples:  (channel, shot, sample)
-                tempid = self.client.get_measured()['measurement_id']
-                #yi2 = yi[self.signal_channel_index].mean(axis=0)
-                if self.singleshot:
-                    yi=self.client.get_measure_samples()
-                    yitemp=yi[self.signal_channel_index][0]
-                else:
-                    yitemp=yi2
-                self.update_samples_graph(yitemp)
-                shotsdata=shotsdata+yi2
-                self.update_shots_graph(shotsdata/(i+1))
-                self.eventloop.processEvents()
-                if index != 0:
-                    midtime=time.perf_counter()-begtime
-                    time.sleep(midtime)
-                index=index+1    
-        
-            self.shotsdata=shotsdata/chunks
-            self.busy=False
-            return shotsdata/chunks
-        else:
-            return self.shotsdata    
-    
+            target = None
+            if self.auto_stop_button.isChecked():
+                target = {
+                    "kind": self.target_kind.get(),
+                    "value": float(self.target_value.get()),
+                    "gates": self.build_gates(),
+                }
+                self.target_names = [gate.name for gate in target["gates"].gates]
+            self.acquire_requested.emit(
+                self.nchunks,
+                self.singleshot,
+                self.record_shots_button.isChecked(),
+                target,
+            )
+        return self.shotsdata
+
+    def on_nshots_updated(self):
+        self.worker.request_nshots(max(int(self.nshots_control.get()), 1))
+
+    def on_nshots_changed(self, nshots):
+        self.nshots_control.set(nshots)
+
+    def tune_nshots(self):
+        if self.busy==False:
+            self.set_busy(True)
+            self.tune_label.setText("tuning...")
+            self.tune_requested.emit(
+                float(self.tune_latency.get()), self.nchunks, bool(self.single_shot_button.isChecked())
+            )
+
+    def on_nshots_tuned(self, result):
+        self.set_busy(False)
+        if result is None:
+            self.tune_label.setText("tuning stopped")
+            return
+        text = (
+            f"nshots {result['nshots']}: {result['shots/sec']:.0f} shots/s, {result['latency']:.3f} s per point\n"
+            f"trigger {result['shot_rate']:.0f} shots/s, overhead {result['overhead'] * 1000:.1f} ms, "
+            f"read {result['fetch'] * 1000:.1f} ms"
+        )
+        self.tune_label.setText(text)
+        print(text)
+
     def run_chart(self):
         if self.busy==False:
-            self.busy=True
-            time.sleep(self.norm_interval/1000)
-            waittime=self.wait_time
-            beg_index=self.beginning_sample
-            end_index=self.ending_sample
+            self.set_busy(True)
             self.singleshot=bool(self.single_shot_button.isChecked())
-            starttime=time.perf_counter()
-            chunks=self.nchunks
-            shotsdata=np.zeros(len(self.sample_xi))
-           
             self.chartstopped=False
-            chartdata=[]
-            timedata=[]
-            index=0
-            begtime=0
-            midtime=0
-            tempid=self.client.get_measured()['measurement_id']
-            # inlined (hardcode) instead of used acquire_nchunks to avoid racing on self.busy
-            # can instead go to subroutine if self.busy conditional on update unnecessary
-            while (self.stop_chart_button.isChecked() != True):
-                shotsdata=np.zeros(len(self.sample_xi))
-                if self.singleshot:
-                    yi2 = self.client.get_measured_samples()
-                    yi2 = yi[self.signal_channel_index][0]
-                    self.shotsdata=yi2
-                    time.sleep(self.norm_interval/1000)
-                    self.eventloop.processEvents()
-                else:
-                    for i in range(chunks):
-                        if index != 0:
-                            begtime=time.perf_counter()
-                        self.chunk_temp.set(i+1)
-                        while self.client.get_measured()['measurement_id'] == tempid:
-                            time.sleep(self.norm_interval/1000)
-                        yi2 = self.client.get_measured()['B_mean']  # samples:  (channel, shot, sample)
-                        tempid = self.client.get_measured()['measurement_id']
-                        #yi2 = yi[self.signal_channel_index].mean(axis=0)
-                        self.update_samples_graph(yi2)
-                        shotsdata=shotsdata+yi2
-                        self.update_shots_graph(shotsdata/(i+1))
-                        self.eventloop.processEvents()
-                        if index != 0:
-                            midtime=time.perf_counter()-begtime
-                            time.sleep(midtime)
-                        index=index+1    
-                    self.shotsdata=shotsdata/chunks
-
-            
-                currenttime=time.perf_counter()-starttime
-                shotsdataab = self.shotsdata[beg_index:end_index]
-                #currently averaging the data within the indices
-                datum=np.sum(shotsdataab)/(end_index-beg_index+1)
-            
-                timedata.append(currenttime)
-                chartdata.append(datum)
-                self.update_chart_graph(np.array(timedata, dtype=float),np.array(chartdata,dtype=float))
-                self.charttimedata=timedata
-                self.chartdata=chartdata
-                time.sleep(waittime)
-        
-            self.stop_chart_button.setChecked(False)
-            self.stopchart=False
-            self.chartstopped=True
-            self.busy=False
-            return chartdata
-        else:
-            return self.chartdata
+            gates = self.build_gates()
+            self.chart_gate_names = [gate.name for gate in gates.gates]
+            self.charttimedata.clear()
+            self.chartdata = RingBuffer(self.chart_retention, shape=(len(gates),))
+            self.charterrors = RingBuffer(self.chart_retention, shape=(len(gates),))
+            self.reset_waterfall()
+            demodulator = self.build_demodulator()
+            self.create_chart_curves(gates, bands=demodulator is not None)
+            self.lockin_label.setText("")
+            # a resumed chart starts from the checkpoint's history, if its gates and lock-in are still the same
+            state, self.resume_state = self.resume_state, None
+            resume = state is not None and Checkpoint.matches(
+                state, self.chart_gate_names, None if demodulator is None else demodulator.to_dict()
+            )
+            if resume:
+                self.charttimedata.extend(state["times"])
+                self.chartdata.extend(state["values"])
+                self.charterrors.extend(np.full(np.shape(state["values"]), np.nan))
+                self.update_chart_graph(self.charttimedata.view(), self.chartdata.view())
+            self.chart_requested.emit(
+                self.nchunks,
+                self.singleshot,
+                ChartScheduler(
+                    self.chart_schedule.get(),
+                    interval=float(self.chart_interval.get()),
+                    every=int(self.chart_every.get()),
+                ),
+                gates,
+                self.record_chart_button.isChecked(),
+                resume,
+                demodulator,
+            )
+        return self.chartdata
+
+    def build_demodulator(self):
+        """The Demodulator set up on the chart tab, or None without LOCK-IN."""
+        if not self.lockin_button.isChecked():
+            return None
+        names = [controls.name for controls in self.gate_controls]
+        reference = self.gate_controls[names.index(self.lockin_reference.get())].get_gate()
+        return Demodulator(
+            reference,
+            threshold=float(self.lockin_threshold.get()) if self.lockin_split.get() == "threshold" else None,
+            nbins=int(self.lockin_bins.get()),
+            invert=self.lockin_invert_button.isChecked(),
+            ratio=self.lockin_output.get() == "ratio",
+            min_contrast=float(self.lockin_min_contrast.get()),
+            separation=float(self.lockin_separation.get()),
+        )
+
+    def set_demodulator_controls(self, demodulator):
+        """Set up LOCK-IN from a Demodulator.to_dict dict, or turn it off for None."""
+        self.lockin_button.setChecked(demodulator is not None)
+        if demodulator is None:
+            return
+        reference = demodulator["reference"]
+        for controls in self.gate_controls:
+            # a charted reference gate is restored with the gates; otherwise only its window counts
+            if controls.name == reference["name"] and not controls.enabled.get():
+                controls.set_gate({key: reference[key] for key in ("method", "start", "stop")})
+                controls.region.setRegion((self.sample_xi[controls.start], self.sample_xi[controls.stop - 1]))
+        self.lockin_reference.set(reference["name"])
+        self.lockin_split.set("midpoint" if demodulator["threshold"] is None else "threshold")
+        if demodulator["threshold"] is not None:
+            self.lockin_threshold.set(demodulator["threshold"])
+        self.lockin_bins.set(demodulator["nbins"])
+        self.lockin_output.set("ratio" if demodulator["ratio"] else "difference")
+        self.lockin_invert_button.setChecked(demodulator["invert"])
+        self.lockin_separation.set(demodulator["separation"])
+        self.lockin_min_contrast.set(demodulator["min_contrast"])
+
+    def resume_chart(self):
+        """Restore the checkpointed chart's gates and settings and continue it."""
+        if not self.checkpoint_path.exists():
+            print(f"no checkpoint {self.checkpoint_path} to resume")
+            return
+        state = Checkpoint.load(self.checkpoint_path)
+        if not state.get("gates"):
+            print(f"checkpoint {self.checkpoint_path} holds no chart to resume")
+            return
+        saved = {gate["name"]: gate for gate in state["gates"]}
+        # enable first, so every saved baseline and reference is on offer
+        for controls in self.gate_controls:
+            controls.enabled.set(controls.name in saved)
+        for controls in self.gate_controls:
+            if controls.name in saved:
+                controls.set_gate(saved[controls.name])
+                controls.region.setRegion(
+                    (self.sample_xi[controls.start], self.sample_xi[controls.stop - 1])
+                )
+        self.nchunks_temp.set(state["nchunks"])
+        self.nchunks = int(state["nchunks"])
+        self.chart_schedule.set(state["schedule"]["mode"])
+        self.chart_interval.set(state["schedule"]["interval"])
+        self.chart_every.set(state["schedule"]["every"])
+        self.single_shot_button.setChecked(state["singleshot"])
+        self.set_demodulator_controls(state.get("demodulator"))
+        if state["stats"] is not None:
+            self.on_shots_ready(state["stats"])
+        print(f"resuming {len(state['times'])} chart points from {self.checkpoint_path}")
+        self.resume_state = state
+        self.run_chart()
+
+    def set_busy(self, busy):
+        self.busy = busy
+        if self.monitor_scope is not None:
+            # the worker streams samples itself while averaging, and in single shot mode
+            self.monitor_scope.paused = busy or self.single_shot_button.isChecked()
+
+    def on_single_shot_toggled(self, checked):
+        if self.monitor_scope is not None:
+            # single shot batches come from the worker, which reads each measurement once
+            self.worker.live_view = checked
+            self.monitor_scope.paused = self.busy or checked
+        if not checked:
+            for overlay in self.samples_plot_overlays:
+                self.samples_plot_widget.set_data(overlay, [], [])
+        self.singleshot_requested.emit(checked)
+
+    def on_reject_updated(self):
+        threshold = float(self.reject_threshold.get()) if self.reject_button.isChecked() else None
+        self.worker.set_reject(threshold)
+        self.clear_histogram()
+
+    def build_rejector(self):
+        return Rejector(
+            zscore=float(self.glitch_threshold.get()) if self.reject_glitches_button.isChecked() else None,
+            clip=self.reject_clipped_button.isChecked(),
+        )
+
+    def on_rejection_updated(self):
+        self.worker.set_rejector(self.build_rejector(), median=self.combine.get() == "median")
+
+    def clear_histogram(self):
+        self.histogram_values.clear()
+        self.histogram_keep.clear()
+        self.histogram_dirty = True
+
+    def on_monitor_samples(self, data):
+        if not self.busy:
+            self.update_samples_graph(data)
+
+    def on_samples_ready(self, data):
+        self.update_samples_graph(data)
+
+    def on_shots_read(self, batch):
+        with self.instrumentation.time("update single shots"):
+            self.update_persistence_graph(batch["shots"])
+            name = self.histogram_gate.get()
+            if name in batch["gate_names"]:
+                self.histogram_values.extend(batch["values"][:, batch["gate_names"].index(name)])
+                self.histogram_keep.extend(batch["keep"])
+                self.histogram_dirty = True
+
+    def on_shots_ready(self, stats):
+        self.chunk_temp.set(stats["count"])
+        self.update_shots_graph(stats)
+
+    def on_shots_finished(self, stats):
+        self.shotsdata = stats.get("median", stats["mean"])
+        self.shotsstats = stats
+        if self.chartstopped:
+            self.set_busy(False)
+
+    def on_acquire_report(self, chunks, seconds, snr):
+        text = f"Used {chunks} chunks in {seconds:.1f} s"
+        rejected = self.shotsstats.get("rejected", {})
+        if rejected:
+            text += "\nRejected " + ", ".join(f"{count} {reason}" for reason, count in rejected.items())
+        if np.any(np.isfinite(snr)):
+            text += "\nSNR: " + ", ".join(f"{key} {value:.1f}" for key, value in zip(self.target_names, snr))
+        self.report_label.setText(text)
+        print(text)
+
+    def on_chart_ready(self, currenttime, datum, errors=None):
+        self.charttimedata.append(currenttime)
+        self.chartdata.append(datum)
+        self.charterrors.append(np.full(len(datum), np.nan) if errors is None else errors)
+        # shots_finished, emitted just before, left the averaged traces of this point in shotsdata
+        self.waterfall.append(currenttime, np.asarray(self.shotsdata))
+        self.update_chart_graph(self.charttimedata.view(), self.chartdata.view())
+        if errors is not None:
+            self.update_lockin_label()
+
+    def update_lockin_label(self):
+        # running demodulated value of each gate over the whole chart, with its standard error
+        values = self.chartdata.view()
+        count = len(values)
+        mean = values.mean(axis=0)
+        sem = values.std(axis=0, ddof=1) / np.sqrt(count) if count > 1 else np.full(len(mean), np.nan)
+        lines = [f"{name}: {m:.4g} \u00b1 {e:.2g}" for name, m, e in zip(self.chart_gate_names, mean, sem)]
+        self.lockin_label.setText(f"running over {count} points\n" + "\n".join(lines))
+
+    def on_chart_finished(self):
+        self.stop_chart_button.setChecked(False)
+        self.stopchart=False
+        self.chartstopped=True
+        self.set_busy(False)
 
     def set_slice_xlim(self, xmin, xmax):
         self.values_plot_widget.set_xlim(xmin, xmax)
 
     def update_samples_graph(self,data):
-        self.samples_plot_scatter.clear()
-        self.samples_plot_scatter.setData(self.sample_xi,data)
+        with self.instrumentation.time("update samples graph"):
+            for curve, trace in zip(self.samples_plot_curves, data):
+                self.samples_plot_widget.set_data(curve, self.sample_xi, trace)
+
+    def update_persistence_graph(self, shots):
+        count = min(int(self.persistence.get()), len(shots))
+        if count <= 0:
+            return
+        # every shot of a channel as one curve, separated by NaN so each is drawn on its own
+        nsamples = len(self.sample_xi)
+        xdata = np.tile(np.append(self.sample_xi, np.nan), count)
+        ydata = np.full((count, nsamples + 1), np.nan)
+        for overlay, channel in zip(self.samples_plot_overlays, range(shots.shape[1])):
+            ydata[:, :nsamples] = shots[:count, channel]
+            self.samples_plot_widget.set_data(overlay, xdata, ydata.ravel().copy())
 
-    def update_shots_graph(self,data):
-        self.shots_plot_scatter.clear()
-        self.shots_plot_scatter.setData(self.sample_xi, data)
+    def update_histogram_graph(self):
+        with self.instrumentation.time("update histogram graph"):
+            values = self.histogram_values.view()
+            keep = self.histogram_keep.view()
+            finite = np.isfinite(values)
+            if not finite.any():
+                for curve in (self.histogram_plot_kept, self.histogram_plot_rejected):
+                    self.histogram_plot_widget.set_data(curve, [0, 1], [0])
+                self.histogram_label.setText("")
+                return
+            edges = np.histogram_bin_edges(values[finite], bins=50)
+            kept, _ = np.histogram(values[finite & keep], bins=edges)
+            rejected, _ = np.histogram(values[finite & ~keep], bins=edges)
+            self.histogram_plot_widget.set_data(self.histogram_plot_kept, edges, kept)
+            self.histogram_plot_widget.set_data(self.histogram_plot_rejected, edges, rejected)
+            self.histogram_label.setText(
+                f"{self.histogram_gate.get()}: {len(values)} shots, {int((~keep).sum())} rejected\n"
+                f"mean {np.nanmean(values[keep]) if keep.any() else np.nan:.4g}, "
+                f"std {np.nanstd(values[keep]) if keep.any() else np.nan:.3g}"
+            )
+
+    def update_shots_graph(self,stats):
+        with self.instrumentation.time("update shots graph"):
+            average = stats.get("median", stats["mean"])
+            for curve, trace in zip(self.shots_plot_curves, average):
+                self.shots_plot_widget.set_data(curve, self.sample_xi, trace)
+            band = self.error_band.get()
+            for (lower, upper), trace, error in zip(
+                self.shots_plot_bands, average, stats.get(band, np.zeros_like(average))
+            ):
+                self.shots_plot_widget.set_data(lower, self.sample_xi, trace - error)
+                self.shots_plot_widget.set_data(upper, self.sample_xi, trace + error)
+            lines = [f"{key} median SEM: {np.median(sem):.3g} V" for key, sem in zip(self.channel_keys, stats["sem"])]
+            rejected = stats.get("rejected", {})
+            if rejected:
+                lines.append("rejected: " + ", ".join(f"{count} {reason}" for reason, count in rejected.items()))
+            self.stats_label.setText("\n".join(lines))
 
     def update_chart_graph(self,xdata,ydata):
-        self.chart_plot_scatter.clear()
-        self.chart_plot_scatter.setData(xdata, ydata)
+        with self.instrumentation.time("update chart graph"):
+            # ydata is (point, gate)
+            for curve, series in zip(self.chart_plot_curves, ydata.T):
+                self.chart_plot_widget.set_data(curve, xdata, series)
+            if self.chart_plot_bands:
+                errors = self.charterrors.view()[-len(xdata):]
+                for (lower, upper), series, error in zip(self.chart_plot_bands, ydata.T, errors.T):
+                    self.chart_plot_widget.set_data(lower, xdata, series - error)
+                    self.chart_plot_widget.set_data(upper, xdata, series + error)
+
+    def update_waterfall_graph(self):
+        with self.instrumentation.time("update waterfall graph"):
+            self.waterfall_view.update(self.waterfall, self.channel_keys.index(self.waterfall_channel.get()))
+            self.waterfall_label.setText(f"{len(self.waterfall)} of {self.waterfall.times.maxlen} points")
 
     def update_samples_tab(self):
         # buttons
         #num_channels = len(self.samples_channel_combo.allowed_values)
         # channel ui
         #channel_index = self.samples_channel_combo.get_index()
-        channel_index=self.signal_channel_index
         #for widget in self.channel_widgets:
         #    widget.hide()
         #self.channel_widgets[channel_index].show()
         # lines on plot
         self.samples_plot_max_voltage_line.hide()
         self.samples_plot_min_voltage_line.hide()
-        current_channel_object = list(self.channels.values())[channel_index]
-        if current_channel_object.enabled.get():
-            channel_min, channel_max = current_channel_object.get_range()
+        if self.channel_keys:
+            channel_min, channel_max = self.get_ylim()
             self.samples_plot_max_voltage_line.show()
             self.samples_plot_max_voltage_line.setValue(channel_max * 1.05)
             self.samples_plot_min_voltage_line.show()
             self.samples_plot_min_voltage_line.setValue(channel_min * 1.05)
         # finish
-        ymin, ymax = current_channel_object.get_range()
+        ymin, ymax = self.get_ylim()
 
         self.samples_plot_widget.set_ylim(ymin/1000, ymax/1000)
 
-    def update(self):
-        # self.busy conditional probably not necessary
-        self.singleshot=bool(self.single_shot_button.isChecked())
-        if self.busy == False:
-            if self.singleshot:
-                yi = self.client.get_measured_samples()  # samples:  (channel, shot, sample)
-                yi2 = yi[self.signal_channel_index][0]
-                self.update_samples_graph(yi2)
-            else:
-                yi = self.client.get_measured()['B_mean']  # samples:  (channel, shot, sample)
-                #yi2 = yi[self.signal_channel_index].mean(axis=0)
-                temp_id=self.client.get_measured()['measurement_id']
-                if temp_id != self.measure_id:
-                    self.update_samples_graph(yi)
-                    self.measure_id=temp_id
-                #don't need to process Eventloop here but may put it in anyway
-        self.busy=False
+    def render(self):
+        if not self.isVisible():
+            return  # hidden scope tabs keep their pending data until shown
+        if self.histogram_dirty and self.histogram_plot_widget.isVisible():
+            self.histogram_dirty = False
+            self.update_histogram_graph()
+        self.samples_plot_widget.render()
+        self.shots_plot_widget.render()
+        self.histogram_plot_widget.render()
+        self.chart_plot_widget.render()
+        # redrawn only after new chart points, and only while the waterfall tab is shown
+        if self.waterfall.appended != self.waterfall_view.shown and self.waterfall_plot_widget.isVisible():
+            self.update_waterfall_graph()
+        self.waterfall_plot_widget.render()
+        self.recompute_plot_widget.render()
+
+
+def get_linestyle(style):
+    if style == "solid":
+        return QtCore.Qt.SolidLine
+    elif style == "dashed":
+        return QtCore.Qt.DashLine
+    elif style == "dotted":
+        return QtCore.Qt.DotLine
+    print(f"style {style} not recognized")
+    return QtCore.Qt.SolidLine
 
 
 class Plot1D(pg.GraphicsView):
-    def __init__(self, title=None, xAutoRange=True, yAutoRange=True):
+    def __init__(self, title=None, xAutoRange=True, yAutoRange=True, max_fps=30, name="plot", instrumentation=None):
         pg.GraphicsView.__init__(self)
+        # frame-rate cap: set_data only queues, render draws at most max_fps
+        self.max_fps = max_fps
+        self.last_render = 0.0
+        self.pending = {}
+        # render (setData) and paint times are recorded as "render <name>" and "paint <name>"
+        self.name = name
+        self.instrumentation = instrumentation
         # create layout
         self.graphics_layout = pg.GraphicsLayout(border="w")
         self.setCentralItem(self.graphics_layout)
@@ -563,11 +1519,137 @@ class Plot1D(pg.GraphicsView):
         if title:
             self.plot_object.setTitle(title)
 
-    def add_scatter(self, color="c", size=3, symbol="o"):
-        curve = pg.ScatterPlotItem(symbol=symbol, pen=(color), brush=(color), size=size)
+    def add_curve(self, color="c", width=1, downsample=True, clip=True, style="solid", name=None, finite=True):
+        """
+        Add a PlotDataItem drawn as a line.
+
+        Parameters
+        ----------
+        color : (optional)
+            The color of the line. Default is 'c', cyan.
+        width : int (optional)
+            Line width in pixels. Default is 1.
+        style : {'solid', 'dashed', dotted'} (optional)
+            Linestyle. Default is solid.
+        name : str (optional)
+            Label shown in the legend, if the plot has one.
+        downsample : bool (optional)
+            Toggles automatic peak-preserving downsampling to the pixel width
+            of the view. Default is True.
+        clip : bool (optional)
+            Toggles drawing only the points inside the visible x range.
+            Default is True.
+        finite : bool (optional)
+            Whether the data is always finite, which skips the check for NaN
+            and inf.  Pass False for data that may hold them; those points
+            are then left out of the line. Default is True.
+        Returns
+        -------
+        PlotDataItem object
+        """
+        pen = pg.mkPen(color, width=width, style=get_linestyle(style))
+        curve = pg.PlotDataItem(pen=pen, skipFiniteCheck=finite, name=name)
+        curve.setDownsampling(auto=downsample, method="peak")
+        curve.setClipToView(clip)
+        self.plot_object.addItem(curve)
+        return curve
+
+    def add_overlay(self, color="c", alpha=50):
+        """
+        Add a faint PlotDataItem for many traces at once, e.g. shot persistence.
+
+        Set data as the traces one after another, each followed by a NaN;
+        the NaNs break the line so every trace is drawn separately.
+
+        Parameters
+        ----------
+        color : (optional)
+            The color of the traces. Default is 'c', cyan.
+        alpha : int (optional)
+            Opacity of the traces, 0-255. Default is 50.
+        Returns
+        -------
+        PlotDataItem object
+        """
+        pen_color = pg.mkColor(color)
+        pen_color.setAlpha(alpha)
+        curve = pg.PlotDataItem(pen=pg.mkPen(pen_color), connect="finite")
+        curve.setClipToView(True)
+        curve.setZValue(-1)
+        self.plot_object.addItem(curve)
+        return curve
+
+    def add_histogram(self, color="c", alpha=80):
+        """
+        Add a filled step curve for histograms.
+
+        Set data as (bin edges, counts), with one more edge than counts.
+
+        Parameters
+        ----------
+        color : (optional)
+            The color of the outline and fill. Default is 'c', cyan.
+        alpha : int (optional)
+            Opacity of the fill, 0-255. Default is 80.
+        Returns
+        -------
+        PlotDataItem object
+        """
+        fill_color = pg.mkColor(color)
+        fill_color.setAlpha(alpha)
+        curve = pg.PlotDataItem(
+            [0, 1], [0], stepMode="center", fillLevel=0, pen=pg.mkPen(color), brush=pg.mkBrush(fill_color)
+        )
         self.plot_object.addItem(curve)
         return curve
 
+    def add_band(self, color="c", alpha=60, finite=True):
+        """
+        Add a shaded region between two curves, e.g. an error band.
+
+        Parameters
+        ----------
+        color : (optional)
+            The color of the region. Default is 'c', cyan.
+        alpha : int (optional)
+            Opacity of the region, 0-255. Default is 60.
+        finite : bool (optional)
+            Whether the data is always finite, as for add_curve. Default is True.
+        Returns
+        -------
+        tuple of PlotDataItem
+            (lower, upper); set data on both to move the region.
+        """
+        lower = pg.PlotDataItem(pen=None, skipFiniteCheck=finite)
+        upper = pg.PlotDataItem(pen=None, skipFiniteCheck=finite)
+        fill_color = pg.mkColor(color)
+        fill_color.setAlpha(alpha)
+        fill = pg.FillBetweenItem(lower, upper, brush=pg.mkBrush(fill_color))
+        self.plot_object.addItem(fill)
+        return lower, upper
+
+    def add_image(self, colormap="viridis"):
+        """
+        Add an ImageItem for 2D data such as a waterfall, rows along y.
+
+        Images are downsampled to the pixel size of the view before they
+        are colored, so large images stay cheap to draw.
+
+        Parameters
+        ----------
+        colormap : str (optional)
+            Name of a pyqtgraph colormap. Default is 'viridis'.
+        Returns
+        -------
+        ImageItem object
+            Set data with set_image.
+        """
+        image = pg.ImageItem(axisOrder="row-major")
+        image.setColorMap(pg.colormap.get(colormap))
+        image.setAutoDownsample(True)
+        self.plot_object.addItem(image)
+        return image
+
     def add_line(self, color="c", size=3, symbol="o"):
         curve = pg.PlotCurveItem(symbol=symbol, pen=(color), brush=(color), size=size)
         self.plot_object.addItem(curve)
@@ -593,16 +1675,7 @@ class Plot1D(pg.GraphicsView):
         InfiniteLine object
             Useful methods: setValue, show, hide
         """
-        if style == "solid":
-            linestyle = QtCore.Qt.SolidLine
-        elif style == "dashed":
-            linestyle = QtCore.Qt.DashLine
-        elif style == "dotted":
-            linestyle = QtCore.Qt.DotLine
-        else:
-            print("style not recognized in add_infinite_line")
-            linestyle = QtCore.Qt.SolidLine
-        pen = pg.mkPen(color, style=linestyle)
+        pen = pg.mkPen(color, style=get_linestyle(style))
         line = pg.InfiniteLine(pen=pen)
         line.setAngle(angle)
         line.setMovable(movable)
@@ -611,6 +1684,40 @@ class Plot1D(pg.GraphicsView):
         self.plot_object.addItem(line)
         return line
 
+    def add_region(self, values, color="c", alpha=40, movable=True):
+        """
+        Add a LinearRegionItem spanning values along the x axis.
+
+        Parameters
+        ----------
+        values : tuple
+            (xmin, xmax) of the region.
+        color : (optional)
+            The color of the region. Default is 'c', cyan.
+        alpha : int (optional)
+            Opacity of the region, 0-255. Default is 40.
+        movable : bool (optional)
+            Toggles if user can drag the region and its edges. Default is True.
+        Returns
+        -------
+        LinearRegionItem object
+            Useful methods: getRegion, setRegion, show, hide
+            Useful signals: sigRegionChangeFinished
+        """
+        fill_color = pg.mkColor(color)
+        fill_color.setAlpha(alpha)
+        region = pg.LinearRegionItem(values=values, brush=pg.mkBrush(fill_color), movable=movable)
+        self.plot_object.addItem(region)
+        return region
+
+    def add_legend(self):
+        self.legend = self.plot_object.addLegend()
+        return self.legend
+
+    def remove_item(self, item):
+        self.pending.pop(item, None)
+        self.plot_object.removeItem(item)
+
     def set_labels(self, xlabel=None, ylabel=None):
         if xlabel:
             self.plot_object.setLabel("bottom", text=xlabel)
@@ -625,29 +1732,242 @@ class Plot1D(pg.GraphicsView):
     def set_ylim(self, ymin, ymax):
         self.plot_object.setYRange(ymin, ymax)
 
+    def set_data(self, item, xdata, ydata):
+        """Queue data for item. It is drawn by the next render the frame-rate cap allows."""
+        self.pending[item] = (xdata, ydata)
+
+    def set_image(self, item, image, rect, levels):
+        """
+        Queue an image for an ImageItem, drawn by the next render like set_data.
+
+        rect is (x, y, width, height) of the image in plot coordinates and
+        levels the (low, high) values mapped to the ends of the colormap.
+        """
+        self.pending[item] = (image, rect, levels)
+
+    def render(self):
+        if not self.isVisible():
+            return  # plots on hidden tabs keep their pending data until shown
+        now = time.monotonic()
+        if not self.pending or now - self.last_render < 1 / self.max_fps:
+            return
+        for item, data in self.pending.items():
+            if isinstance(item, pg.ImageItem):
+                image, rect, levels = data
+                item.setImage(image, autoLevels=False, levels=levels)
+                item.setRect(QtCore.QRectF(*rect))
+            else:
+                item.setData(*data)
+        self.pending.clear()
+        self.last_render = now
+        if self.instrumentation is not None:
+            self.instrumentation.record(f"render {self.name}", time.monotonic() - now)
+
+    def paintEvent(self, event):
+        if self.instrumentation is None:
+            return super().paintEvent(event)
+        with self.instrumentation.time(f"paint {self.name}"):
+            return super().paintEvent(event)
+
     def clear(self):
         self.plot_object.clear()
 
 
+class WaterfallView:
+    """
+    One channel of a Waterfall drawn on a Plot1D, sample time across and chart time up.
+
+    Rows are drawn in tiles of tile_rows chart points, each an ImageItem
+    holding its own copy of its rows, so a new point redraws only the
+    newest tile and never the whole history.  A tile is removed once all
+    its points have left the Waterfall.  The color levels widen, with a
+    margin, whenever new traces go beyond them; only then is every tile
+    redrawn.
+    """
+
+    def __init__(self, plot_widget, tile_rows=256, margin=0.1):
+        self.plot_widget = plot_widget
+        self.tile_rows = tile_rows
+        self.margin = margin  # fraction of the level range added when widening
+        self.tiles = {}  # tile number -> {"image", "rows", "times", "lo", "hi"}
+        self.levels = None
+        self.step = 1.0  # chart time between rows, for tiles of one row
+        self.shown = 0  # Waterfall.appended when last drawn
+
+    def clear(self):
+        for tile in self.tiles.values():
+            self.plot_widget.remove_item(tile["image"])
+        self.tiles = {}
+        self.levels = None
+        self.shown = 0
+
+    def update(self, waterfall, channel):
+        """Draw the rows of channel (an index) added to waterfall since the last update."""
+        first = waterfall.appended - len(waterfall)  # count of the oldest point still kept
+        start = max(self.shown, first)
+        if start < waterfall.appended:
+            rows = waterfall.traces.view()[start - first :, channel]
+            times = waterfall.times.view()[start - first :]
+            low, high = float(rows.min()), float(rows.max())
+            widen = self.levels is None or low < self.levels[0] or high > self.levels[1]
+            if widen:
+                if self.levels is not None:
+                    low, high = min(low, self.levels[0]), max(high, self.levels[1])
+                pad = self.margin * max(high - low, 1e-9)
+                self.levels = (low - pad, high + pad)
+            changed = set()
+            count = start
+            while count < waterfall.appended:
+                number = count // self.tile_rows
+                stop = min((number + 1) * self.tile_rows, waterfall.appended)
+                lo, hi = count - number * self.tile_rows, stop - number * self.tile_rows
+                if number not in self.tiles:
+                    self.tiles[number] = self.add_tile(rows.shape[-1], lo)
+                tile = self.tiles[number]
+                tile["rows"][lo:hi] = rows[count - start : stop - start]
+                tile["times"][lo:hi] = times[count - start : stop - start]
+                tile["hi"] = hi
+                changed.add(number)
+                count = stop
+            for number, tile in self.tiles.items():
+                if widen or number in changed:
+                    self.draw(tile, waterfall.sample_time)
+        self.shown = waterfall.appended
+        for number in [number for number in self.tiles if (number + 1) * self.tile_rows <= first]:
+            self.plot_widget.remove_item(self.tiles.pop(number)["image"])
+
+    def add_tile(self, nsamples, lo):
+        return {
+            "image": self.plot_widget.add_image(),
+            "rows": np.empty((self.tile_rows, nsamples), dtype=np.float32),
+            "times": np.empty(self.tile_rows),
+            "lo": lo,
+            "hi": lo,
+        }
+
+    def draw(self, tile, sample_time):
+        rows = tile["rows"][tile["lo"] : tile["hi"]]
+        times = tile["times"][tile["lo"] : tile["hi"]]
+        # a tile's rows are drawn evenly spaced from its first point's chart time to its last's
+        if len(times) > 1:
+            self.step = (times[-1] - times[0]) / (len(times) - 1)
+        rect = (
+            sample_time[0],
+            times[0] - self.step / 2,
+            sample_time[-1] - sample_time[0],
+            times[-1] - times[0] + self.step,
+        )
+        self.plot_widget.set_image(tile["image"], rows, rect, self.levels)
+
+
 class MainWindow(QtWidgets.QMainWindow):
-    def __init__(self, app, port):
+    render_interval = 20  # msec
+    # a daemon answered its metadata requests: port, client and cache, or the error
+    scope_connected = QtCore.Signal(int, object)
+
+    def __init__(self, app, ports, monitor=None, client_factory=None, resume=False):
         super().__init__()
         self.app = app
+        self.monitor = monitor
+        self.client_factory = client_factory
+        self.resume = resume  # continue each scope's checkpointed chart
         self.setWindowTitle("Picoscope")
-        self.app.eventloop=QtCore.QEventLoop(app)
-        self.setCentralWidget(ConfigWidget(port))
-        ConfigWidget.eventloop=self.app.eventloop
+        # one render timer and one chart origin for every scope
+        self.render_timer = QtCore.QTimer()
+        self.render_timer.start(self.render_interval)
+        self.t0 = time.time()
+        self.tabs = QtWidgets.QTabWidget()
+        self.tabs.setTabBarAutoHide(True)
+        self.scopes = []
+        # the window shows at once; each scope's tab is filled in once its daemon has answered,
+        # with every daemon connecting and reading its metadata in parallel
+        self.placeholders = {}
+        self.scope_connected.connect(self.add_scope)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(len(ports), 1))
+        for port in ports:
+            self.placeholders[port] = QtWidgets.QLabel(f"connecting to port {port}...")
+            self.placeholders[port].setAlignment(QtCore.Qt.AlignCenter)
+            self.tabs.addTab(self.placeholders[port], str(port))
+            future = self.executor.submit(self.connect_scope, port)
+            future.add_done_callback(functools.partial(self.on_scope_connected, port))
+        self.executor.shutdown(wait=False)
+        self.setCentralWidget(self.tabs)
+
+    def connect_scope(self, port):
+        # runs in an executor thread
+        client = yaqc.Client(port) if self.client_factory is None else self.client_factory(port)
+        return client, DaemonCache().prefetch(client)
+
+    def on_scope_connected(self, port, future):
+        # runs in the executor thread; the signal queues the result to the GUI thread
+        try:
+            self.scope_connected.emit(port, future.result())
+        except Exception as error:
+            self.scope_connected.emit(port, error)
+
+    def add_scope(self, port, connected):
+        placeholder = self.placeholders.pop(port)
+        if isinstance(connected, Exception):
+            placeholder.setText(f"could not connect to port {port}: {connected}")
+            return
+        client, cache = connected
+        scope = ConfigWidget(
+            port,
+            monitor=self.monitor,
+            render_timer=self.render_timer,
+            t0=self.t0,
+            client_factory=self.client_factory,
+            client=client,
+            cache=cache,
+            resume=self.resume,
+        )
+        self.scopes.append(scope)
+        index = self.tabs.indexOf(placeholder)
+        current = self.tabs.currentIndex() == index
+        self.tabs.removeTab(index)
+        self.tabs.insertTab(index, scope, f"{cache.get('id', client)['name']} ({port})")
+        if current:
+            self.tabs.setCurrentIndex(index)
+        placeholder.deleteLater()
+
+    def closeEvent(self, event):
+        for scope in self.scopes:
+            scope.close_worker()
+        super().closeEvent(event)
 
 
 def main():
     """Initialize application and main window."""
     
-    port = int(sys.argv[1])
+    args = sys.argv[1:]
+    client_factory = None
+    if "--mock" in args:
+        # simulated daemons, no hardware needed
+        from picotech_chart_mock import MockClient
+
+        args.remove("--mock")
+        client_factory = MockClient
+    resume = "--resume" in args
+    if resume:
+        # continue the charts checkpointed by the last session
+        args.remove("--resume")
+    ports = [int(arg) for arg in args]
     app = QtWidgets.QApplication(sys.argv)
-    main_window = MainWindow(app, port)
+    if qasync is None:
+        main_window = MainWindow(app, ports, client_factory=client_factory, resume=resume)
+        main_window.showMaximized()
+        sys.exit(app.exec_())
+    # run asyncio on the Qt event loop so daemon polls can be in flight together
+    loop = qasync.QEventLoop(app)
+    asyncio.set_event_loop(loop)
+    monitor = AsyncMonitor()
+    main_window = MainWindow(app, ports, monitor=monitor, client_factory=client_factory, resume=resume)
     main_window.showMaximized()
-        
-    sys.exit(app.exec_())
+    with loop:
+        task = loop.create_task(monitor.run())
+        loop.run_forever()
+        task.cancel()
+        monitor.close()
     
 
 if __name__ == "__main__":
@@ -0,0 +1,274 @@
+"""In-process stand-in for a yaqd-picotech daemon, for running and benchmarking without hardware."""
+
+import collections
+import importlib.util
+import pathlib
+import tempfile
+import time
+
+import numpy as np  # type: ignore
+import toml
+
+
+class MockDaemon:
+    """
+    Simulated yaqd-picotech daemon state for one port.
+
+    The daemon loops measurements the way yaqd-picotech does: each
+    measurement takes dead_time + nshots / shot_rate seconds and produces
+    per-shot traces of a pulse on every enabled channel plus Gaussian
+    noise.  Time runs on the wall clock, so pollers see measurement_id
+    advance exactly as they would against real hardware.
+
+    With chopper, a chopper modulates the signal: on every other shot the
+    channels after the first are (1 + chopper) times stronger, and the
+    first channel, the reference, is 1 V higher.
+
+    With processing_path, measurements are reduced by that shots processing
+    module (e.g. picotech_processing.py), as the daemon's
+    shots_processing_path does, and get_measured publishes its channels.
+    """
+
+    ranges = ["20 mV", "50 mV", "100 mV", "200 mV", "500 mV", "1 V", "2 V", "5 V", "10 V", "20 V"]
+    messages = [
+        "busy",
+        "get_config",
+        "get_channel_names",
+        "get_config_filepath",
+        "get_mappings",
+        "get_measured",
+        "get_measured_samples",
+        "get_measurement_id",
+        "get_nshots",
+        "id",
+        "set_nshots",
+        "shutdown",
+    ]
+
+    def __init__(
+        self,
+        port=38008,
+        shot_rate=1000.0,
+        nshots=100,
+        nsamples=200,
+        channels="AB",
+        noise=0.05,
+        amplitude=1.0,
+        latency=0.0,
+        sample_interval=64.0,
+        dead_time=0.0,
+        seed=None,
+        processing_path=None,
+        chopper=0.0,
+    ):
+        self.port = port
+        self.shot_rate = float(shot_rate)  # shots per second
+        self.nsamples = int(nsamples)
+        self.noise = noise  # volts rms per shot
+        self.amplitude = amplitude  # volts
+        self.latency = latency  # sec per call
+        self.sample_interval = sample_interval  # ns
+        self.dead_time = dead_time  # sec per measurement, rearming and transfer
+        self.chopper = chopper  # fractional signal change on chopped shots
+        self.seed = seed
+        self.nshots = int(nshots)
+        self.calls = collections.Counter()  # every message handled, from every client
+        self.created = {}  # recent measurement_id -> wall-clock time it finished, for latency benchmarks
+        self.config_filepath = pathlib.Path(tempfile.gettempdir()) / f"mock-picotech-{port}.toml"
+        self.config = {
+            "make": "picotech",
+            "model": "ps2000",
+            "port": port,
+            "max_samples": self.nsamples,
+            "timebase": 6,
+            "oversample": 16,
+            "channels": {
+                name: {"enabled": True, "coupling": "DC", "range": "5 V", "invert": False} for name in channels
+            },
+        }
+        self.protocol = {
+            "types": [
+                {"name": "adc_range", "type": "enum", "symbols": self.ranges},
+                {"name": "adc_coupling", "type": "enum", "symbols": ["DC", "AC"]},
+            ],
+            "messages": {name: {} for name in self.messages},
+        }
+        self.processing = None
+        if processing_path is not None:
+            self.config["shots_processing_path"] = str(processing_path)
+            spec = importlib.util.spec_from_file_location(pathlib.Path(processing_path).stem, processing_path)
+            self.processing = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(self.processing)
+        self.down_until = 0.0  # wall-clock time an outage ends
+        self.epoch = time.time()
+        self.first_id = 0
+        self._cached_id = None
+        self._shots = None
+        self._means = None
+        self.processed = None  # channels of the processing module, for the cached measurement
+
+    @property
+    def channel_names(self):
+        return [name for name, channel in self.config["channels"].items() if channel["enabled"]]
+
+    @property
+    def period(self):
+        """Seconds per measurement."""
+        return self.dead_time + self.nshots / self.shot_rate
+
+    def current_id(self):
+        # id of the newest finished measurement
+        return self.first_id + int((time.time() - self.epoch) / self.period)
+
+    def rebase(self):
+        # keep ids increasing across nshots changes and restarts
+        self.first_id = self.current_id()
+        self.epoch = time.time()
+        self._cached_id = None
+
+    def measure(self, measurement_id):
+        """
+        Return (shots, means) of one measurement, shapes (channel, shot, sample) and (channel, sample).
+
+        With a processing module its channels are in ``processed``.
+        """
+        if measurement_id != self._cached_id:
+            seed = None if self.seed is None else (self.seed, measurement_id)
+            rng = np.random.default_rng(seed)
+            nchannels = len(self.channel_names)
+            x = np.arange(self.nsamples)
+            pulse = np.exp(-0.5 * ((x - self.nsamples / 5) / (self.nsamples / 40)) ** 2)
+            scale = self.amplitude * np.arange(1, nchannels + 1) / nchannels
+            noise = rng.normal(0, self.noise, (nchannels, self.nshots, self.nsamples))
+            self._shots = (scale[:, None] * pulse)[:, None, :] + noise
+            if self.chopper:
+                on = np.arange(self.nshots) % 2 == 0
+                self._shots[1:, on] += self.chopper * (scale[1:, None] * pulse)[:, None, :]
+                self._shots[0, on] += 1.0
+            self._means = self._shots.mean(axis=1)
+            if self.processing is not None:
+                values, names, units = self.processing.process(list(self._shots), self.channel_names, {})[:3]
+                self.processed = dict(zip(names, values))
+            self._cached_id = measurement_id
+            self.created.setdefault(measurement_id, self.epoch + (measurement_id - self.first_id) * self.period)
+            while len(self.created) > 1024:
+                del self.created[next(iter(self.created))]
+        return self._shots, self._means
+
+    def outage(self, seconds):
+        """Drop every connection and refuse new ones for seconds, like a network blip or a daemon crash."""
+        self.down_until = time.time() + seconds
+
+    @property
+    def down(self):
+        return time.time() < self.down_until
+
+    def restart(self):
+        # like yaqd, pick up a config written by the client before shutdown(restart=True)
+        if self.config_filepath.exists():
+            written = toml.load(self.config_filepath)
+            for value in written.values():
+                self.config.update(value)
+        self.rebase()
+
+
+class MockClient:
+    """
+    Drop-in replacement for ``yaqc.Client`` talking to a picotech daemon.
+
+    Clients on the same port share one MockDaemon, created on first connect
+    with the given keyword arguments, so the GUI, its worker and a reconnect
+    after a restart all see the same measurements and config.  Every
+    message is counted in ``calls`` and delayed by the daemon's ``latency``.
+    During a MockDaemon.outage messages raise ConnectionError and
+    connecting raises ConnectionRefusedError.
+
+    Use it anywhere a client factory is accepted, e.g.
+    ``Engine(port, client_factory=MockClient)``.
+    """
+
+    daemons = {}
+
+    def __init__(self, port=38008, host="127.0.0.1", **daemon_kwargs):
+        if port not in MockClient.daemons:
+            MockClient.daemons[port] = MockDaemon(port, **daemon_kwargs)
+        self.daemon = MockClient.daemons[port]
+        if self.daemon.down:
+            raise ConnectionRefusedError(f"mock daemon on port {port} is down")
+        self.host = host
+        self._protocol = self.daemon.protocol
+
+    @property
+    def calls(self):
+        return self.daemon.calls
+
+    def _call(self, name):
+        if self.daemon.down:
+            raise ConnectionError(f"mock daemon on port {self.daemon.port} is down")
+        self.daemon.calls[name] += 1
+        if self.daemon.latency:
+            time.sleep(self.daemon.latency)
+
+    def id(self):
+        self._call("id")
+        return {"name": f"mock-picotech-{self.daemon.port}", "kind": "picotech-adc-triggered"}
+
+    def busy(self):
+        self._call("busy")
+        return True
+
+    def get_config(self):
+        self._call("get_config")
+        return toml.dumps(self.daemon.config)
+
+    def get_config_filepath(self):
+        self._call("get_config_filepath")
+        return str(self.daemon.config_filepath)
+
+    def get_mappings(self):
+        self._call("get_mappings")
+        return {"time": np.arange(self.daemon.nsamples, dtype=float) * self.daemon.sample_interval}
+
+    def get_nshots(self):
+        self._call("get_nshots")
+        return self.daemon.nshots
+
+    def set_nshots(self, nshots):
+        self._call("set_nshots")
+        assert nshots > 0
+        self.daemon.rebase()
+        self.daemon.nshots = int(nshots)
+
+    def get_measurement_id(self):
+        self._call("get_measurement_id")
+        return self.daemon.current_id()
+
+    def get_channel_names(self):
+        self._call("get_channel_names")
+        if self.daemon.processing is not None:
+            self.daemon.measure(self.daemon.current_id())
+            return list(self.daemon.processed)
+        return [f"{name}_mean" for name in self.daemon.channel_names]
+
+    def get_measured(self):
+        self._call("get_measured")
+        measurement_id = self.daemon.current_id()
+        shots, means = self.daemon.measure(measurement_id)
+        out = {"measurement_id": measurement_id}
+        if self.daemon.processing is not None:
+            out.update(self.daemon.processed)
+            return out
+        for name, mean in zip(self.daemon.channel_names, means):
+            out[f"{name}_mean"] = mean.copy()
+        return out
+
+    def get_measured_samples(self):
+        """shape [channels, shots, samples]"""
+        self._call("get_measured_samples")
+        shots, means = self.daemon.measure(self.daemon.current_id())
+        return shots.copy()
+
+    def shutdown(self, restart=False):
+        self._call("shutdown")
+        if restart:
+            self.daemon.restart()
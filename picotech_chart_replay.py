@@ -0,0 +1,273 @@
+"""Offline replay of recorded sessions through the engine's chunk rejection, averaging and gates."""
+
+import argparse
+import pathlib
+import sys
+import time
+
+import numpy as np  # type: ignore
+import toml
+
+from picotech_chart_engine import GateSet, Gate, Rejector, Waterfall, parse_gate, range_volts
+
+
+class Replay:
+    """
+    A recorded session, re-processed as fast as the CPU allows.
+
+    path is any of
+
+    - a recording written with RECORD or the headless command: its stem,
+      ``<stem>_shots.npy`` or ``<stem>.toml``.  The chunks are memory-mapped
+      and the channels, sample time, ranges and gates come from the .toml
+    - a Waterfall saved as .npz, i.e. already averaged chart points
+    - a plain .npy array shaped (chunk, channel, sample), or measurement
+      cubes shaped (measurement, channel, shot, sample) as
+      get_measured_samples returns them, which are averaged over shots
+
+    chart runs the chunks through the same steps as Engine.chart: a
+    Rejector, nchunks accepted chunks averaged (or their median) per point
+    and the gates computed from the averaged traces.  Instead of one chunk
+    at a time it works on whole blocks of chunks, so re-gating a night of
+    chunks takes seconds.  Only the z-score check of a Rejector, which
+    depends on the chunks before, still looks at one chunk at a time.
+    Clipping is checked against the range each chunk was recorded at.
+
+    Recordings hold every chunk read, including those rejected while
+    live, so rejection is decided anew.  Chunks are grouped into points
+    as the live chart does: a point takes chunks until nchunks are
+    accepted or 2 * nchunks have been tried, averages the accepted ones
+    (fewer than nchunks if that is all there were) and is skipped if
+    none are.  The Rejector starts over wherever the recording logs a new
+    nshots.  Points still short of chunks at the end of the recording,
+    cut off when the chart was stopped, are dropped.  Measurements that
+    never reached the recording (shots all left out, unmodulated, stale
+    gates) used up tries live that a replay cannot see.
+    """
+
+    def __init__(self, path):
+        path = pathlib.Path(path)
+        self.metadata = {}
+        self.cubes = False  # traces still have a shot axis to average over
+        if path.suffix == ".npz":
+            waterfall = Waterfall.load(path)
+            self.times = waterfall.times.view()
+            self.traces = waterfall.traces.view()
+            self.channel_keys = waterfall.channel_keys
+            self.sample_time = waterfall.sample_time
+            self.origin = 0.0  # waterfall times are chart times already
+            return
+        if path.name.endswith("_shots.npy"):
+            stem = path.with_name(path.name[: -len("_shots.npy")])
+        elif path.suffix in (".toml", ""):
+            stem = path.with_suffix("")
+        else:
+            stem = None
+        if stem is None:
+            self.traces = np.load(path, mmap_mode="r")
+            self.cubes = self.traces.ndim == 4
+            self.times = np.arange(len(self.traces), dtype=float)
+            self.channel_keys = list("ABCDEFGH"[: self.traces.shape[1]])
+            self.sample_time = np.arange(self.traces.shape[-1], dtype=float)
+            self.origin = 0.0
+            return
+        self.metadata = toml.load(f"{stem}.toml")
+        records = np.load(f"{stem}_shots.npy", mmap_mode="r")
+        self.times = records["time"]
+        self.traces = records["traces"]
+        self.channel_keys = list(self.metadata["recorded_channels"])
+        self.sample_time = np.asarray(self.metadata["sample_time"], dtype=float)
+        # chart time is counted from the recorded chart's origin, else the session's shared one
+        first = float(self.times[0]) if len(self.times) else 0.0
+        self.origin = self.metadata.get("origin", self.metadata.get("t0", first))
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def nsamples(self):
+        return len(self.sample_time)
+
+    def gates(self, gates=None):
+        """
+        A GateSet for these traces: of the given Gates, or the gates the
+        session was charted with, or None if it recorded none.
+        """
+        if gates is None:
+            if not self.metadata.get("gates"):
+                return None
+            gates = [Gate(**gate) for gate in self.metadata["gates"]]
+        dt = self.sample_time[1] - self.sample_time[0] if self.nsamples > 1 else 1.0
+        return GateSet(gates, self.channel_keys, self.nsamples, dt=dt)
+
+    def limits(self):
+        """
+        Full scale of each channel in volts for every chunk, (chunk, channel), or None if unknown.
+
+        Range changes the recording lists apply from the chunk they were made at.
+        """
+        channels = self.metadata.get("channels", {})
+        if not all("range" in channels.get(key, {}) for key in self.channel_keys):
+            return None
+        ranges = {key: channels[key]["range"] for key in self.channel_keys}
+        limits = np.empty((len(self), len(self.channel_keys)))
+        start = 0
+        for change in self.metadata.get("changes", []) + [{"chunk": len(self)}]:
+            limits[start : change["chunk"]] = [range_volts(ranges[key]) for key in self.channel_keys]
+            ranges.update(change.get("ranges", {}))
+            start = change["chunk"]
+        return limits
+
+    def read(self, index):
+        """Traces of the chunks at index (an int, slice or index array), (..., channel, sample)."""
+        traces = np.asarray(self.traces[index], dtype=float)
+        if self.cubes:
+            traces = traces.mean(axis=-2)
+        return traces
+
+    def accepted(self, rejector=None, block=4096):
+        """Boolean mask of the chunks rejector passes; all of them without one."""
+        keep = np.ones(len(self), dtype=bool)
+        if rejector is None:
+            return keep
+        limits = self.limits()
+        if rejector.clip and limits is not None:
+            for start in range(0, len(self), block):
+                traces = self.read(slice(start, start + block))
+                keep[start : start + block] = ~rejector.clipped(traces, limits[start : start + block]).any(axis=-1)
+        if rejector.zscore is not None:
+            rejector.reset()
+            # the live chart starts the rejector over at every new nshots
+            resets = sorted(change["chunk"] for change in self.metadata.get("changes", []) if "nshots" in change)
+            epochs = np.searchsorted(resets, np.arange(len(self)), side="right")
+            epoch = 0
+            for start in range(0, len(self), block):
+                traces = self.read(slice(start, start + block))
+                for offset in np.flatnonzero(keep[start : start + block]):
+                    if epochs[start + offset] != epoch:
+                        epoch = epochs[start + offset]
+                        rejector.reset()
+                    keep[start + offset] = rejector.check(traces[offset]) is None
+        return keep
+
+    def groups(self, nchunks, keep):
+        """
+        Chunks of every chart point, as the live chart takes them.
+
+        Returns
+        -------
+        list of arrays
+            The accepted chunk indices of each point, in order; points with none are left out.
+        """
+        accepted = np.concatenate([[0], np.cumsum(keep)])  # accepted chunks before each chunk
+        groups = []
+        start = 0
+        while True:
+            # until nchunks are accepted or 2 * nchunks tried
+            stop = min(int(np.searchsorted(accepted, accepted[start] + nchunks)), start + 2 * nchunks)
+            if stop > len(keep):
+                return groups
+            if accepted[stop] > accepted[start]:
+                groups.append(start + np.flatnonzero(keep[start:stop]))
+            start = stop
+
+    def points(self, nchunks, rejector=None, median=False, block=4096):
+        """
+        Averaged traces of every chart point, in blocks of about block chunks.
+
+        Yields
+        ------
+        tuple
+            (chart times, shape (point,), averaged traces, shape (point, channel, sample))
+        """
+        groups = self.groups(nchunks, self.accepted(rejector, block))
+        step = max(1, block // nchunks)
+        for start in range(0, len(groups), step):
+            group = groups[start : start + step]
+            counts = np.array([len(chunks) for chunks in group])
+            index = np.concatenate(group)
+            offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+            traces = self.read(index)
+            if median:
+                average = np.stack([np.median(traces[i : i + n], axis=0) for i, n in zip(offsets, counts)])
+            else:
+                average = np.add.reduceat(traces, offsets, axis=0) / counts[:, None, None]
+            times = np.add.reduceat(np.asarray(self.times[index], dtype=float), offsets) / counts
+            yield times - self.origin, average
+
+    def chart(self, nchunks, gates, rejector=None, median=False, block=4096):
+        """
+        Chart gates over the whole recording.
+
+        Returns
+        -------
+        tuple
+            (chart times, shape (point,), gate values, shape (point, gate))
+        """
+        times = [np.empty(0)]
+        values = [np.empty((0, len(gates)))]
+        for elapsed, average in self.points(nchunks, rejector, median, block):
+            times.append(elapsed)
+            values.append(gates.compute(average))
+        return np.concatenate(times), np.concatenate(values)
+
+    def waterfall(self, nchunks, rejector=None, median=False, block=4096):
+        """A Waterfall of every chart point's averaged traces, to recompute gates over at will."""
+        blocks = list(self.points(nchunks, rejector, median, block))
+        waterfall = Waterfall(max(sum(len(times) for times, _ in blocks), 1), self.channel_keys, self.sample_time)
+        for times, average in blocks:
+            waterfall.extend(times, average)
+        return waterfall
+
+
+def main(argv=None):
+    """Re-chart a recorded session with new settings: ``python -m picotech_chart_replay STEM``."""
+    parser = argparse.ArgumentParser(prog="picotech_chart_replay", description=main.__doc__)
+    parser.add_argument("path", help="recording stem, its _shots.npy or .toml, a waterfall .npz or a .npy array")
+    parser.add_argument("--chunks", type=int, default=1, help="accepted chunks averaged per chart point")
+    parser.add_argument(
+        "--gate",
+        action="append",
+        default=[],
+        metavar="NAME:CHANNEL:START:STOP[:METHOD]",
+        help="gate in samples, repeatable; default is the recorded gates, else samples 1-5 of every channel",
+    )
+    parser.add_argument(
+        "--chunk-reject",
+        type=float,
+        default=None,
+        metavar="Z",
+        help="leave out chunks above this robust z from the running mean",
+    )
+    parser.add_argument("--keep-clipped", action="store_true", help="average chunks that reach the ADC range too")
+    parser.add_argument("--median", action="store_true", help="chart the median of each point's chunks, not the mean")
+    parser.add_argument("--output", default=None, help="write the chart to this .npy file instead of printing it")
+    args = parser.parse_args(argv)
+
+    replay = Replay(args.path)
+    if args.gate:
+        gates = replay.gates([parse_gate(text, replay.channel_keys) for text in args.gate])
+    else:
+        gates = replay.gates()
+    if gates is None:
+        stop = min(5, replay.nsamples)
+        gates = replay.gates([Gate(f"{key} signal", key, min(1, stop - 1), stop) for key in replay.channel_keys])
+    rejector = Rejector(zscore=args.chunk_reject, clip=not args.keep_clipped)
+    began = time.perf_counter()
+    times, values = replay.chart(args.chunks, gates, rejector, args.median)
+    seconds = time.perf_counter() - began
+    print(f"{len(replay)} chunks to {len(times)} points in {seconds:.2f} s", file=sys.stderr)
+    if args.output is not None:
+        # same layout as a recording's _chart.npy, wall-clock times included
+        chart = np.empty(len(times), dtype=[("time", "f8"), ("values", "f8", (len(gates),))])
+        chart["time"] = times + replay.origin
+        chart["values"] = values
+        np.save(args.output, chart)
+        return
+    print("time (s)\t" + "\t".join(gate.name for gate in gates.gates))
+    for elapsed, row in zip(times, values):
+        print(f"{elapsed:.3f}\t" + "\t".join(f"{value:.6g}" for value in row))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,260 @@
+"""
+Shots processing module for yaqd-picotech that reduces every measurement to gate values inside the daemon.
+
+Point a daemon at it in its config.toml::
+
+    shots_processing_path = "path/to/picotech_processing.py"
+
+Each measurement then publishes, besides every channel's mean trace
+("A_mean", "B_mean", ...):
+
+- "gate_values": each gate's per-shot value (ratios and background
+  subtraction included) averaged over the kept shots
+- "gate_std": the shot-to-shot standard deviation of those values
+- "shots_kept": how many shots were averaged, after outlier rejection
+- "gates_version": version of the gates the values were computed with
+- "timestamp": wall-clock time the measurement was processed
+
+The gates are read from a control file next to this module, with the same
+name and a .json suffix, which picotech_chart_engine writes (see
+Engine.write_processing_gates) and which is reread whenever it changes.
+Daemons running side by side each need their own copy of the module, so
+that each has its own control file.
+
+Gate and GateSet live here, needing nothing but numpy, so the daemon can
+load this module without the rest of the project's dependencies; the
+engine imports them from here.
+"""
+
+import json
+import pathlib
+import time
+
+import numpy as np  # type: ignore
+
+
+class Gate:
+    """
+    A named sample window on one channel.
+
+    Parameters
+    ----------
+    name : str
+        Label, also used by other gates to refer to this one.
+    channel : str
+        Channel key, e.g. "B".
+    start, stop : int
+        Sample indices of the window, stop exclusive.
+    method : {"mean", "integral", "peak"} (optional)
+        How the window is reduced. "integral" is in volts times the sample
+        time unit, "peak" is the sample with the largest magnitude.
+        Default is "mean".
+    baseline : str (optional)
+        Name of a gate whose value is subtracted from this one.
+    reference : str (optional)
+        Name of a gate this one is divided by, after baseline subtraction.
+    """
+
+    methods = ["mean", "integral", "peak"]
+
+    def __init__(self, name, channel, start, stop, method="mean", baseline=None, reference=None):
+        self.name = name
+        self.channel = channel
+        self.start = int(start)
+        self.stop = int(stop)
+        self.method = method
+        self.baseline = baseline
+        self.reference = reference
+
+    def to_dict(self):
+        d = {"name": self.name, "channel": self.channel, "start": self.start, "stop": self.stop}
+        d["method"] = self.method
+        if self.baseline:
+            d["baseline"] = self.baseline
+        if self.reference:
+            d["reference"] = self.reference
+        return d
+
+
+class GateSet:
+    """
+    Reduce traces to one value per gate in a single vectorized pass.
+
+    compute accepts any array shaped (..., channel, sample), so the same
+    GateSet works on one averaged trace or on a whole stack of them.
+
+    Raises ValueError if a gate's baseline or reference names a gate that
+    is not in the set.
+    """
+
+    def __init__(self, gates, channel_keys, nsamples, dt=1.0):
+        self.gates = list(gates)
+        self.names = [gate.name for gate in self.gates]
+        self.dt = dt
+        index = {name: i for i, name in enumerate(self.names)}
+        for gate in self.gates:
+            for role, name in (("baseline", gate.baseline), ("reference", gate.reference)):
+                if name and name not in index:
+                    raise ValueError(f"{role} {name!r} of gate {gate.name!r} is not one of the gates {self.names}")
+        self.channel_index = np.array([list(channel_keys).index(g.channel) for g in self.gates], dtype=int)
+        self.mask = np.zeros((len(self.gates), nsamples), dtype=bool)
+        for i, gate in enumerate(self.gates):
+            self.mask[i, max(gate.start, 0) : max(gate.stop, 0)] = True
+        self.weights = self.mask.astype(float)
+        counts = self.mask.sum(axis=1)
+        self.counts = np.where(counts > 0, counts, np.nan)
+        self.is_integral = np.array([g.method == "integral" for g in self.gates], dtype=bool)
+        self.is_peak = np.array([g.method == "peak" for g in self.gates], dtype=bool)
+        self.baseline_index = np.array([index.get(g.baseline, 0) for g in self.gates], dtype=int)
+        self.has_baseline = np.array([bool(g.baseline) for g in self.gates], dtype=bool)
+        self.reference_index = np.array([index.get(g.reference, 0) for g in self.gates], dtype=int)
+        self.has_reference = np.array([bool(g.reference) for g in self.gates], dtype=bool)
+
+    def __len__(self):
+        return len(self.gates)
+
+    def compute(self, traces):
+        """
+        Parameters
+        ----------
+        traces : array
+            Shape (..., channel, sample).
+
+        Returns
+        -------
+        array
+            Shape (..., gate).
+        """
+        rows = np.asarray(traces)[..., self.channel_index, :]  # (..., gate, sample)
+        sums = np.einsum("...gs,gs->...g", rows, self.weights)
+        values = np.where(self.is_integral, sums * self.dt, sums / self.counts)
+        if self.is_peak.any():
+            magnitude = np.where(self.mask, np.abs(rows), -1)
+            peak_index = np.argmax(magnitude, axis=-1)[..., None]
+            peaks = np.take_along_axis(rows, peak_index, axis=-1)[..., 0]
+            values = np.where(self.is_peak, peaks, values)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            if self.has_baseline.any():
+                values = values - np.where(self.has_baseline, values[..., self.baseline_index], 0)
+            if self.has_reference.any():
+                values = np.where(self.has_reference, values / values[..., self.reference_index], values)
+        return values
+
+
+def reject_outliers(values, threshold):
+    """
+    Flag shots whose values lie more than threshold robust z-scores from the median.
+
+    values is (shot, value); each column is scored against its median and
+    median absolute deviation, so a few wild shots do not inflate the spread
+    they are judged by.  Columns without spread, and NaN values, never
+    reject a shot.
+
+    Returns
+    -------
+    numpy.ndarray
+        Boolean (shot,) mask of the shots to keep.
+    """
+    median = np.nanmedian(values, axis=0)
+    deviation = np.abs(values - median)
+    mad = np.nanmedian(deviation, axis=0)
+    # 0.6745 makes the MAD of Gaussian noise equal to its standard deviation
+    z = 0.6745 * deviation / np.where(mad > 0, mad, np.inf)
+    return ~np.any(z > threshold, axis=1)
+
+
+class Control:
+    """
+    The control file written by the engine, reread when it changes.
+
+    It holds "version", "gates" (Gate.to_dict dicts), "dt" (sample time
+    step, for integrals), "invert" (channel -> bool; the daemon hands over
+    traces before inverting them) and "reject" (robust z-score above which
+    a shot is left out, or null).
+    """
+
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+        self.stamp = None
+        self.settings = {"version": 0, "gates": [], "dt": 1.0, "invert": {}, "reject": None}
+        self.gates = None  # GateSet, built for the channels and samples of the first measurement to use it
+        self.layout = None
+
+    def refresh(self):
+        try:
+            stat = self.path.stat()
+        except OSError:
+            return
+        if (stat.st_mtime_ns, stat.st_size) == self.stamp:
+            return
+        try:
+            self.settings = json.loads(self.path.read_text())
+        except ValueError:
+            return  # caught mid-write; try again on the next measurement
+        self.stamp = (stat.st_mtime_ns, stat.st_size)
+        self.gates = None
+
+    def gate_set(self, names, nsamples):
+        if self.gates is None or self.layout != (tuple(names), nsamples):
+            gates = [Gate(**gate) for gate in self.settings["gates"] if gate["channel"] in names]
+            # so are the gates subtracting or dividing by a gate left out
+            while True:
+                kept = {gate.name for gate in gates} | {None}
+                complete = [gate for gate in gates if gate.baseline in kept and gate.reference in kept]
+                if len(complete) == len(gates):
+                    break
+                gates = complete
+            self.gates = GateSet(gates, names, nsamples, dt=self.settings.get("dt", 1.0))
+            self.layout = (tuple(names), nsamples)
+        return self.gates
+
+
+control = Control(pathlib.Path(__file__).with_suffix(".json"))
+
+
+def process(samples, names, units):
+    """
+    Reduce one measurement; called by the daemon after every measurement.
+
+    Parameters
+    ----------
+    samples : iterable of arrays
+        One (shot, sample) array per enabled channel, in the order of names.
+    names : list of str
+        Channel names, e.g. ["A", "B"].
+    units : dict
+        Channel name -> units.
+
+    Returns
+    -------
+    list
+        [values, names, units] of the published channels.
+    """
+    control.refresh()
+    settings = control.settings
+    shots = np.stack(list(samples), axis=1)  # (shot, channel, sample)
+    invert = [i for i, name in enumerate(names) if settings["invert"].get(name)]
+    if invert:
+        shots[:, invert] *= -1
+    out_names = [f"{name}_mean" for name in names]
+    out_values = list(shots.mean(axis=0))
+    out_units = {f"{name}_mean": units.get(name, "V") for name in names}
+    gates = control.gate_set(names, shots.shape[-1])
+    values = gates.compute(shots)  # (shot, gate)
+    keep = np.ones(len(shots), dtype=bool)
+    if settings["reject"] is not None and len(shots) > 2 and len(gates):
+        keep = reject_outliers(values, settings["reject"])
+        if not keep.any():
+            keep[:] = True
+    kept = values[keep]
+    out_names += ["gate_values", "gate_std", "shots_kept", "gates_version", "timestamp"]
+    out_values += [
+        kept.mean(axis=0),
+        kept.std(axis=0, ddof=1) if len(kept) > 1 else np.zeros(len(gates)),
+        int(keep.sum()),
+        int(settings["version"]),
+        time.time(),
+    ]
+    out_units.update({"gate_values": None, "gate_std": None, "shots_kept": None, "gates_version": None})
+    out_units["timestamp"] = "s"
+    return [out_values, out_names, out_units]
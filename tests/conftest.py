@@ -0,0 +1,22 @@
+import itertools
+import pathlib
+import sys
+
+import pytest
+
+# the modules live at the top of the repository, next to this folder
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+_ports = itertools.count(41000)
+
+
+@pytest.fixture
+def port():
+    """A port no other test has used, so every test gets its own MockDaemon."""
+    return next(_ports)
+
+
+@pytest.fixture
+def other_port():
+    """A second unused port, for tests with two daemons."""
+    return next(_ports)
@@ -0,0 +1,481 @@
+import asyncio
+import functools
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from picotech_chart_engine import (
+    AsyncClient,
+    AsyncMonitor,
+    ChartScheduler,
+    Checkpoint,
+    DaemonCache,
+    Demodulator,
+    Engine,
+    Gate,
+    GateSet,
+    Instrumentation,
+    MeasurementWatcher,
+    NpyAppender,
+    Rejector,
+    RingBuffer,
+    RunningStats,
+    choose_nshots,
+    fit_nshots,
+)
+from picotech_chart_mock import MockClient
+
+
+def make_engine(port, **daemon_kwargs):
+    daemon_kwargs.setdefault("shot_rate", 20000)
+    daemon_kwargs.setdefault("seed", 0)
+    return Engine(port, client_factory=functools.partial(MockClient, **daemon_kwargs)).connect()
+
+
+def run_chart(engine, seconds, *args, **kwargs):
+    """Chart for seconds, returning the points."""
+    timer = threading.Timer(seconds, engine.stop)
+    timer.start()
+    try:
+        return [(elapsed, values.copy()) for elapsed, values, stats in engine.chart(*args, **kwargs)]
+    finally:
+        timer.cancel()
+
+
+def test_ring_buffer_wraps_and_grows():
+    ring = RingBuffer(5, initial=2)
+    for i in range(3):
+        ring.append(i)
+    assert ring.view().tolist() == [0, 1, 2]
+    ring.extend(np.arange(3, 9))
+    assert ring.view().tolist() == [4, 5, 6, 7, 8]
+    ring.append(9)
+    assert ring.view().tolist() == [5, 6, 7, 8, 9]
+    ring.resize(3)
+    assert ring.view().tolist() == [7, 8, 9]
+    ring.extend(np.arange(100))
+    assert ring.view().tolist() == [97, 98, 99]
+
+
+def test_ring_buffer_memmap(tmp_path):
+    ring = RingBuffer(4, shape=(2,), path=tmp_path / "ring.npy")
+    for i in range(6):
+        ring.append([i, -i])
+    assert ring.view()[:, 0].tolist() == [2, 3, 4, 5]
+    assert (tmp_path / "ring.npy").exists()
+
+
+def test_npy_appender_is_always_loadable(tmp_path):
+    path = tmp_path / "records.npy"
+    appender = NpyAppender(path, [("time", "f8"), ("values", "f8", (2,))])
+    for i in range(3):
+        appender.append((i, [i, 2 * i]))
+        loaded = np.load(path)
+        assert len(loaded) == i + 1
+    appender.close()
+    assert np.load(path, mmap_mode="r")["values"][2].tolist() == [2, 4]
+
+
+def test_running_stats_matches_numpy():
+    chunks = np.random.default_rng(2).normal(size=(7, 2, 5))
+    stats = RunningStats((2, 5), keep=7)
+    for chunk in chunks:
+        stats.add(chunk)
+    assert stats.mean == pytest.approx(chunks.mean(axis=0))
+    assert stats.std() == pytest.approx(chunks.std(axis=0, ddof=1))
+    assert stats.sem() == pytest.approx(chunks.std(axis=0, ddof=1) / np.sqrt(7))
+    assert stats.min == pytest.approx(chunks.min(axis=0))
+    assert stats.max == pytest.approx(chunks.max(axis=0))
+    assert stats.average() == pytest.approx(np.median(chunks, axis=0))
+
+
+def test_rejector_clip_and_zscore():
+    rng = np.random.default_rng(3)
+    limits = np.array([1.0, 1.0])
+    rejector = Rejector(zscore=5.0, clip=True, warmup=5)
+    assert rejector.check(np.full((2, 200), 0.995), limits) == "clipped"
+    for _ in range(20):
+        assert rejector.check(rng.normal(0, 0.01, (2, 200)), limits) is None
+    assert rejector.check(rng.normal(0, 0.01, (2, 200)) + 0.5, limits) == "outlier"
+    # a level that persists is taken as real after patience rejections
+    reasons = [rejector.check(np.full((2, 200), 0.5), limits) for _ in range(rejector.patience + 1)]
+    assert reasons[-1] is None
+    assert rejector.rebaselined == 1
+
+
+def test_checkpoint_round_trip(tmp_path):
+    path = tmp_path / "checkpoint.npz"
+    checkpoint = Checkpoint(path, interval=1000.0)
+    gates = GateSet([Gate("s", "B", 1, 5, baseline="b"), Gate("b", "B", 10, 20)], ["A", "B"], 20)
+    origin = checkpoint.begin(gates, 123.0, {"nchunks": 3})
+    stats = RunningStats((2, 20))
+    stats.add(np.ones((2, 20)))
+    for i in range(4):
+        checkpoint.add(float(i), np.array([i, -i]), stats)
+    checkpoint.write()
+    state = Checkpoint.load(path)
+    assert origin == 123.0
+    assert state["origin"] == 123.0
+    assert state["nchunks"] == 3
+    assert state["gates"] == [gate.to_dict() for gate in gates.gates]
+    assert state["times"].tolist() == [0, 1, 2, 3]
+    assert state["values"][:, 1].tolist() == [0, -1, -2, -3]
+    assert state["stats"]["count"] == 1
+    resumed = Checkpoint(path).begin(gates, 999.0, {}, resume=True)
+    assert resumed == 123.0
+
+
+def test_checkpoint_keeps_lockin_settings(tmp_path):
+    path = tmp_path / "checkpoint.npz"
+    gates = GateSet([Gate("s", "B", 1, 5)], ["A", "B"], 20)
+    demodulator = Demodulator(Gate("ref", "A", 1, 5), threshold=0.5, nbins=4, ratio=True, separation=3.0)
+    checkpoint = Checkpoint(path, interval=1000.0)
+    checkpoint.begin(gates, 123.0, {"singleshot": True, "demodulator": demodulator.to_dict()})
+    checkpoint.add(0.0, np.array([1.0]), None)
+    checkpoint.write()
+    state = Checkpoint.load(path)
+    restored = Demodulator.from_dict(state["demodulator"])
+    assert restored.to_dict() == demodulator.to_dict()
+    assert restored.reference.name == "ref" and restored.nbins == 4 and restored.ratio
+    # a plain chart does not continue a lock-in one, nor the other way round
+    assert Checkpoint(path).begin(gates, 999.0, {"demodulator": None}, resume=True) == 999.0
+    checkpoint.write()
+    other = dict(demodulator.to_dict(), ratio=False)
+    assert Checkpoint(path).begin(gates, 999.0, {"demodulator": other}, resume=True) == 999.0
+    checkpoint.write()
+    assert Checkpoint(path).begin(gates, 999.0, {"demodulator": demodulator.to_dict()}, resume=True) == 123.0
+
+
+def test_lockin_chart_checkpoints_its_settings(port, tmp_path):
+    engine = make_engine(port, chopper=1.0)
+    engine.checkpoint = Checkpoint(tmp_path / "checkpoint.npz", interval=0.0)
+    engine.set_demodulator(Demodulator(Gate("ref", "A", 1, 100)))
+    gates = GateSet([Gate("s", "B", 30, 50)], engine.channel_keys, engine.nsamples)
+    run_chart(engine, 0.5, 1, gates)
+    state = Checkpoint.load(tmp_path / "checkpoint.npz")
+    assert state["singleshot"] is True
+    assert state["demodulator"] == engine.demodulator.to_dict()
+
+
+def test_recover_reads_daemon_state_anew(port):
+    engine = make_engine(port)
+    assert engine.cache.get("nshots", engine.client) == 100
+    # the daemon restarts with its default nshots while the engine is cut off
+    daemon = MockClient.daemons[port]
+    daemon.nshots = 200
+    daemon.outage(0.2)
+    engine.recover(ConnectionError("down"))
+    assert engine.cache.get("nshots", engine.client) == 200
+    engine.apply_nshots(100)
+    assert daemon.nshots == 100
+
+
+def test_acquire_leaves_the_chart_checkpoint_alone(port, tmp_path):
+    engine = make_engine(port)
+    engine.checkpoint = Checkpoint(tmp_path / "checkpoint.npz", interval=0.0)
+    gates = GateSet([Gate("s", "B", 30, 50)], engine.channel_keys, engine.nsamples)
+    points = run_chart(engine, 0.5, 1, gates)
+    # e.g. ACQUIRE in a GUI started afterwards, with the same checkpoint path
+    engine.checkpoint = Checkpoint(tmp_path / "checkpoint.npz", interval=0.0)
+    engine.acquire(2)
+    state = Checkpoint.load(tmp_path / "checkpoint.npz")
+    assert len(state["times"]) == len(points) > 0
+    assert state["gates"] == [gate.to_dict() for gate in gates.gates]
+
+
+def test_reconnect_takes_a_changed_config(port):
+    engine = make_engine(port)
+    changes = []
+    engine.range_listeners.append(lambda key, value: changes.append((key, value)))
+    assert engine.limits.tolist() == [5.0, 5.0]
+    # the daemon restarts with another range on B
+    daemon = MockClient.daemons[port]
+    daemon.config["channels"]["B"]["range"] = "1 V"
+    daemon.outage(0.2)
+    engine.recover(ConnectionError("down"))
+    assert engine.config["channels"]["B"]["range"] == "1 V"
+    assert engine.limits.tolist() == [5.0, 1.0]
+    assert changes == [("B", "1 V")]
+    # and one that no longer has B
+    daemon.config["channels"]["B"]["enabled"] = False
+    daemon.outage(0.2)
+    with pytest.raises(RuntimeError, match="channels"):
+        engine.recover(ConnectionError("down"))
+
+
+def test_stop_cuts_a_reconnect_short(port):
+    engine = make_engine(port)
+    MockClient.daemons[port].outage(60.0)
+    threading.Timer(0.2, engine.stop).start()
+    began = time.monotonic()
+    assert engine.recover(ConnectionError("down")) is False
+    assert time.monotonic() - began < 2.0
+
+
+def test_chunk_without_kept_shots_is_rejected(port):
+    engine = make_engine(port, amplitude=10.0)  # every shot clips the 5 V range of B
+    engine.set_rejector(Rejector(clip=True))
+    result = engine.acquire(3, singleshot=True)
+    assert result["count"] == 0
+    assert engine.instrumentation.counters["chunks no shots kept"] == 6
+    assert engine.instrumentation.counters["shots clipped"] > 0
+
+
+def test_daemon_cache_fetches_once(port):
+    clients = [MockClient(port, shot_rate=20000, seed=0) for _ in range(2)]
+    calls = clients[0].calls
+    cache = DaemonCache().prefetch(clients[0])
+    fetched = calls.copy()
+    assert cache.get("config", clients[1]) is cache.get("config", clients[0])
+    assert cache.get("nshots", clients[1]) == 100
+    assert calls == fetched  # one round trip per item, whichever client asks
+    cache.set_nshots(clients[1], 100)
+    assert calls["set_nshots"] == 0  # known to be set already
+    cache.set_nshots(clients[1], 50)
+    assert cache.get("nshots", clients[0]) == 50
+    assert calls["set_nshots"] == calls["get_nshots"] == 1
+    cache.invalidate("config")
+    cache.get("config", clients[0])
+    assert calls["get_config"] == 2
+    assert calls["get_nshots"] == 1
+
+
+def test_config_is_read_anew_after_writing_it(port):
+    engine = make_engine(port)
+    engine.range_debounce = 0.0
+    calls = engine.client.calls
+    assert calls["get_config"] == 1
+    engine.request_range("B", "1 V")
+    engine.apply_pending()  # writes the config and restarts the daemon
+    assert calls["get_config"] == 2
+    assert engine.config["channels"]["B"]["range"] == "1 V"
+    assert engine.cache.get("config", engine.client) is engine.config
+    assert calls["get_config"] == 2
+
+
+def test_fit_and_choose_nshots():
+    # 2 ms overhead per measurement at 10 kHz, 1 ms per read
+    probes = [{"nshots": n, "period": 0.002 + n / 10000, "fetch": 0.001} for n in (100, 1000)]
+    model = fit_nshots(probes)
+    assert model["shot_rate"] == pytest.approx(10000)
+    assert model["overhead"] == pytest.approx(0.002)
+    assert model["fetch"] == pytest.approx(0.001)
+    choice = choose_nshots(model, target_latency=0.1, nchunks=2)
+    assert choice["latency"] <= 0.1 + 1e-9
+    assert choice["nshots"] == 480
+
+
+def test_watcher_sleeps_between_measurements(port):
+    client = MockClient(port, shot_rate=5000, seed=0)  # a measurement every 20 ms
+    watcher = MeasurementWatcher(client)
+    ids = [watcher.wait()["measurement_id"] for _ in range(25)]
+    assert np.all(np.diff(ids) >= 1)
+    assert watcher.skipped == ids[-1] - ids[0] - 24
+    assert watcher.period == pytest.approx(0.02, rel=0.25)
+    # polling every 2 ms would take about 10 calls per measurement
+    assert client.calls["get_measured"] == watcher.polls < 4 * 26
+
+
+def test_one_get_measured_per_chunk(port):
+    engine = make_engine(port)
+    calls = engine.client.calls
+    before, polls = calls.copy(), engine.watcher.polls
+    assert engine.acquire(20)["count"] == 20
+    # the poll that sees a new measurement is also the read
+    assert calls["get_measured"] - before["get_measured"] == engine.watcher.polls - polls
+    assert calls["get_measured_samples"] == calls["get_measurement_id"] == 0
+    assert engine.acquire(20, singleshot=True)["count"] == 20
+    assert calls["get_measured_samples"] == 20
+
+
+def test_acquire_stops_at_target(port):
+    engine = make_engine(port, noise=20.0)  # a signal to noise of about 1.2 per chunk
+    gates = GateSet([Gate("s", "B", 30, 50)], engine.channel_keys, engine.nsamples)
+    chunks = []
+    target = {"kind": "snr", "value": 5, "gates": gates}
+    result = engine.acquire(200, target=target, callback=lambda traces, stats: chunks.append(stats.count))
+    assert engine.min_target_chunks < result["count"] < 200
+    assert len(chunks) == result["count"]  # no chunk read past the target
+    assert result["snr"][0] >= 5
+    assert 0 < result["seconds"] < 1.0
+    result = engine.acquire(30, target={"kind": "snr", "value": 1e6, "gates": gates})
+    assert result["count"] == 30  # out of reach: nchunks caps it
+    assert result["snr"][0] < 1e6
+    result = engine.acquire(30, target={"kind": "sem", "value": 1e3, "gates": gates})
+    assert result["count"] == engine.min_target_chunks
+
+
+def test_async_client_runs_daemon_calls(port):
+    instrumentation = Instrumentation()
+    factory = functools.partial(MockClient, shot_rate=20000, seed=0)
+
+    async def measure():
+        client = await AsyncClient(port, client_factory=factory, instrumentation=instrumentation).connect()
+        try:
+            return await client.get_measured(), await client.get_nshots()
+        finally:
+            client.close()
+
+    measured, nshots = asyncio.run(measure())
+    assert measured["B_mean"].shape == (200,)
+    assert nshots == 100
+    assert instrumentation.timers["monitor rpc get_measured"][0] == 1
+
+
+def test_monitor_polls_scopes_together(port, other_port):
+    factory = functools.partial(MockClient, shot_rate=2000, latency=0.2, seed=0)  # a measurement every 50 ms
+    seen = {port: [], other_port: []}
+    monitor = AsyncMonitor()
+    scopes = [monitor.add(key, "AB", seen[key].append, client_factory=factory) for key in seen]
+
+    async def poll():
+        began = time.monotonic()
+        await monitor.poll()
+        return time.monotonic() - began
+
+    try:
+        asyncio.run(poll())  # connects
+        assert asyncio.run(poll()) < 0.3  # both daemons' 0.2 s calls at once
+        assert [len(traces) for traces in seen.values()] == [2, 2]
+        assert seen[port][-1].shape == (2, 200)
+        scopes[1].paused = True
+        calls = MockClient.daemons[other_port].calls["get_measured"]
+        asyncio.run(poll())
+        assert MockClient.daemons[other_port].calls["get_measured"] == calls
+        assert [len(traces) for traces in seen.values()] == [3, 2]
+        MockClient.daemons[port].outage(0.3)
+        asyncio.run(poll())  # reported, and the scope reconnects once the daemon is back
+        assert scopes[0].client.client is None
+        time.sleep(0.3)
+        asyncio.run(poll())
+        assert len(seen[port]) == 4
+    finally:
+        monitor.close()
+
+
+class Clock:
+    """Stands in for time.monotonic and a stop event, so schedules run instantly."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.waits = []
+
+    def __call__(self):
+        return self.now
+
+    def is_set(self):
+        return False
+
+    def wait(self, timeout):
+        self.waits.append(timeout)
+        self.now += timeout
+        return False
+
+
+def test_fixed_schedule_drops_overrun_slots(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(time, "monotonic", clock)
+    scheduler = ChartScheduler("fixed", interval=1.0)
+    assert scheduler.wait(clock) is False
+    clock.now += 0.4  # a point well within its slot
+    scheduler.wait(clock)
+    assert clock.waits == [0.0, pytest.approx(0.6)]
+    clock.now += 3.5  # a slow point overruns slots 2 and 3
+    scheduler.wait(clock)
+    assert scheduler.missed == 2
+    assert clock.waits[-1] == 0.0  # starts on the slot it is in, no burst to catch up
+    clock.now += 0.2
+    scheduler.wait(clock)
+    assert clock.now == pytest.approx(5.0)  # still on the grid anchored at the start
+    assert scheduler.missed == 2
+    scheduler.start()
+    assert scheduler.missed == 0
+
+
+def test_every_schedule_stays_on_its_grid():
+    scheduler = ChartScheduler("every", every=5)
+    assert scheduler.min_id() is None
+    scheduler.started(10)
+    assert scheduler.min_id() == 15
+    scheduler.started(17)  # a point that ran late still counts from the grid
+    assert scheduler.min_id() == 20
+    assert ChartScheduler("fast").min_id() is None
+    with pytest.raises(ValueError):
+        ChartScheduler("sometimes")
+
+
+def test_chart_on_every_nth_measurement(port, tmp_path):
+    engine = make_engine(port)
+    engine.record_directory = tmp_path
+    gates = GateSet([Gate("s", "B", 30, 50)], engine.channel_keys, engine.nsamples)
+    assert len(run_chart(engine, 0.5, 1, gates, scheduler=ChartScheduler("every", every=4), record=True)) > 3
+    ids = np.load(next(tmp_path.glob("*_shots.npy")))["measurement_id"]
+    slots = ids - (ids - ids[0]) % 4  # a late point starts past its slot, the next ones are back on the grid
+    assert np.all(np.diff(slots) > 0)
+    assert np.mean(ids == slots) > 0.5
+
+
+def test_chart_counts_missed_slots(port):
+    engine = make_engine(port)
+    gates = GateSet([Gate("s", "B", 30, 50)], engine.channel_keys, engine.nsamples)
+    scheduler = ChartScheduler("fixed", interval=0.01)
+    run_chart(engine, 0.5, 1, gates, scheduler=scheduler, callback=lambda traces, stats: time.sleep(0.05))
+    assert scheduler.missed > 0
+    assert engine.instrumentation.counters["chart slots missed"] == scheduler.missed
+
+
+def test_chart_averages_mock_measurements(port):
+    engine = make_engine(port, nshots=20)
+    gates = GateSet([Gate("B signal", "B", 30, 50)], engine.channel_keys, engine.nsamples)
+    points = run_chart(engine, 0.5, 2, gates)
+    assert len(points) >= 3
+    # the mock's pulse on B peaks at 1 V around sample 40
+    assert 0.5 < points[-1][1][0] < 1.0
+
+
+def test_demodulator_splits_chopped_shots():
+    rng = np.random.default_rng(5)
+    shots = rng.normal(0, 0.01, (100, 2, 10))  # (shot, channel, sample)
+    on = np.arange(100) % 2 == 0
+    shots[on, 0] += 1.0  # reference
+    shots[on, 1] += 0.2  # signal
+    demodulator = Demodulator(Gate("ref", "A", 0, 10))
+    values = shots[:, 1].mean(axis=-1)[:, None]
+    result = demodulator.demodulate(shots, np.ones(100, dtype=bool), ["A", "B"], values)
+    assert result["on"] == result["off"] == 50
+    assert result["values"][0] == pytest.approx(0.2, abs=0.005)
+    assert result["errors"][0] == pytest.approx(0.01 / np.sqrt(10) * np.sqrt(2 / 50), rel=0.3)
+    inverted = Demodulator(Gate("ref", "A", 0, 10), invert=True).demodulate(shots, np.ones(100, dtype=bool), ["A", "B"])
+    assert inverted["traces"][1] == pytest.approx(-result["traces"][1])
+    # the reference window alone decides, whatever the reference gate subtracts in the chart
+    subtracted = Demodulator(Gate("ref", "A", 0, 10, baseline="A background"))
+    assert subtracted.levels(shots, ["A", "B"]) == pytest.approx(demodulator.levels(shots, ["A", "B"]))
+
+
+@pytest.mark.parametrize("distribution", ["normal", "uniform"])
+def test_demodulator_rejects_unmodulated_reference(distribution):
+    rng = np.random.default_rng(6)
+    levels = getattr(rng, distribution)(size=1000)
+    for nbins in (2, 4):
+        assert Demodulator(Gate("ref", "A", 0, 1), nbins=nbins).bins(levels) is None
+    # a chopped reference with the same noise is split
+    levels[::2] += 10 * levels.std()
+    assert Demodulator(Gate("ref", "A", 0, 1)).bins(levels) is not None
+    assert Demodulator(Gate("ref", "A", 0, 1), min_contrast=1e6).bins(levels) is None
+
+
+@pytest.mark.parametrize("chopper", [0.0, 0.1])
+def test_lockin_chart_needs_a_chopper(port, chopper):
+    engine = make_engine(port, nshots=50, chopper=chopper)
+    gates = GateSet([Gate("B signal", "B", 30, 50)], engine.channel_keys, engine.nsamples)
+    engine.set_demodulator(Demodulator(Gate("A reference", "A", 30, 50)))
+    points = run_chart(engine, 0.5, 1, gates)
+    if chopper:
+        assert len(points) >= 3
+        # the mock's chopped B pulse is 1 V * chopper near the gate's center
+        assert 0.05 < np.mean([values[0] for elapsed, values in points]) < 0.1
+    else:
+        assert points == []
+        assert engine.instrumentation.counters["chunks unmodulated"] > 0
@@ -0,0 +1,103 @@
+import functools
+import threading
+
+import numpy as np
+import pytest
+
+from picotech_chart_engine import Engine, Gate, GateSet, Rejector
+from picotech_chart_mock import MockClient
+from picotech_chart_replay import Replay, main
+
+
+def record_chart(port, directory, nchunks, seconds=0.6):
+    factory = functools.partial(MockClient, shot_rate=20000, nshots=20, seed=0)
+    engine = Engine(port, client_factory=factory, record_directory=directory).connect()
+    gates = GateSet([Gate("s", "B", 30, 50), Gate("r", "A", 30, 50)], engine.channel_keys, engine.nsamples)
+    timer = threading.Timer(seconds, engine.stop)
+    timer.start()
+    elapsed = [point[0] for point in engine.chart(nchunks, gates, record=True)]
+    timer.cancel()
+    return directory / recorded_stem(directory), gates, elapsed
+
+
+def recorded_stem(directory):
+    return next(directory.glob("*_shots.npy")).name[: -len("_shots.npy")]
+
+
+def test_replay_matches_live_chart(port, tmp_path):
+    stem, gates, elapsed = record_chart(port, tmp_path, 3)
+    live = np.load(f"{stem}_chart.npy")
+    replay = Replay(stem)
+    assert replay.gates().names == gates.names
+    times, values = replay.chart(3, replay.gates(), Rejector(clip=True), block=4)
+    assert len(live) == len(elapsed)
+    assert len(times) >= len(live)
+    assert values[: len(live)] == pytest.approx(live["values"])
+    # same chart time axis as live, and the same wall-clock times in --output
+    assert times[: len(live)] == pytest.approx(elapsed, abs=1e-6)
+    main([str(stem), "--chunks", "3", "--output", str(tmp_path / "replayed.npy")])
+    assert np.load(tmp_path / "replayed.npy")["time"][: len(live)] == pytest.approx(live["time"], abs=1e-6)
+
+
+def test_replay_of_shot_cubes(tmp_path):
+    cubes = np.random.default_rng(4).normal(size=(12, 2, 5, 10))  # (measurement, channel, shot, sample)
+    np.save(tmp_path / "cubes.npy", cubes)
+    replay = Replay(tmp_path / "cubes.npy")
+    times, values = replay.chart(4, replay.gates([Gate("x", "B", 0, 10)]))
+    assert times.tolist() == [1.5, 5.5, 9.5]
+    assert values[:, 0] == pytest.approx(cubes[:, 1].reshape(3, -1).mean(axis=1))
+
+
+def test_replay_waterfall_recomputes(port, tmp_path):
+    stem, gates, elapsed = record_chart(port, tmp_path, 2)
+    replay = Replay(stem)
+    times, values = replay.chart(2, gates)
+    waterfall = replay.waterfall(2)
+    assert len(waterfall) == len(times)
+    assert waterfall.recompute(gates) == pytest.approx(values, abs=1e-6)
+
+
+def test_replay_follows_logged_changes(port, tmp_path):
+    factory = functools.partial(MockClient, shot_rate=20000, nshots=20, seed=0)
+    engine = Engine(port, client_factory=factory, record_directory=tmp_path).connect()
+    engine.range_debounce = 0.0
+    recorder = engine.open_recorder()
+    traces = np.zeros((len(engine.channel_keys), engine.nsamples))
+    for i in range(3):
+        recorder.record_shots(float(i), i, traces)
+    engine.request_range("B", "1 V")
+    engine.apply_pending()
+    engine.request_nshots(50)
+    engine.apply_pending()
+    traces[1] = 2.0  # beyond 1 V, well within the 5 V recorded at the start
+    for i in range(3, 5):
+        recorder.record_shots(float(i), i, traces)
+    engine.close_recorder()
+    replay = Replay(tmp_path / recorder.stem)
+    assert replay.metadata["changes"] == [{"chunk": 3, "ranges": {"B": "1 V"}}, {"chunk": 3, "nshots": 50}]
+    assert replay.limits()[:, 1].tolist() == [5, 5, 5, 1, 1]
+    assert replay.accepted(Rejector(clip=True)).tolist() == [True, True, True, False, False]
+
+
+def test_replay_matches_live_chart_with_rejections(port, tmp_path):
+    factory = functools.partial(MockClient, shot_rate=20000, nshots=20, seed=0)
+    engine = Engine(port, client_factory=factory, record_directory=tmp_path).connect()
+    engine.set_rejector(Rejector(zscore=0.5, clip=False, warmup=3, patience=3))
+    gates = GateSet([Gate("s", "B", 30, 50)], engine.channel_keys, engine.nsamples)
+    chunks = []
+
+    def callback(traces, stats):
+        chunks.append(None)
+        if len(chunks) == 60:
+            engine.request_nshots(40)
+        if len(chunks) == 200:
+            engine.stop()
+
+    live = [(datum.copy(), stats.count) for _, datum, stats in engine.chart(3, gates, record=True, callback=callback)]
+    assert min(count for _, count in live) < 3  # some points were charted short of chunks
+    replay = Replay(tmp_path / recorded_stem(tmp_path))
+    assert [change.get("nshots") for change in replay.metadata["changes"]] == [40]
+    times, values = replay.chart(3, gates, Rejector(zscore=0.5, clip=False, warmup=3, patience=3))
+    # the live chart may have been stopped just before charting a full last point
+    assert len(times) - len(live) in (0, 1)
+    assert values[: len(live)] == pytest.approx(np.array([datum for datum, _ in live]))
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from picotech_processing import Gate, GateSet, reject_outliers
+
+
+@pytest.fixture
+def traces():
+    rng = np.random.default_rng(0)
+    return rng.normal(size=(2, 20))  # (channel, sample)
+
+
+def test_mean_integral_peak(traces):
+    gates = GateSet(
+        [Gate("m", "A", 2, 6), Gate("i", "B", 0, 10, method="integral"), Gate("p", "B", 5, 15, method="peak")],
+        ["A", "B"],
+        20,
+        dt=0.5,
+    )
+    values = gates.compute(traces)
+    window = traces[1, 5:15]
+    assert values[0] == pytest.approx(traces[0, 2:6].mean())
+    assert values[1] == pytest.approx(traces[1, :10].sum() * 0.5)
+    assert values[2] == pytest.approx(window[np.argmax(np.abs(window))])
+
+
+def test_baseline_then_reference(traces):
+    gates = GateSet(
+        [
+            Gate("s", "B", 2, 6, baseline="b", reference="r"),
+            Gate("b", "B", 15, 20),
+            Gate("r", "A", 2, 6),
+        ],
+        ["A", "B"],
+        20,
+    )
+    s, b, r = traces[1, 2:6].mean(), traces[1, 15:20].mean(), traces[0, 2:6].mean()
+    assert gates.compute(traces) == pytest.approx([(s - b) / r, b, r])
+
+
+@pytest.mark.parametrize("role", ["baseline", "reference"])
+def test_unknown_gate_is_an_error(role):
+    with pytest.raises(ValueError, match="'gone'"):
+        GateSet([Gate("s", "B", 2, 6, **{role: "gone"}), Gate("b", "B", 15, 20)], ["A", "B"], 20)
+
+
+def test_compute_on_stacks(traces):
+    gates = GateSet([Gate("s", "B", 2, 6, baseline="b"), Gate("b", "A", 0, 4)], ["A", "B"], 20)
+    stack = np.stack([traces, 2 * traces, -traces])[:, None]  # (3, 1, channel, sample)
+    values = gates.compute(stack)
+    assert values.shape == (3, 1, 2)
+    for value, trace in zip(values[:, 0], stack[:, 0]):
+        assert value == pytest.approx(gates.compute(trace))
+
+
+def test_reject_outliers():
+    values = np.random.default_rng(1).normal(size=(100, 2))
+    values[7, 1] = 50.0
+    keep = reject_outliers(values, 5.0)
+    assert not keep[7]
+    assert keep.sum() >= 98